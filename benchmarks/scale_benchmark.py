@@ -0,0 +1,242 @@
+"""Measures how stickshift scales with the number of migrations in a repository.
+
+For every size a synthetic repository is generated with ``create_migration`` in a
+scratch directory, then listing, checksumming, planning and applying it are timed
+against a throwaway Postgres cluster created with ``initdb`` in a temporary directory
+and reachable only through a Unix socket. Results can be saved as a baseline and
+later runs compared against it:
+
+    python benchmarks/scale_benchmark.py --save benchmarks/baselines/scale.json
+    python benchmarks/scale_benchmark.py --compare benchmarks/baselines/scale.json
+
+``initdb`` refuses to run as root, and is looked up on the PATH, through ``pg_config``,
+or in ``--pg-bin``. ``--dsn`` benchmarks against an existing server instead, creating
+and dropping one database per size.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import contextlib
+import subprocess
+
+import natsort  # noqa: F401, imported up front so the first scan doesn't time the import
+
+ROOT_DIRECTORY = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, ROOT_DIRECTORY)
+
+from stickshift.migration_repository import MigrationRepository
+from stickshift.database_manager import DatabaseManager, TRANSACTION_MODES, TRANSACTION_MODE_BATCH
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 50000]
+DEFAULT_TOLERANCE = 0.25
+
+# Measures below this many seconds are too noisy to be compared with a baseline.
+COMPARE_MIN_SECONDS = 0.05
+
+# Every synthetic table receives this many migrations: a CREATE TABLE followed by
+# inserts, with a column added half way through.
+MIGRATIONS_PER_TABLE = 100
+
+MEASURES = ["generate", "scan_cold", "scan_warm", "checksums", "plan", "migrate", "migrate_noop"]
+
+BENCHMARK_USER = "stickshift"
+BENCHMARK_DATABASE = "stickshift_benchmark_{0}"
+
+
+def synthetic_migration(index):
+    table = "bench_{0}".format(index // MIGRATIONS_PER_TABLE)
+    position = index % MIGRATIONS_PER_TABLE
+    if position == 0:
+        return "create_table_{0}".format(table), "CREATE TABLE {0} (id INTEGER, name TEXT);".format(table)
+    if position == MIGRATIONS_PER_TABLE // 2:
+        return "alter_table_{0}".format(table), "ALTER TABLE {0} ADD COLUMN created_at TIMESTAMP;".format(table)
+    return "insert_{0}_{1}".format(table, position), \
+        "INSERT INTO {0} (id, name) VALUES ({1}, 'row {1}; of {0}');".format(table, index)
+
+
+def generate_repository(directory, size):
+    migration_repository = MigrationRepository(directory=directory)
+    migration_repository.create_repository()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for index in range(size):
+            name, contents = synthetic_migration(index)
+            migration_repository.create_migration(directory=migration_repository.repository_upgrade_path(),
+                                                  name=name,
+                                                  contents=contents,
+                                                  migration_index=index)
+    return migration_repository
+
+
+def find_pg_bin(pg_bin):
+    if pg_bin:
+        return pg_bin
+    initdb = shutil.which("initdb")
+    if initdb:
+        return os.path.dirname(initdb)
+    try:
+        return subprocess.check_output(["pg_config", "--bindir"]).decode("utf-8").strip()
+    except OSError:
+        raise RuntimeError("initdb was not found, pass --pg-bin or --dsn")
+
+
+class EphemeralPostgres(object):
+    """A Postgres cluster living in a temporary directory for as long as the benchmark runs."""
+
+    def __init__(self, pg_bin):
+        self.pg_bin = pg_bin
+        self.directory = tempfile.mkdtemp(prefix="stickshift-postgres-")
+        self.data_directory = os.path.join(self.directory, "data")
+        self.port = 5432
+
+    def command(self, name):
+        return os.path.join(self.pg_bin, name)
+
+    def start(self):
+        with open(os.devnull, "w") as devnull:
+            subprocess.check_call([self.command("initdb"), "-D", self.data_directory, "-U", BENCHMARK_USER,
+                                   "--auth=trust", "--no-sync"], stdout=devnull)
+            subprocess.check_call([self.command("pg_ctl"), "start", "-w", "-D", self.data_directory,
+                                   "-l", os.path.join(self.directory, "postgres.log"),
+                                   "-o", "-p {0} -k {1} -c listen_addresses='' -c fsync=off".format(
+                                       self.port, self.directory)], stdout=devnull)
+        return self
+
+    def stop(self):
+        with open(os.devnull, "w") as devnull:
+            subprocess.call([self.command("pg_ctl"), "stop", "-D", self.data_directory, "-m", "fast"],
+                            stdout=devnull)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def dsn(self):
+        return "host={0} port={1} user={2} dbname=postgres".format(self.directory, self.port, BENCHMARK_USER)
+
+
+def execute_admin(dsn, query):
+    import psycopg2
+    connection = psycopg2.connect(dsn)
+    try:
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(query)
+            return cursor.fetchone() if cursor.description else None
+    finally:
+        connection.close()
+
+
+def timed(operation):
+    started = time.time()
+    operation()
+    return time.time() - started
+
+
+def benchmark_size(dsn, size, transaction_mode):
+    import psycopg2.extensions
+    directory = tempfile.mkdtemp(prefix="stickshift-scale-")
+    database = BENCHMARK_DATABASE.format(size)
+    execute_admin(dsn, "DROP DATABASE IF EXISTS {0};".format(database))
+    execute_admin(dsn, "CREATE DATABASE {0};".format(database))
+    database_manager = None
+    try:
+        results = {}
+        results["generate"] = timed(lambda: generate_repository(directory, size))
+        # The manifest only trusts directories that were last modified a while before it was written.
+        settled = time.time() - 60
+        os.utime(MigrationRepository(directory=directory).repository_upgrade_path(), (settled, settled))
+
+        def scan():
+            MigrationRepository(directory=directory).current_migrations_list()
+
+        results["scan_cold"] = timed(scan)
+        results["scan_warm"] = timed(scan)
+        migration_repository = MigrationRepository(directory=directory)
+        results["checksums"] = timed(lambda: migration_repository.upgrade_index(checksums=True))
+
+        database_manager = DatabaseManager(migration_repository=migration_repository,
+                                           environment=None,
+                                           database_config={"dsn": psycopg2.extensions.make_dsn(dsn,
+                                                                                               dbname=database)},
+                                           output=lambda message: None)
+        database_manager.provision_database()
+        results["plan"] = timed(database_manager.plan_migrations)
+        results["migrate"] = timed(lambda: database_manager.migrate(transaction_mode=transaction_mode))
+        results["migrate_noop"] = timed(lambda: database_manager.migrate(transaction_mode=transaction_mode))
+        if database_manager.current_database_migration_version() != size - 1:
+            raise RuntimeError("{0} migrations were not all applied".format(size))
+        return results
+    finally:
+        if database_manager is not None:
+            database_manager.close()
+        execute_admin(dsn, "DROP DATABASE IF EXISTS {0};".format(database))
+        shutil.rmtree(directory)
+
+
+def compare_results(results, baseline, tolerance):
+    """Returns a description of every measure that got slower than the baseline allows."""
+    regressions = []
+    for size, measures in sorted(results.items(), key=lambda item: int(item[0])):
+        expected = baseline.get(size)
+        if expected is None:
+            continue
+        for measure in MEASURES:
+            if measure not in expected:
+                continue
+            limit = max(expected[measure], COMPARE_MIN_SECONDS) * (1 + tolerance)
+            if measures[measure] > limit:
+                regressions.append("{0} migrations {1} {2:.3f}s exceeds {3:.3f}s".format(
+                    size, measure, measures[measure], limit))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures how stickshift scales with the number of migrations.")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES),
+                        help="Comma separated repository sizes.")
+    parser.add_argument("--transaction", choices=TRANSACTION_MODES, default=TRANSACTION_MODE_BATCH,
+                        help="Transaction mode used to apply the migrations.")
+    parser.add_argument("--pg-bin", metavar="PATH", help="Directory holding initdb and pg_ctl.")
+    parser.add_argument("--dsn", help="Benchmarks against an existing server instead of a temporary one.")
+    parser.add_argument("--save", metavar="PATH", help="Writes the results to a baseline file.")
+    parser.add_argument("--compare", metavar="PATH", help="Fails if the results regress from a baseline file.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed slowdown relative to the baseline, 0.25 being 25%%.")
+    arguments = parser.parse_args()
+    sizes = [int(size) for size in arguments.sizes.split(",") if size.strip()]
+
+    postgres = None
+    dsn = arguments.dsn
+    if dsn is None:
+        postgres = EphemeralPostgres(find_pg_bin(arguments.pg_bin)).start()
+        dsn = postgres.dsn()
+    try:
+        server_version = execute_admin(dsn, "SHOW server_version;")[0]
+        results = {}
+        for size in sizes:
+            results[str(size)] = benchmark_size(dsn, size, arguments.transaction)
+            print("{0:>6} migrations  ".format(size) + "  ".join(
+                "{0} {1:.3f}s".format(measure, results[str(size)][measure]) for measure in MEASURES))
+    finally:
+        if postgres is not None:
+            postgres.stop()
+
+    if arguments.save:
+        with open(arguments.save, "w") as baseline_file:
+            json.dump({"python": sys.version.split()[0], "postgres": server_version,
+                       "transaction": arguments.transaction, "sizes": results},
+                      baseline_file, indent=2, sort_keys=True)
+
+    baseline = {}
+    if arguments.compare:
+        with open(arguments.compare, "r") as baseline_file:
+            baseline = json.load(baseline_file)["sizes"]
+    regressions = compare_results(results, baseline, arguments.tolerance)
+    for regression in regressions:
+        print(regression)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""Measures how long the stickshift command line takes to start for each command.
+
+Every command is run in a fresh interpreter with ``-X importtime`` inside a scratch
+migration repository, recording the wall time of the whole run and the time spent
+importing modules. Results can be saved as a baseline and later runs compared
+against it:
+
+    python benchmarks/startup_benchmark.py --save benchmarks/baselines/startup.json
+    python benchmarks/startup_benchmark.py --compare benchmarks/baselines/startup.json
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+
+ROOT_DIRECTORY = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+STARTUP_COMMANDS = [
+    ["--help"],
+    ["setup"],
+    ["clear"],
+    ["new", "migration", "benchmark"],
+    ["db", "--help"],
+    ["serve", "--help"],
+]
+
+# Modules that must never be imported by the commands above.
+STARTUP_FORBIDDEN_MODULES = ["psycopg2", "natsort", "multiprocessing", "gzip"]
+
+DEFAULT_REPEAT = 5
+DEFAULT_TOLERANCE = 0.25
+
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$")
+
+RUNNER = "import sys; sys.argv[0] = 'stickshift'; from stickshift.cli import cli; cli()"
+
+
+def command_name(command):
+    return " ".join(command)
+
+
+def run_command(command, directory):
+    """Runs a single command, returning its wall time and the self time of every imported module."""
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join([ROOT_DIRECTORY, environment.get("PYTHONPATH", "")])
+    started = time.time()
+    process = subprocess.Popen([sys.executable, "-X", "importtime", "-c", RUNNER] + command,
+                               cwd=directory, env=environment,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, stderr = process.communicate()
+    wall_time = time.time() - started
+    if process.returncode != 0:
+        raise RuntimeError("{0} exited with {1}:\n{2}".format(command_name(command), process.returncode,
+                                                               stderr.decode("utf-8", "replace")))
+
+    modules = {}
+    for line in stderr.decode("utf-8", "replace").splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match is not None:
+            modules[match.group(4)] = int(match.group(1))
+    return wall_time, modules
+
+
+def benchmark_command(command, repeat):
+    directory = tempfile.mkdtemp(prefix="stickshift-startup-")
+    try:
+        if command[0] not in ["setup", "--help"]:
+            run_command(["setup"], directory)
+        wall_times = []
+        import_times = []
+        modules = {}
+        for _ in range(repeat):
+            wall_time, modules = run_command(command, directory)
+            wall_times.append(wall_time)
+            import_times.append(sum(modules.values()) / 1000000.0)
+            if command[0] == "clear":
+                run_command(["setup"], directory)
+    finally:
+        shutil.rmtree(directory)
+
+    top_level = set(module.split(".")[0] for module in modules)
+    return {"wall_time": min(wall_times),
+            "import_time": min(import_times),
+            "modules": len(modules),
+            "forbidden": sorted(module for module in STARTUP_FORBIDDEN_MODULES if module in top_level)}
+
+
+def run_benchmark(repeat):
+    return dict((command_name(command), benchmark_command(command, repeat)) for command in STARTUP_COMMANDS)
+
+
+def compare_results(results, baseline, tolerance):
+    """Returns a description of every command that got slower than the baseline allows."""
+    regressions = []
+    for name, result in sorted(results.items()):
+        if result["forbidden"]:
+            regressions.append("{0} imports {1}".format(name, ", ".join(result["forbidden"])))
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        for measure in ["wall_time", "import_time"]:
+            limit = expected[measure] * (1 + tolerance)
+            if result[measure] > limit:
+                regressions.append("{0} {1} {2:.3f}s exceeds {3:.3f}s".format(name, measure, result[measure], limit))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the startup time of stickshift commands.")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--save", metavar="PATH", help="Writes the results to a baseline file.")
+    parser.add_argument("--compare", metavar="PATH", help="Fails if the results regress from a baseline file.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed slowdown relative to the baseline, 0.25 being 25%%.")
+    arguments = parser.parse_args()
+
+    results = run_benchmark(arguments.repeat)
+    for name, result in sorted(results.items()):
+        print("{0:<28} wall {1:.3f}s  imports {2:.3f}s  modules {3}".format(
+            name, result["wall_time"], result["import_time"], result["modules"]))
+
+    if arguments.save:
+        with open(arguments.save, "w") as baseline_file:
+            json.dump({"python": sys.version.split()[0], "commands": results}, baseline_file,
+                      indent=2, sort_keys=True)
+
+    baseline = {}
+    if arguments.compare:
+        with open(arguments.compare, "r") as baseline_file:
+            baseline = json.load(baseline_file)["commands"]
+    regressions = compare_results(results, baseline, arguments.tolerance)
+    for regression in regressions:
+        print(regression)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
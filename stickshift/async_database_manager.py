@@ -0,0 +1,714 @@
+import os
+import time
+import asyncio
+import hashlib
+import itertools
+import contextlib
+
+import psycopg2
+import psycopg2.extensions
+
+try:
+    from stickshift.migration_repository import find_migration_index, DB_GROUP_DEFAULT_CONCURRENCY
+    from stickshift.sql_script import ScriptReader, StatementLexer
+    from stickshift.copy_migration import is_copy_migration
+    from stickshift.backfill_migration import is_backfill_migration
+    from stickshift.fleet_manager import FleetTargetResult, FLEET_STATUS_MIGRATED, FLEET_STATUS_FAILED
+    from stickshift.database_engine import QUERY_CREATE_MIGRATION_TABLE, QUERY_UPGRADE_MIGRATION_TABLE, \
+        QUERY_DROP_MIGRATION_TABLE, QUERY_DATABASE_MIGRATIONS_TABLE_EXISTS, FEATURE_ASYNC, \
+        connection_arguments, engine_for
+    from stickshift.database_manager import (QUERY_DATABASE_CURRENT_VERSION,
+                                             QUERY_DATABASE_DELETE_MIGRATION, QUERY_SAVEPOINT_MIGRATION,
+                                             QUERY_RELEASE_AND_SAVEPOINT_MIGRATION,
+                                             QUERY_ROLLBACK_TO_SAVEPOINT_MIGRATION, TRANSACTION_MODE_SETTING,
+                                             TRANSACTION_MODE_NONE, TRANSACTION_MODE_SAVEPOINT, TRANSACTION_MODES,
+                                             STREAMING_THRESHOLD_SETTING, STREAMING_THRESHOLD_BYTES,
+                                             STREAMING_BATCH_BYTES, STREAMING_PROGRESS_INTERVAL,
+                                             LOCK_RETRY_BUDGET_SETTING, LOCK_RETRY_DEFAULT_BUDGET,
+                                             QUERY_SET_LOCAL_SETTING, QUERY_SET_SETTING, QUERY_RESET_TIMEOUTS,
+                                             QUERY_INVALID_INDEXES, QUERY_DROP_INDEX_CONCURRENTLY, QUERY_RESET_SESSION,
+                                             InvalidTransactionModeError,
+                                             create_bulk_insert_migrations_query, describe_statement_failure,
+                                             script_timeouts, is_non_transactional_script, quote_identifier,
+                                             is_lock_timeout, lock_retry_delay, print_output, baseline_versions,
+                                             MIGRATE_LOCK_WAIT_SETTING, MIGRATE_LOCK_DEFAULT_WAIT,
+                                             QUERY_TRY_MIGRATE_LOCK, QUERY_MIGRATE_LOCK, QUERY_MIGRATE_UNLOCK,
+                                             QUERY_DROP_VERSION_SIDE_TABLES, QUERY_INTERRUPTED_TABLE_EXISTS,
+                                             QUERY_INTERRUPTED_VERSIONS, MigrateLockTimeoutError)
+    from stickshift.script_directives import DIRECTIVE_TIMEOUTS, validate_timeout
+    from stickshift.schema_gate import QUERY_CREATE_FINGERPRINT_TABLE, QUERY_SCHEMA_FINGERPRINT, \
+        QUERY_SAVE_SCHEMA_FINGERPRINT, is_undefined_table
+    from stickshift.migration_planner import OUT_OF_ORDER_SETTING, OUT_OF_ORDER_WARN, OUT_OF_ORDER_ERROR, \
+        QUERY_DATABASE_APPLIED_VERSIONS, OutOfOrderMigrationError, validate_out_of_order_policy, plan_upgrade, \
+        plan_downgrade, describe_out_of_order
+except ImportError:
+    from migration_repository import find_migration_index, DB_GROUP_DEFAULT_CONCURRENCY
+    from sql_script import ScriptReader, StatementLexer
+    from copy_migration import is_copy_migration
+    from backfill_migration import is_backfill_migration
+    from fleet_manager import FleetTargetResult, FLEET_STATUS_MIGRATED, FLEET_STATUS_FAILED
+    from database_engine import QUERY_CREATE_MIGRATION_TABLE, QUERY_UPGRADE_MIGRATION_TABLE, \
+        QUERY_DROP_MIGRATION_TABLE, QUERY_DATABASE_MIGRATIONS_TABLE_EXISTS, FEATURE_ASYNC, \
+        connection_arguments, engine_for
+    from database_manager import (QUERY_DATABASE_CURRENT_VERSION,
+                                  QUERY_DATABASE_DELETE_MIGRATION, QUERY_SAVEPOINT_MIGRATION,
+                                  QUERY_RELEASE_AND_SAVEPOINT_MIGRATION,
+                                  QUERY_ROLLBACK_TO_SAVEPOINT_MIGRATION, TRANSACTION_MODE_SETTING,
+                                  TRANSACTION_MODE_NONE, TRANSACTION_MODE_SAVEPOINT, TRANSACTION_MODES,
+                                  STREAMING_THRESHOLD_SETTING, STREAMING_THRESHOLD_BYTES,
+                                  STREAMING_BATCH_BYTES, STREAMING_PROGRESS_INTERVAL,
+                                  LOCK_RETRY_BUDGET_SETTING, LOCK_RETRY_DEFAULT_BUDGET,
+                                  QUERY_SET_LOCAL_SETTING, QUERY_SET_SETTING, QUERY_RESET_TIMEOUTS,
+                                  QUERY_INVALID_INDEXES, QUERY_DROP_INDEX_CONCURRENTLY, QUERY_RESET_SESSION,
+                                  InvalidTransactionModeError,
+                                  create_bulk_insert_migrations_query, describe_statement_failure,
+                                  script_timeouts, is_non_transactional_script, quote_identifier,
+                                  is_lock_timeout, lock_retry_delay, print_output, baseline_versions,
+                                  MIGRATE_LOCK_WAIT_SETTING, MIGRATE_LOCK_DEFAULT_WAIT,
+                                  QUERY_TRY_MIGRATE_LOCK, QUERY_MIGRATE_LOCK, QUERY_MIGRATE_UNLOCK,
+                                  QUERY_DROP_VERSION_SIDE_TABLES, QUERY_INTERRUPTED_TABLE_EXISTS,
+                                  QUERY_INTERRUPTED_VERSIONS, MigrateLockTimeoutError)
+    from script_directives import DIRECTIVE_TIMEOUTS, validate_timeout
+    from schema_gate import QUERY_CREATE_FINGERPRINT_TABLE, QUERY_SCHEMA_FINGERPRINT, \
+        QUERY_SAVE_SCHEMA_FINGERPRINT, is_undefined_table
+    from migration_planner import OUT_OF_ORDER_SETTING, OUT_OF_ORDER_WARN, OUT_OF_ORDER_ERROR, \
+        QUERY_DATABASE_APPLIED_VERSIONS, OutOfOrderMigrationError, validate_out_of_order_policy, plan_upgrade, \
+        plan_downgrade, describe_out_of_order
+
+ASYNC_POOL_DEFAULT_SIZE = 1
+
+QUERY_BEGIN = "BEGIN;"
+QUERY_COMMIT = "COMMIT;"
+QUERY_ROLLBACK = "ROLLBACK;"
+
+QUERY_SET_LOCAL_DEFAULT = "SET LOCAL {0} TO DEFAULT;"
+
+
+class UnsupportedMigrationError(Exception):
+    pass
+
+
+async def wait_for_connection(connection):
+    """Polls a non-blocking psycopg2 connection until its current operation completes."""
+    loop = asyncio.get_event_loop()
+    while True:
+        state = connection.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            return
+        ready = loop.create_future()
+        file_descriptor = connection.fileno()
+        if state == psycopg2.extensions.POLL_READ:
+            loop.add_reader(file_descriptor, ready.set_result, None)
+            try:
+                await ready
+            finally:
+                loop.remove_reader(file_descriptor)
+        elif state == psycopg2.extensions.POLL_WRITE:
+            loop.add_writer(file_descriptor, ready.set_result, None)
+            try:
+                await ready
+            finally:
+                loop.remove_writer(file_descriptor)
+        else:
+            raise psycopg2.OperationalError("Unexpected poll state {0}".format(state))
+
+
+class AsyncConnection(object):
+    """A non-blocking connection to a single database.
+
+    Non-blocking connections are always in autocommit mode, so transactions are
+    opened and closed with explicit ``BEGIN`` and ``COMMIT`` queries.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    @classmethod
+    async def connect(cls, database_config):
+        connection = psycopg2.connect(async_=True, **connection_arguments(database_config))
+        try:
+            await wait_for_connection(connection)
+        except Exception:
+            connection.close()
+            raise
+        return cls(connection)
+
+    @property
+    def closed(self):
+        return bool(self.connection.closed)
+
+    def in_transaction(self):
+        return self.connection.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    async def execute(self, query, parameters=None):
+        """Executes the query and returns its rows, or None if it returns no rows."""
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(query, parameters)
+            await wait_for_connection(self.connection)
+            return cursor.fetchall() if cursor.description is not None else None
+        finally:
+            cursor.close()
+
+    async def fetch(self, query):
+        return [row[0] for row in await self.execute(query)]
+
+    def close(self):
+        self.connection.close()
+
+
+class AsyncConnectionPool(object):
+    """A bounded pool of non-blocking connections to a single environment, opened on demand."""
+
+    def __init__(self, database_config, size=ASYNC_POOL_DEFAULT_SIZE):
+        self.database_config = database_config
+        self.size = size
+        self.idle = []
+        self.slots = None
+
+    async def acquire(self):
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.size)
+        await self.slots.acquire()
+        try:
+            while self.idle:
+                connection = self.idle.pop()
+                if not connection.closed:
+                    return connection
+            return await AsyncConnection.connect(self.database_config)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, connection):
+        if connection.closed or connection.in_transaction():
+            connection.close()
+        else:
+            self.idle.append(connection)
+        self.slots.release()
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        connection = await self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self):
+        for connection in self.idle:
+            connection.close()
+        self.idle = []
+
+
+class AsyncDatabaseManager(object):
+    """asyncio counterpart of ``DatabaseManager`` built on non-blocking connections.
+
+    Every operation borrows a connection from ``pool`` for as long as it runs, so
+    one pool can be shared by several managers of the same environment.
+    """
+
+    def __init__(self, migration_repository, environment, database_config=None, pool=None, output=None):
+        self.migration_repository = migration_repository
+        self.environment = environment
+        self.output = output or print_output
+        if database_config is None:
+            database_config = migration_repository.database_config(self.environment)
+        self.database_config = database_config
+        engine_for(database_config).require(FEATURE_ASYNC)
+        self.transaction_mode = migration_repository.environment_setting(environment,
+                                                                         TRANSACTION_MODE_SETTING,
+                                                                         TRANSACTION_MODE_NONE)
+        self.out_of_order = migration_repository.environment_setting(environment,
+                                                                     OUT_OF_ORDER_SETTING,
+                                                                     OUT_OF_ORDER_WARN)
+        self.streaming_threshold = int(migration_repository.environment_setting(environment,
+                                                                                STREAMING_THRESHOLD_SETTING,
+                                                                                STREAMING_THRESHOLD_BYTES))
+        self.timeouts = dict((setting, migration_repository.environment_setting(environment, setting))
+                             for setting in DIRECTIVE_TIMEOUTS)
+        for setting, value in self.timeouts.items():
+            if value is not None:
+                validate_timeout(setting, value)
+        self.lock_retry_budget = float(migration_repository.environment_setting(environment,
+                                                                                LOCK_RETRY_BUDGET_SETTING,
+                                                                                LOCK_RETRY_DEFAULT_BUDGET))
+        self.migrate_lock_wait = float(migration_repository.environment_setting(environment,
+                                                                                MIGRATE_LOCK_WAIT_SETTING,
+                                                                                MIGRATE_LOCK_DEFAULT_WAIT))
+        self.owns_pool = pool is None
+        self.pool = pool or AsyncConnectionPool(database_config)
+        self.version_table_upgraded = False
+        # See DatabaseManager.started_migrations.
+        self.started_migrations = 0
+
+    def close(self):
+        if self.owns_pool:
+            self.pool.close()
+
+    async def provision_database(self):
+        async with self.pool.connection() as connection:
+            if await self.is_provisioned(connection):
+                await self.upgrade_version_table(connection)
+                return False
+            await connection.execute(QUERY_CREATE_MIGRATION_TABLE)
+            return True
+
+    async def deprovision_database(self):
+        async with self.pool.connection() as connection:
+            if not await self.is_provisioned(connection):
+                return False
+            await connection.execute(QUERY_DROP_MIGRATION_TABLE)
+            for query in QUERY_DROP_VERSION_SIDE_TABLES:
+                await connection.execute(query)
+            return True
+
+    async def is_database_provisioned(self):
+        async with self.pool.connection() as connection:
+            return await self.is_provisioned(connection)
+
+    async def current_database_migration_version(self):
+        async with self.pool.connection() as connection:
+            return await self.current_version(connection)
+
+    async def is_provisioned(self, connection):
+        return (await connection.fetch(QUERY_DATABASE_MIGRATIONS_TABLE_EXISTS))[0]
+
+    async def current_version(self, connection):
+        return (await connection.fetch(QUERY_DATABASE_CURRENT_VERSION))[0]
+
+    async def upgrade_version_table(self, connection):
+        if not self.version_table_upgraded:
+            await connection.execute(QUERY_UPGRADE_MIGRATION_TABLE)
+            self.version_table_upgraded = True
+
+    async def upgrade_plan(self, connection, out_of_order=None):
+        """See ``DatabaseManager.upgrade_plan``."""
+        upgrade_index = self.migration_repository.upgrade_index()
+        applied_versions = await connection.fetch(QUERY_DATABASE_APPLIED_VERSIONS)
+        plan = plan_upgrade(upgrade_index=upgrade_index,
+                            applied_versions=applied_versions,
+                            policy=out_of_order or self.out_of_order)
+        if plan.out_of_order:
+            interrupted_versions = await self.interrupted_versions(connection)
+            if interrupted_versions:
+                plan = plan_upgrade(upgrade_index=upgrade_index,
+                                    applied_versions=applied_versions,
+                                    policy=out_of_order or self.out_of_order,
+                                    interrupted_versions=interrupted_versions)
+        return plan
+
+    async def interrupted_versions(self, connection):
+        """Returns the versions a failed parallel migrate left unrecorded."""
+        if not (await connection.fetch(QUERY_INTERRUPTED_TABLE_EXISTS))[0]:
+            return []
+        return await connection.fetch(QUERY_INTERRUPTED_VERSIONS)
+
+    async def pending_migrations(self, connection, out_of_order=None):
+        return (await self.upgrade_plan(connection, out_of_order=out_of_order)).pending
+
+    async def checked_upgrade_plan(self, connection, out_of_order=None):
+        """See ``DatabaseManager.checked_upgrade_plan``."""
+        plan = await self.upgrade_plan(connection, out_of_order=out_of_order)
+        if plan.out_of_order:
+            if plan.policy == OUT_OF_ORDER_ERROR:
+                raise OutOfOrderMigrationError(describe_out_of_order(plan))
+            self.output("{0}, {1}".format(describe_out_of_order(plan), "skipped" if plan.skipped() else "applying"))
+        return plan
+
+    async def applied_downgrades(self, connection):
+        applied_versions = await connection.fetch(QUERY_DATABASE_APPLIED_VERSIONS)
+        if not applied_versions:
+            return None
+        return plan_downgrade(self.migration_repository.downgrade_index(), applied_versions)
+
+    async def migrate(self, transaction_mode=None, out_of_order=None):
+        transaction_mode = transaction_mode or self.transaction_mode
+        if transaction_mode not in TRANSACTION_MODES:
+            raise InvalidTransactionModeError("{0} is not a valid transaction mode, expected one of: {1}".format(
+                transaction_mode, ", ".join(TRANSACTION_MODES)))
+        out_of_order = validate_out_of_order_policy(out_of_order or self.out_of_order)
+
+        async with self.pool.connection() as connection:
+            # See DatabaseManager.migrate, an up to date database is left alone without waiting for the lock.
+            plan = await self.upgrade_plan(connection, out_of_order=out_of_order)
+            if plan.newest_version is not None and not plan.out_of_order and not plan.pending:
+                if not plan.unknown:
+                    await self.record_fingerprint(connection, plan=plan, only_if_changed=True)
+                return []
+            async with self.migrate_lock(connection):
+                await self.apply_baseline(connection)
+                migration_list = (await self.checked_upgrade_plan(connection, out_of_order=out_of_order)).pending
+                if migration_list:
+                    await self.upgrade_version_table(connection)
+                if transaction_mode == TRANSACTION_MODE_NONE:
+                    for migration_file_name in migration_list:
+                        await self.execute_migration(connection, migration_file_name)
+                else:
+                    for transactional, segment in itertools.groupby(migration_list, key=lambda migration_file_name:
+                                                                    not self.is_non_transactional(migration_file_name)):
+                        segment = list(segment)
+                        if not transactional:
+                            for migration_file_name in segment:
+                                await self.execute_migration(connection, migration_file_name)
+                            continue
+
+                        async def apply_batch(attempt, segment=segment):
+                            batch = segment
+                            if attempt > 0:
+                                pending = set(await self.pending_migrations(connection, out_of_order=out_of_order))
+                                batch = [migration_file_name for migration_file_name in segment
+                                         if migration_file_name in pending]
+                            await self.execute_migration_batch(
+                                connection,
+                                migration_list=batch,
+                                savepoints=transaction_mode == TRANSACTION_MODE_SAVEPOINT)
+                        await self.with_lock_retry(apply_batch, "batch of {0} migrations".format(len(segment)))
+        return migration_list
+
+    async def apply_baseline(self, connection):
+        """Applies the latest baseline to a database without any migrations, see ``DatabaseManager.apply_baseline``."""
+        baseline = self.migration_repository.latest_baseline()
+        if baseline is None or await self.current_version(connection) is not None:
+            return None
+        baseline_version, baseline_file_name = baseline
+        path = self.migration_repository.repository_baseline_path() + "/" + baseline_file_name
+        covered = baseline_versions(self.migration_repository, baseline_version)
+        await self.upgrade_version_table(connection)
+        self.started_migrations += 1
+        await connection.execute(QUERY_BEGIN)
+        try:
+            with open(path, "rb") as script_file:
+                if os.path.getsize(path) < self.streaming_threshold:
+                    await connection.execute(script_file.read().decode("utf-8"))
+                else:
+                    await self.execute_streamed_script(connection, ScriptReader(script_file), baseline_file_name)
+            await connection.execute(QUERY_RESET_SESSION)
+            if covered:
+                await connection.execute(create_bulk_insert_migrations_query(covered))
+            await connection.execute(QUERY_COMMIT)
+        except Exception:
+            await self.rollback(connection)
+            raise
+        self.output("Baseline:{0} completed, {1} migrations recorded".format(baseline_file_name, len(covered)))
+        return baseline_file_name
+
+    async def upgrade(self, out_of_order=None):
+        async with self.pool.connection() as connection, self.migrate_lock(connection):
+            migration_list = (await self.checked_upgrade_plan(connection, out_of_order=out_of_order)).pending
+            next_migration = migration_list[0]
+            await self.upgrade_version_table(connection)
+            await self.execute_migration(connection, next_migration)
+
+    async def reset(self):
+        async with self.pool.connection() as connection, self.migrate_lock(connection):
+            downgrade_list = await self.applied_downgrades(connection)
+            if downgrade_list is None:
+                return
+            for migration_file_name in downgrade_list:
+                await self.execute_downgrade(connection, migration_file_name)
+
+    async def downgrade(self):
+        async with self.pool.connection() as connection, self.migrate_lock(connection):
+            downgrade_list = await self.applied_downgrades(connection)
+            if not downgrade_list:
+                return False
+            await self.execute_downgrade(connection, downgrade_list[0])
+            return True
+
+    @contextlib.asynccontextmanager
+    async def migrate_lock(self, connection):
+        """Holds the migrate lock of the database, recording its fingerprint before releasing it if anything changed.
+
+        See ``DatabaseManager.with_migrate_lock``.
+        """
+        if not (await connection.fetch(QUERY_TRY_MIGRATE_LOCK))[0]:
+            self.output("Database:{0} is being migrated by another process, waiting for it to finish".format(
+                self.environment))
+            await connection.execute(QUERY_BEGIN)
+            try:
+                await connection.execute(QUERY_SET_LOCAL_SETTING.format(
+                    "lock_timeout", "{0}ms".format(int(self.migrate_lock_wait * 1000))))
+                await connection.execute(QUERY_MIGRATE_LOCK)
+                await connection.execute(QUERY_COMMIT)
+            except Exception as error:
+                await self.rollback(connection)
+                if is_lock_timeout(error):
+                    raise MigrateLockTimeoutError("Database:{0} is still being migrated by another process after "
+                                                  "{1:g}s".format(self.environment, self.migrate_lock_wait))
+                raise
+        started_migrations = self.started_migrations
+        try:
+            try:
+                yield
+            except Exception:
+                try:
+                    await self.record_fingerprint(connection)
+                except Exception:
+                    pass
+                raise
+            if self.started_migrations != started_migrations:
+                await self.record_fingerprint(connection)
+        finally:
+            if not connection.closed:
+                await connection.execute(QUERY_MIGRATE_UNLOCK)
+
+    async def record_fingerprint(self, connection, plan=None, only_if_changed=False):
+        """See ``DatabaseManager.record_fingerprint``."""
+        await self.rollback(connection)
+        if plan is None:
+            if not await self.is_provisioned(connection):
+                return
+            plan = await self.upgrade_plan(connection)
+        fingerprint = None
+        if not plan.pending and not plan.out_of_order and not plan.unknown:
+            # Hashing any changed files blocks, so it is kept off the event loop.
+            fingerprint = await asyncio.get_event_loop().run_in_executor(None, self.migration_repository.fingerprint)
+        if only_if_changed and await self.recorded_fingerprint(connection) == (fingerprint, plan.newest_version):
+            return
+        await connection.execute(QUERY_CREATE_FINGERPRINT_TABLE)
+        await connection.execute(QUERY_SAVE_SCHEMA_FINGERPRINT, (fingerprint, plan.newest_version))
+
+    async def recorded_fingerprint(self, connection):
+        try:
+            rows = await connection.execute(QUERY_SCHEMA_FINGERPRINT)
+        except Exception as error:
+            if not is_undefined_table(error):
+                raise
+            return None
+        return tuple(rows[0]) if rows else None
+
+    def upgrade_script_path(self, migration_file_name):
+        return self.migration_repository.repository_upgrade_path() + "/" + migration_file_name
+
+    def is_non_transactional(self, migration_file_name):
+        return is_non_transactional_script(self.upgrade_script_path(migration_file_name))
+
+    async def with_lock_retry(self, operation, description):
+        """Awaits the operation, again while it fails to acquire a lock within the retry budget."""
+        start = time.time()
+        attempt = 0
+        while True:
+            try:
+                return await operation(attempt)
+            except Exception as error:
+                if not is_lock_timeout(error):
+                    raise
+                delay = lock_retry_delay(attempt)
+                if time.time() - start + delay > self.lock_retry_budget:
+                    raise
+                attempt += 1
+                self.output("Migration:{0} lock not available, retrying in {1:.2f}s (attempt {2})".format(
+                    description, delay, attempt + 1))
+                await asyncio.sleep(delay)
+
+    async def execute_upgrade_script(self, connection, migration_file_name):
+        """Executes an upgrade script inside the open transaction and returns its checksum."""
+        if is_copy_migration(migration_file_name):
+            raise UnsupportedMigrationError("{0} is a copy migration, which non-blocking connections "
+                                            "cannot run".format(migration_file_name))
+        if is_backfill_migration(migration_file_name):
+            raise UnsupportedMigrationError("{0} is a backfill migration, which non-blocking connections "
+                                            "cannot run".format(migration_file_name))
+        path = self.upgrade_script_path(migration_file_name)
+        # Every timeout is set, or set back to its default, so none carries over from an
+        # earlier migration of the same batch.
+        await connection.execute("".join(QUERY_SET_LOCAL_SETTING.format(setting, value) if value is not None
+                                         else QUERY_SET_LOCAL_DEFAULT.format(setting)
+                                         for setting, value in script_timeouts(self.timeouts, path).items()))
+        with open(path, "rb") as script_file:
+            if os.path.getsize(path) < self.streaming_threshold:
+                contents = script_file.read()
+                await connection.execute(contents.decode("utf-8"))
+                return hashlib.sha256(contents).hexdigest()
+            reader = ScriptReader(script_file)
+            await self.execute_streamed_script(connection, reader, migration_file_name)
+        return reader.checksum()
+
+    async def execute_streamed_script(self, connection, reader, migration_file_name):
+        statement_count = 0
+        last_progress = time.time()
+        batch = []
+        batch_length = 0
+        for statement in StatementLexer(reader.read):
+            batch.append(statement)
+            batch_length += len(statement)
+            if batch_length >= STREAMING_BATCH_BYTES:
+                await self.execute_statement_batch(connection, migration_file_name, batch, statement_count)
+                statement_count += len(batch)
+                batch = []
+                batch_length = 0
+                if time.time() - last_progress >= STREAMING_PROGRESS_INTERVAL:
+                    self.output("Migration:{0} {1} statements, {2} bytes".format(
+                        migration_file_name, statement_count, reader.bytes_read))
+                    last_progress = time.time()
+        if batch:
+            await self.execute_statement_batch(connection, migration_file_name, batch, statement_count)
+            statement_count += len(batch)
+        self.output("Migration:{0} {1} statements executed".format(migration_file_name, statement_count))
+
+    async def execute_statement_batch(self, connection, migration_file_name, batch, first_statement):
+        try:
+            await connection.execute("".join(batch))
+        except psycopg2.Error as error:
+            self.output(describe_statement_failure(migration_file_name, batch, first_statement, error))
+            raise
+
+    async def execute_migration(self, connection, migration_file_name):
+        self.started_migrations += 1
+        await self.with_lock_retry(lambda attempt: self.execute_migration_attempt(connection, migration_file_name),
+                                   migration_file_name)
+        self.output("Migration:{0} completed".format(migration_file_name))
+
+    async def execute_migration_attempt(self, connection, migration_file_name):
+        if self.is_non_transactional(migration_file_name):
+            checksum = await self.execute_non_transactional_script(connection,
+                                                                   self.upgrade_script_path(migration_file_name),
+                                                                   migration_file_name)
+            await connection.execute(create_bulk_insert_migrations_query(
+                [(int(find_migration_index(migration_file_name)), checksum)]))
+            return
+        await connection.execute(QUERY_BEGIN)
+        try:
+            checksum = await self.execute_upgrade_script(connection, migration_file_name)
+            await connection.execute(create_bulk_insert_migrations_query(
+                [(int(find_migration_index(migration_file_name)), checksum)]))
+            await connection.execute(QUERY_COMMIT)
+        except Exception:
+            await self.rollback(connection)
+            raise
+
+    async def execute_migration_batch(self, connection, migration_list=None, savepoints=False):
+        """Applies every migration in one transaction, see ``DatabaseManager.execute_migration_batch``."""
+        if not migration_list:
+            return
+        self.started_migrations += len(migration_list)
+        applied = []
+        await connection.execute(QUERY_BEGIN)
+        try:
+            for migration_file_name in migration_list:
+                if savepoints:
+                    await connection.execute(QUERY_RELEASE_AND_SAVEPOINT_MIGRATION if applied
+                                             else QUERY_SAVEPOINT_MIGRATION)
+                try:
+                    checksum = await self.execute_upgrade_script(connection, migration_file_name)
+                except Exception:
+                    if savepoints:
+                        await connection.execute(QUERY_ROLLBACK_TO_SAVEPOINT_MIGRATION)
+                        await self.commit_migration_batch(connection, applied)
+                    raise
+                applied.append((migration_file_name, checksum))
+            await self.commit_migration_batch(connection, applied)
+        except Exception:
+            await self.rollback(connection)
+            raise
+
+    async def commit_migration_batch(self, connection, applied):
+        if applied:
+            await connection.execute(create_bulk_insert_migrations_query(
+                [(int(find_migration_index(migration_file_name)), checksum) for migration_file_name, checksum in applied]))
+        await connection.execute(QUERY_COMMIT)
+        for migration_file_name, checksum in applied:
+            self.output("Migration:{0} completed".format(migration_file_name))
+
+    async def execute_non_transactional_script(self, connection, path, migration_file_name):
+        """Executes every statement of a script on its own, see ``DatabaseManager.execute_non_transactional_script``."""
+        timeouts = [(setting, value) for setting, value in script_timeouts(self.timeouts, path).items()
+                    if value is not None]
+        for setting, value in timeouts:
+            await connection.execute(QUERY_SET_SETTING.format(setting, value))
+        try:
+            invalid_indexes = set(await self.invalid_indexes(connection))
+            with open(path, "rb") as script_file:
+                reader = ScriptReader(script_file)
+                for idx, statement in enumerate(StatementLexer(reader.read)):
+                    await self.with_lock_retry(lambda attempt: self.execute_non_transactional_statement(
+                        connection, migration_file_name, statement, idx, invalid_indexes),
+                        "{0} statement {1}".format(migration_file_name, idx + 1))
+        finally:
+            if timeouts and not connection.closed:
+                await connection.execute(QUERY_RESET_TIMEOUTS)
+        return reader.checksum()
+
+    async def execute_non_transactional_statement(self, connection, migration_file_name, statement, statement_index,
+                                                  invalid_indexes):
+        try:
+            await connection.execute(statement)
+        except Exception:
+            self.output("Migration:{0} failed at statement {1}".format(migration_file_name, statement_index + 1))
+            for schema, name in await self.invalid_indexes(connection):
+                if (schema, name) not in invalid_indexes:
+                    await connection.execute(QUERY_DROP_INDEX_CONCURRENTLY.format(quote_identifier(schema),
+                                                                                  quote_identifier(name)))
+                    self.output("Migration:{0} dropped invalid index {1}.{2}".format(migration_file_name, schema, name))
+            raise
+
+    async def invalid_indexes(self, connection):
+        return [(schema, name) for schema, name in await connection.execute(QUERY_INVALID_INDEXES)]
+
+    async def execute_downgrade(self, connection, migration_file_name):
+        self.started_migrations += 1
+        path = self.migration_repository.repository_downgrade_path() + "/" + migration_file_name
+        if is_non_transactional_script(path):
+            await self.execute_non_transactional_script(connection, path, migration_file_name)
+            await connection.execute(QUERY_DATABASE_DELETE_MIGRATION.format(find_migration_index(migration_file_name)))
+            self.output("Downgrade:{0} completed".format(migration_file_name))
+            return
+        with open(path, "r") as script_file:
+            script = script_file.read()
+        await connection.execute(QUERY_BEGIN)
+        try:
+            await connection.execute(script)
+            await connection.execute(QUERY_DATABASE_DELETE_MIGRATION.format(find_migration_index(migration_file_name)))
+            await connection.execute(QUERY_COMMIT)
+        except Exception:
+            await self.rollback(connection)
+            raise
+        self.output("Downgrade:{0} completed".format(migration_file_name))
+
+    async def rollback(self, connection):
+        if not connection.closed and connection.in_transaction():
+            try:
+                await connection.execute(QUERY_ROLLBACK)
+            except psycopg2.Error:
+                connection.close()
+
+
+async def migrate_targets(migration_repository, targets, concurrency=DB_GROUP_DEFAULT_CONCURRENCY,
+                          transaction_mode=None, out_of_order=None, output=None):
+    """Migrates every target from a single event loop, at most ``concurrency`` at a time.
+
+    Targets are environment names or DSNs, and each one is migrated over its own
+    connection which is closed as soon as it is done. Returns a ``FleetTargetResult``
+    for every target, in the order given.
+    """
+    slots = asyncio.Semaphore(max(1, concurrency))
+
+    async def migrate_target(target):
+        async with slots:
+            start = time.time()
+            database_manager = None
+            try:
+                database_manager = AsyncDatabaseManager(
+                    migration_repository=migration_repository,
+                    environment=target,
+                    database_config=migration_repository.target_database_config(target),
+                    output=output)
+                migrations = await database_manager.migrate(transaction_mode=transaction_mode,
+                                                             out_of_order=out_of_order)
+                return FleetTargetResult(target=target,
+                                         status=FLEET_STATUS_MIGRATED,
+                                         migrations=migrations,
+                                         duration=time.time() - start)
+            except Exception as error:
+                return FleetTargetResult(target=target,
+                                         status=FLEET_STATUS_FAILED,
+                                         error=error,
+                                         duration=time.time() - start)
+            finally:
+                if database_manager is not None:
+                    database_manager.close()
+
+    # List the repository once up front instead of once per target.
+    migration_repository.upgrade_index()
+    return list(await asyncio.gather(*[migrate_target(target) for target in targets]))
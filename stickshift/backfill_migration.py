@@ -0,0 +1,144 @@
+import sys
+import hashlib
+
+python_version = sys.version_info.major
+if python_version == 3:
+    from configparser import RawConfigParser
+else:
+    from ConfigParser import RawConfigParser
+
+BACKFILL_MIGRATION_EXTENSION = ".backfill"
+
+BACKFILL_DEFAULT_BATCH_SIZE = 1000
+BACKFILL_DEFAULT_TARGET_SECONDS = 0.5
+
+# A batch grows or shrinks by at most this factor at a time, so a single slow or fast
+# batch can't swing its size too far.
+BACKFILL_MAX_RESIZE = 2.0
+
+# The largest batch, relative to the declared batch size, unless one is declared.
+BACKFILL_MAX_BATCH_FACTOR = 10
+
+BACKFILL_MIGRATION_TEMPLATE = "[{0}]" \
+                              "\nkey: id" \
+                              "\nbatch_size: 1000" \
+                              "\nsql: UPDATE {0} SET column = value WHERE id BETWEEN %(start)s AND %(end)s\n"
+
+QUERY_CREATE_BACKFILL_PROGRESS_TABLE = 'CREATE TABLE IF NOT EXISTS "version_migration_backfill" ' \
+                                       '(version INTEGER, target TEXT, last_key TEXT, rows BIGINT, ' \
+                                       'finished BOOLEAN DEFAULT FALSE, ' \
+                                       'updated_at INTEGER DEFAULT EXTRACT(EPOCH FROM CURRENT_TIMESTAMP), ' \
+                                       'PRIMARY KEY (version, target));'
+
+QUERY_DROP_BACKFILL_PROGRESS_TABLE = 'DROP TABLE IF EXISTS "version_migration_backfill";'
+
+QUERY_BACKFILL_PROGRESS = "SELECT target, last_key, rows, finished FROM version_migration_backfill WHERE version = %s;"
+
+QUERY_SAVE_BACKFILL_PROGRESS = "INSERT INTO version_migration_backfill (version, target, last_key, rows, finished) " \
+                               "VALUES (%s, %s, %s, %s, %s) " \
+                               "ON CONFLICT (version, target) DO UPDATE SET last_key = EXCLUDED.last_key, " \
+                               "rows = EXCLUDED.rows, finished = EXCLUDED.finished, " \
+                               "updated_at = EXTRACT(EPOCH FROM CURRENT_TIMESTAMP);"
+
+# Appended to the query recording the version, so progress is only forgotten along with it.
+QUERY_DELETE_BACKFILL_PROGRESS = "\n;DELETE FROM version_migration_backfill WHERE version = {0};"
+
+# The first and last key of the next batch. The keys are only read by the server, walking
+# the index of the key column from the last key of the previous batch.
+QUERY_BACKFILL_FIRST_RANGE = "SELECT MIN({0}), MAX({0}) FROM (SELECT {0} FROM {1} ORDER BY {0} LIMIT %s) batch;"
+QUERY_BACKFILL_NEXT_RANGE = "SELECT MIN({0}), MAX({0}) FROM (SELECT {0} FROM {1} WHERE {0} > %s " \
+                            "ORDER BY {0} LIMIT %s) batch;"
+
+
+def is_backfill_migration(migration_file_name):
+    return migration_file_name.endswith(BACKFILL_MIGRATION_EXTENSION)
+
+
+class InvalidBackfillMigrationError(Exception):
+    pass
+
+
+class BackfillTarget(object):
+    """A table walked in batches of key ranges, running the same SQL over each range.
+
+    ``sql`` refers to the first and last key of the range, both included, as
+    ``%(start)s`` and ``%(end)s``.
+    """
+
+    def __init__(self, table, key, sql, batch_size=BACKFILL_DEFAULT_BATCH_SIZE, max_batch_size=None,
+                 target_seconds=BACKFILL_DEFAULT_TARGET_SECONDS, sleep=0.0):
+        self.table = table
+        self.key = key
+        self.sql = sql
+        self.batch_size = batch_size
+        self.max_batch_size = max_batch_size or batch_size * BACKFILL_MAX_BATCH_FACTOR
+        self.target_seconds = target_seconds
+        self.sleep = sleep
+
+    def range_query(self, last_key):
+        if last_key is None:
+            return QUERY_BACKFILL_FIRST_RANGE.format(self.key, self.table)
+        return QUERY_BACKFILL_NEXT_RANGE.format(self.key, self.table)
+
+    def range_parameters(self, last_key, batch_size):
+        return (batch_size,) if last_key is None else (last_key, batch_size)
+
+    def next_batch_size(self, batch_size, seconds):
+        """Resizes a batch towards the size expected to take ``target_seconds``."""
+        ratio = self.target_seconds / seconds if seconds > 0 else BACKFILL_MAX_RESIZE
+        ratio = max(1 / BACKFILL_MAX_RESIZE, min(BACKFILL_MAX_RESIZE, ratio))
+        return max(1, min(self.max_batch_size, int(batch_size * ratio)))
+
+
+def read_backfill_migration(path):
+    """Parses a backfill migration, returning its targets and the checksum of the migration file.
+
+    Every section of the migration file names a table, backfilled in the order they appear.
+    """
+    with open(path, "rb") as migration_file:
+        contents = migration_file.read()
+
+    # Interpolation is off, since the SQL holds %(start)s and %(end)s placeholders.
+    config = RawConfigParser()
+    try:
+        if python_version == 3:
+            config.read_string(contents.decode("utf-8"), source=path)
+        else:
+            import StringIO
+            config.readfp(StringIO.StringIO(contents), path)
+    except Exception as error:
+        raise InvalidBackfillMigrationError("{0} is not a valid backfill migration: {1}".format(path, error))
+
+    targets = []
+    for table in config.sections():
+        for name in ["key", "sql"]:
+            if not config.has_option(table, name):
+                raise InvalidBackfillMigrationError("{0} does not declare a {1} for {2}".format(path, name, table))
+
+        def option(name, default=None, convert=None):
+            if not config.has_option(table, name):
+                return default
+            text = config.get(table, name).strip()
+            if convert is None:
+                return text
+            try:
+                value = convert(text)
+            except ValueError:
+                value = -1
+            if value < 0:
+                raise InvalidBackfillMigrationError("{0} is not a valid {1} for {2}".format(text, name, table))
+            return value
+
+        batch_size = option("batch_size", BACKFILL_DEFAULT_BATCH_SIZE, int)
+        if batch_size < 1:
+            raise InvalidBackfillMigrationError("{0} is not a valid batch_size for {1}".format(batch_size, table))
+        targets.append(BackfillTarget(table=table,
+                                      key=option("key"),
+                                      sql=option("sql"),
+                                      batch_size=batch_size,
+                                      max_batch_size=option("max_batch_size", None, int),
+                                      target_seconds=option("target_seconds", BACKFILL_DEFAULT_TARGET_SECONDS, float),
+                                      sleep=option("sleep", 0.0, float)))
+    if not targets:
+        raise InvalidBackfillMigrationError("{0} does not declare any tables".format(path))
+    return targets, hashlib.sha256(contents).hexdigest()
@@ -0,0 +1,54 @@
+import os
+import subprocess
+
+BASELINE_NAME = "baseline"
+BASELINE_HEADER = "-- Baseline of every migration through version {0}\n"
+
+PG_DUMP_SETTING = "pg_dump"
+PG_DUMP_DEFAULT_COMMAND = "pg_dump"
+PG_DUMP_SCHEMA_OPTIONS = ["--schema-only", "--no-owner", "--no-privileges", "--exclude-table=version_migration*"]
+# Data is dumped as INSERT statements, since COPY ... FROM stdin can't be sent as a plain query.
+PG_DUMP_DATA_OPTIONS = ["--data-only", "--inserts", "--no-owner", "--no-privileges"]
+
+
+class SchemaDumpError(Exception):
+    pass
+
+
+def pg_dump_arguments(database_config):
+    """Returns the connection arguments and environment for pg_dump, keeping the password off the command line."""
+    environment = dict(os.environ)
+    if "dsn" in database_config:
+        return ["--dbname={0}".format(database_config["dsn"])], environment
+    if database_config.get("password"):
+        environment["PGPASSWORD"] = database_config["password"]
+    return ["--host={0}".format(database_config["host"]),
+            "--port={0}".format(database_config["port"]),
+            "--username={0}".format(database_config["username"]),
+            "--dbname={0}".format(database_config["database"])], environment
+
+
+def strip_meta_commands(dump):
+    """Removes psql meta-commands, such as ``\\connect``, which the server itself can't execute."""
+    return "".join(line for line in dump.splitlines(True) if not line.startswith("\\"))
+
+
+def run_pg_dump(command, database_config, options):
+    arguments, environment = pg_dump_arguments(database_config)
+    try:
+        process = subprocess.Popen([command] + options + arguments, env=environment,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as error:
+        raise SchemaDumpError("Unable to run {0}: {1}".format(command, error))
+    output, errors = process.communicate()
+    if process.returncode != 0:
+        raise SchemaDumpError("{0} failed: {1}".format(command, errors.decode("utf-8", "replace").strip()))
+    return strip_meta_commands(output.decode("utf-8"))
+
+
+def dump_baseline(command, database_config, version, data_tables=()):
+    """Dumps the schema of a database, and the rows of the given tables, as a baseline script for ``version``."""
+    contents = [BASELINE_HEADER.format(version), run_pg_dump(command, database_config, PG_DUMP_SCHEMA_OPTIONS)]
+    for table in data_tables:
+        contents.append(run_pg_dump(command, database_config, PG_DUMP_DATA_OPTIONS + ["--table={0}".format(table)]))
+    return "".join(contents)
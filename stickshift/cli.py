@@ -2,10 +2,8 @@ import click
 
 try:
     from stickshift.shell import ShellCLI, pass_context
-    from stickshift import cmd_setup, cmd_clear, cmd_new, cmd_alter, cmd_db
 except ImportError:
     from shell import ShellCLI, pass_context
-    import cmd_setup, cmd_clear, cmd_new, cmd_alter, cmd_db
 
 CONTEXT_SETTINGS = dict(auto_envvar_prefix='STICKSHIFT')
 
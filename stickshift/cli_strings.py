@@ -15,3 +15,32 @@ class CLIStrings(object):
 
     DB_DATABASE_VERSION = "Version"
     DB_DATABASE_NOT_MIGRATED_YET = "Database has not been migrated yet"
+
+    DB_DATABASE_VERIFIED = "Verified migrations"
+    DB_DATABASE_DRIFTED = "DRIFTED MIGRATIONS"
+
+    DB_INDEX_COLUMNS_REQUIRED = "At least one column is required to create an index"
+
+    DB_SQUASH_VERSION_MISMATCH = "Database must be migrated to version {0} to squash it, it is at version {1}"
+
+    DB_DATABASE_ALREADY_EXISTS = "Database {0} already exists"
+
+    DB_MIGRATION_PLAN = "MIGRATION PLAN"
+    DB_SLOWEST_MIGRATIONS = "SLOWEST MIGRATIONS"
+    DB_HISTORY_TOTAL = "TOTAL"
+    DB_DATABASE_UP_TO_DATE = "Database is up to date"
+
+    DB_SCHEMA_STATUS = "Schema"
+    DB_FINGERPRINT_SAVED = "Saved fingerprint:{0} (version {1})"
+    DB_FINGERPRINT_CURRENT = "Saved fingerprint is current"
+    DB_FINGERPRINT_STALE = "Saved fingerprint is missing or out of date, run stickshift fingerprint"
+    DB_SCHEMA_SNAPSHOT_SAVED = "Saved schema snapshot:{0} ({1})"
+    DB_SCHEMA_TABLE_SIZES = "TABLE SIZES"
+    DB_SCHEMA_DIFFERENCES = "SCHEMA DIFFERENCES"
+    DB_SCHEMAS_MATCH = "Schemas match"
+    DB_SCHEMA_DIFF_TARGET_REQUIRED = "A snapshot or environment to compare against is required"
+
+    DAEMON_LISTENING = "Listening on"
+
+    DB_FLEET_SUMMARY = "FLEET SUMMARY"
+    DB_FLEET_OPERATION_NOT_SUPPORTED = "Environment groups only support the migrate, verify and history operations"
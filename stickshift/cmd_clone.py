@@ -0,0 +1,35 @@
+import click
+
+try:
+    from stickshift.shell import pass_context
+    from stickshift.cli_strings import CLIStrings
+except ImportError:
+    from shell import pass_context
+    from cli_strings import CLIStrings
+
+
+@click.command('clone', short_help='Creates a migrated database by copying a template of the current migrations')
+@click.argument('environment', required=True, type=click.STRING, metavar='<environment>')
+@click.argument('name', required=True, type=click.STRING, metavar='<name>')
+@click.option('--prune/--no-prune', default=True,
+              help='Whether templates of previous migration sets are dropped.')
+@pass_context
+def cli(ctx, environment, name, prune):
+
+    if ctx.repository().is_repository_setup():
+        try:
+            from stickshift.template_manager import TemplateManager, DatabaseAlreadyExistsError
+        except ImportError:
+            from template_manager import TemplateManager, DatabaseAlreadyExistsError
+        template_manager = TemplateManager(migration_repository=ctx.repository(),
+                                           environment=environment,
+                                           output=ctx.echo)
+        try:
+            template_manager.clone(name=name, prune=prune)
+        except DatabaseAlreadyExistsError:
+            ctx.log(CLIStrings.DB_DATABASE_ALREADY_EXISTS.format(name))
+            click.get_current_context().exit(1)
+        finally:
+            template_manager.close()
+    else:
+        ctx.log(CLIStrings.DB_MIGRATION_REPOSITORY_MUST_BE_SETUP)
@@ -3,9 +3,17 @@ import click
 try:
     from stickshift.shell import pass_context
     from stickshift.cli_strings import CLIStrings
+    from stickshift.migration_repository import DB_GROUP_ON_ERROR_CONTINUE, DB_GROUP_ON_ERROR_FAIL_FAST
+    from stickshift.database_manager import TRANSACTION_MODES, VERIFY_STATUS_OK
+    from stickshift.migration_planner import OUT_OF_ORDER_POLICIES
+    from stickshift import daemon_client
 except ImportError:
     from shell import pass_context
     from cli_strings import CLIStrings
+    from migration_repository import DB_GROUP_ON_ERROR_CONTINUE, DB_GROUP_ON_ERROR_FAIL_FAST
+    from database_manager import TRANSACTION_MODES, VERIFY_STATUS_OK
+    from migration_planner import OUT_OF_ORDER_POLICIES
+    import daemon_client
 
 
 DB_OPERATIONS = [
@@ -18,39 +26,228 @@ DB_OPERATIONS = [
     "reset",
     "upgrade",
     "downgrade",
+    "verify",
+    "plan",
+    "history",
+    "status",
 ]
 
 
 @click.command('db', short_help='Run specific commands against a specific database')
 @click.argument('operation', required=True, type=click.Choice(DB_OPERATIONS), metavar='<operation>')
 @click.argument('environment', required=True, type=click.STRING, metavar='<environment>')
+@click.option('--concurrency', type=click.INT, default=None,
+              help='Maximum number of group members migrated at the same time.')
+@click.option('--canary', multiple=True,
+              help='Group member migrated before all others, may be repeated.')
+@click.option('--continue-on-error/--fail-fast', 'continue_on_error', default=None,
+              help='Whether remaining group members are migrated after a member fails.')
+@click.option('--transaction', 'transaction_mode', type=click.Choice(TRANSACTION_MODES), default=None,
+              help='Applies pending migrations one by one, in a single transaction, or in a single transaction '
+                   'with a savepoint per migration.')
+@click.option('--out-of-order', 'out_of_order', type=click.Choice(OUT_OF_ORDER_POLICIES), default=None,
+              help='Whether pending migrations older than the applied version are reported and skipped, '
+                   'refused, or applied.')
+@click.option('--to', 'to', type=click.INT, default=None,
+              help='Migrates up to, or downgrades back to, this version in a single transaction.')
+@click.option('--steps', type=click.INT, default=None,
+              help='Number of migrations downgraded in a single transaction.')
+@click.option('--workers', type=click.INT, default=None,
+              help='Number of migrations that don\'t depend on each other applied at the same time.')
+@click.option('--resume', is_flag=True, default=False,
+              help='Continues a failed no-transaction migration after its last completed statement.')
+@click.option('--daemon/--no-daemon', default=True,
+              help='Runs the operation through a running stickshift serve daemon when one is available.')
 @pass_context
-def cli(ctx, operation, environment):
+def cli(ctx, operation, environment, concurrency, canary, continue_on_error, transaction_mode, out_of_order, to, steps,
+        workers, resume, daemon):
 
     if ctx.repository().is_repository_setup():
+        if ctx.repository().is_environment_group(environment):
+            if operation == "history":
+                print_environment_group_history(ctx=ctx, environment=environment)
+            elif operation in ["migrate", "verify"]:
+                on_error = None
+                if continue_on_error is not None:
+                    on_error = DB_GROUP_ON_ERROR_CONTINUE if continue_on_error else DB_GROUP_ON_ERROR_FAIL_FAST
+                exit_with_code(run_environment_group(ctx=ctx,
+                                                     operation=operation,
+                                                     environment=environment,
+                                                     concurrency=concurrency,
+                                                     canary=list(canary),
+                                                     on_error=on_error,
+                                                     transaction_mode=transaction_mode,
+                                                     out_of_order=out_of_order,
+                                                     to=to,
+                                                     workers=workers,
+                                                     resume=resume))
+            else:
+                ctx.log(CLIStrings.DB_FLEET_OPERATION_NOT_SUPPORTED)
+            return
+        if daemon:
+            response = daemon_client.request(operation=operation,
+                                             environment=environment,
+                                             directory=ctx.directory,
+                                             database_config=ctx.repository().database_config(environment),
+                                             transaction_mode=transaction_mode,
+                                             out_of_order=out_of_order,
+                                             to=to,
+                                             steps=steps,
+                                             workers=workers,
+                                             resume=resume)
+            if response is not None:
+                click.echo(response["stdout"], nl=False)
+                click.echo(response["stderr"], nl=False, err=True)
+                exit_with_code(response["exit_code"])
+                return
         database_manager = ctx.database_manager(environment=environment)
-        if operation == "provision":
-            provision_database(ctx=ctx, database_manager=database_manager)
-        elif operation == "deprovision":
-            deprovision_database(ctx=ctx, database_manager=database_manager)
-        elif operation == "version":
-            print_database_version(ctx=ctx, database_manager=database_manager)
-        elif operation == "procedures":
-            print_list_items_with_title(title="PROCEDURES", list_items=database_manager.list_procedures())
-        elif operation == "tables":
-            print_list_items_with_title(title="TABLES", list_items=database_manager.list_tables())
-        elif operation == "upgrade":
-            database_manager.upgrade()
-        elif operation == "downgrade":
-            database_manager.downgrade()
-        elif operation == "migrate":
-            database_manager.migrate()
-        elif operation == "reset":
-            database_manager.reset()
+        exit_with_code(run_database_operation(ctx=ctx,
+                                              operation=operation,
+                                              database_manager=database_manager,
+                                              transaction_mode=transaction_mode,
+                                              out_of_order=out_of_order,
+                                              to=to,
+                                              steps=steps,
+                                              workers=workers,
+                                              resume=resume))
     else:
         ctx.log(CLIStrings.DB_MIGRATION_REPOSITORY_MUST_BE_SETUP)
 
 
+def exit_with_code(exit_code):
+    if exit_code:
+        click.get_current_context().exit(exit_code)
+
+
+def run_database_operation(ctx, operation, database_manager, transaction_mode=None, out_of_order=None, to=None,
+                           steps=None, workers=None, resume=False):
+    """Runs a single environment operation, returning the exit code of the command."""
+    if operation == "provision":
+        provision_database(ctx=ctx, database_manager=database_manager)
+    elif operation == "deprovision":
+        deprovision_database(ctx=ctx, database_manager=database_manager)
+    elif operation == "version":
+        print_database_version(ctx=ctx, database_manager=database_manager)
+    elif operation == "procedures":
+        print_list_items_with_title(ctx=ctx, title="PROCEDURES", list_items=database_manager.list_procedures())
+    elif operation == "tables":
+        print_list_items_with_title(ctx=ctx, title="TABLES", list_items=database_manager.list_tables())
+    elif operation == "upgrade":
+        database_manager.upgrade(out_of_order=out_of_order)
+    elif operation == "downgrade":
+        database_manager.downgrade(steps=steps, to=to)
+    elif operation == "migrate":
+        database_manager.migrate(transaction_mode=transaction_mode, out_of_order=out_of_order, to=to,
+                                 workers=workers, resume=resume)
+    elif operation == "reset":
+        database_manager.reset()
+    elif operation == "verify":
+        return verify_database(ctx=ctx, database_manager=database_manager)
+    elif operation == "plan":
+        print_migration_plan(ctx=ctx, database_manager=database_manager)
+    elif operation == "history":
+        print_migration_history(ctx=ctx, database_manager=database_manager)
+    elif operation == "status":
+        return print_schema_status(ctx=ctx, database_manager=database_manager)
+    return 0
+
+
+def run_environment_group(ctx, operation, environment, concurrency, canary, on_error, transaction_mode,
+                          out_of_order=None, to=None, workers=None, resume=False):
+    try:
+        from stickshift.fleet_manager import FleetManager, FLEET_STATUS_MIGRATED, FLEET_STATUS_FAILED, \
+            FLEET_STATUS_SKIPPED, FLEET_STATUS_VERIFIED, FLEET_STATUS_DRIFTED
+    except ImportError:
+        from fleet_manager import FleetManager, FLEET_STATUS_MIGRATED, FLEET_STATUS_FAILED, FLEET_STATUS_SKIPPED, \
+            FLEET_STATUS_VERIFIED, FLEET_STATUS_DRIFTED
+    fleet_manager = FleetManager(migration_repository=ctx.repository(),
+                                 group=ctx.repository().environment_group(environment),
+                                 concurrency=concurrency,
+                                 canary=canary,
+                                 on_error=on_error,
+                                 transaction_mode=transaction_mode,
+                                 out_of_order=out_of_order,
+                                 to=to,
+                                 workers=workers,
+                                 resume=resume)
+    if operation == "verify":
+        results = fleet_manager.verify()
+        statuses = [FLEET_STATUS_VERIFIED, FLEET_STATUS_DRIFTED, FLEET_STATUS_FAILED, FLEET_STATUS_SKIPPED]
+    else:
+        results = fleet_manager.migrate()
+        statuses = [FLEET_STATUS_MIGRATED, FLEET_STATUS_FAILED, FLEET_STATUS_SKIPPED]
+    print_list_items_with_title(ctx=ctx,
+                                title=CLIStrings.DB_FLEET_SUMMARY,
+                                list_items=[result.describe() for result in results])
+    counts = [(status, len([result for result in results if result.status == status])) for status in statuses]
+    ctx.echo(", ".join("{0}: {1}".format(status, count) for status, count in counts))
+    return 1 if any(result.status != statuses[0] for result in results) else 0
+
+
+def verify_database(ctx, database_manager):
+    results = database_manager.verify_migrations()
+    drifted = ["V{0} {1}: {2}".format(version, migration_file_name or "", status)
+               for version, migration_file_name, status in results if status != VERIFY_STATUS_OK]
+    if drifted:
+        print_list_items_with_title(ctx=ctx, title=CLIStrings.DB_DATABASE_DRIFTED, list_items=drifted)
+        return 1
+    ctx.log("{0}: {1}".format(CLIStrings.DB_DATABASE_VERIFIED, len(results)))
+    return 0
+
+
+def print_schema_status(ctx, database_manager):
+    try:
+        from stickshift.schema_gate import SCHEMA_UP_TO_DATE
+    except ImportError:
+        from schema_gate import SCHEMA_UP_TO_DATE
+    status = database_manager.schema_status()
+    ctx.log("{0}: {1}".format(CLIStrings.DB_SCHEMA_STATUS, status))
+    return 0 if status == SCHEMA_UP_TO_DATE else 1
+
+
+def print_migration_plan(ctx, database_manager):
+    plans = database_manager.plan_migrations()
+    if plans:
+        print_list_items_with_title(ctx=ctx,
+                                    title=CLIStrings.DB_MIGRATION_PLAN,
+                                    list_items=[plan.describe() for plan in plans])
+    else:
+        ctx.log(CLIStrings.DB_DATABASE_UP_TO_DATE)
+
+
+def print_migration_history(ctx, database_manager):
+    try:
+        from stickshift.migration_history import slowest_migrations, describe_history_totals
+    except ImportError:
+        from migration_history import slowest_migrations, describe_history_totals
+    history = database_manager.migration_history()
+    print_list_items_with_title(ctx=ctx,
+                                title=CLIStrings.DB_SLOWEST_MIGRATIONS,
+                                list_items=[entry.describe() for entry in slowest_migrations(history)])
+    ctx.echo("{0}: {1}".format(CLIStrings.DB_HISTORY_TOTAL, describe_history_totals(history)))
+
+
+def print_environment_group_history(ctx, environment):
+    try:
+        from stickshift.fleet_manager import FleetManager, mask_dsn
+        from stickshift.migration_history import compare_histories, describe_history_totals
+    except ImportError:
+        from fleet_manager import FleetManager, mask_dsn
+        from migration_history import compare_histories, describe_history_totals
+    fleet_manager = FleetManager(migration_repository=ctx.repository(),
+                                 group=ctx.repository().environment_group(environment))
+    results = fleet_manager.histories()
+    histories = [(mask_dsn(member), history) for member, history, error in results if history is not None]
+    print_list_items_with_title(ctx=ctx,
+                                title=CLIStrings.DB_SLOWEST_MIGRATIONS,
+                                list_items=compare_histories(histories))
+    print_list_items_with_title(ctx=ctx,
+                                title=CLIStrings.DB_HISTORY_TOTAL,
+                                list_items=["{0}: {1}".format(mask_dsn(member), describe_history_totals(history)
+                                                              if history is not None else str(error).strip())
+                                            for member, history, error in results])
+
+
 def provision_database(ctx, database_manager):
     if database_manager.provision_database():
         ctx.log(CLIStrings.DB_DATABASE_PROVISIONED_SUCCESSFULLY)
@@ -73,9 +270,9 @@ def print_database_version(ctx, database_manager):
         ctx.log(CLIStrings.DB_DATABASE_NOT_MIGRATED_YET)
 
 
-def print_list_items_with_title(title, list_items):
-    print("\n{0}".format(title))
-    print("--------")
+def print_list_items_with_title(ctx, title, list_items):
+    ctx.echo("\n{0}".format(title))
+    ctx.echo("--------")
     for item in list_items:
-        print(item)
-    print("--------")
+        ctx.echo(item)
+    ctx.echo("--------")
@@ -0,0 +1,27 @@
+import click
+
+try:
+    from stickshift.shell import pass_context
+    from stickshift.cli_strings import CLIStrings
+except ImportError:
+    from shell import pass_context
+    from cli_strings import CLIStrings
+
+
+@click.command('fingerprint', short_help='Saves the fingerprint of the repository for checking databases against it')
+@click.option('--check', is_flag=True, default=False,
+              help='Only checks that the saved fingerprint matches the migration files.')
+@pass_context
+def cli(ctx, check):
+
+    if ctx.repository().is_repository_setup():
+        if check:
+            if ctx.repository().saved_fingerprint() != ctx.repository().current_fingerprint():
+                ctx.log(CLIStrings.DB_FINGERPRINT_STALE)
+                click.get_current_context().exit(1)
+            ctx.log(CLIStrings.DB_FINGERPRINT_CURRENT)
+            return
+        fingerprint, version = ctx.repository().save_fingerprint()
+        ctx.log(CLIStrings.DB_FINGERPRINT_SAVED.format(fingerprint, version))
+    else:
+        ctx.log(CLIStrings.DB_MIGRATION_REPOSITORY_MUST_BE_SETUP)
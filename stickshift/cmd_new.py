@@ -8,16 +8,28 @@ except ImportError:
     from cli_strings import CLIStrings
 
 
-@click.command('new', short_help='Creates a migration script for creating a new table or procedure')
+@click.command('new', short_help='Creates a migration script for creating a new table, procedure, index, data load '
+                                 'or backfill')
 @click.argument('type', required=True, type=click.STRING, metavar='<type>')
 @click.argument('name', required=True, type=click.STRING, metavar='<name>')
+@click.argument('columns', required=False, nargs=-1, type=click.STRING, metavar='[<columns>...]')
 @pass_context
-def cli(ctx, type, name):
+def cli(ctx, type, name, columns):
 
     if ctx.repository().is_repository_setup():
         if type == "table":
             ctx.repository().create_new_table_migration(name)
         elif type == "procedure":
             ctx.repository().create_new_procedure_migration(name)
+        elif type == "data":
+            ctx.repository().create_new_data_migration(name)
+        elif type == "backfill":
+            ctx.repository().create_new_backfill_migration(name)
+        elif type == "index":
+            columns = [column.strip() for value in columns for column in value.split(",") if column.strip()]
+            if columns:
+                ctx.repository().create_new_index_migration(table=name, columns=columns)
+            else:
+                ctx.log(CLIStrings.DB_INDEX_COLUMNS_REQUIRED)
     else:
         print(CLIStrings.DB_MIGRATION_REPOSITORY_MUST_BE_SETUP)
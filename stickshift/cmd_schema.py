@@ -0,0 +1,78 @@
+import os
+import click
+
+try:
+    from stickshift.shell import pass_context
+    from stickshift.cli_strings import CLIStrings
+except ImportError:
+    from shell import pass_context
+    from cli_strings import CLIStrings
+
+SCHEMA_OPERATIONS = [
+    "snapshot",
+    "diff",
+    "sizes",
+]
+
+
+@click.command('schema', short_help='Saves, compares and sizes the schema of databases from their catalog')
+@click.argument('operation', required=True, type=click.Choice(SCHEMA_OPERATIONS), metavar='<operation>')
+@click.argument('source', required=True, type=click.STRING, metavar='<environment|snapshot>')
+@click.argument('target', required=False, type=click.STRING, metavar='[<environment|snapshot>]')
+@click.option('--output', type=click.Path(dir_okay=False), default=None,
+              help='File the snapshot is saved to, defaults to db/snapshots/<environment>.json.')
+@click.option('--cached', is_flag=True, default=False,
+              help='Compares the saved snapshots of environments instead of reading their catalog.')
+@pass_context
+def cli(ctx, operation, source, target, output, cached):
+
+    if ctx.repository().is_repository_setup():
+        try:
+            from stickshift.schema_catalog import InvalidSnapshotError, save_snapshot, diff_snapshots
+            from stickshift.cmd_db import print_list_items_with_title
+        except ImportError:
+            from schema_catalog import InvalidSnapshotError, save_snapshot, diff_snapshots
+            from cmd_db import print_list_items_with_title
+        if operation == "snapshot":
+            snapshot = ctx.database_manager(environment=source).schema_snapshot()
+            if output is None:
+                if not os.path.exists(ctx.repository().repository_snapshot_path()):
+                    os.mkdir(ctx.repository().repository_snapshot_path())
+                output = ctx.repository().snapshot_path(source)
+            save_snapshot(snapshot, output)
+            ctx.log(CLIStrings.DB_SCHEMA_SNAPSHOT_SAVED.format(output, snapshot.describe()))
+        elif operation == "diff" and target is None:
+            ctx.log(CLIStrings.DB_SCHEMA_DIFF_TARGET_REQUIRED)
+            click.get_current_context().exit(1)
+        else:
+            try:
+                snapshot = read_snapshot(ctx, source, cached)
+                changes = None if operation == "sizes" else diff_snapshots(snapshot, read_snapshot(ctx, target, cached))
+            except InvalidSnapshotError as error:
+                ctx.log(str(error))
+                click.get_current_context().exit(1)
+                return
+            if changes is None:
+                print_list_items_with_title(ctx=ctx,
+                                            title=CLIStrings.DB_SCHEMA_TABLE_SIZES,
+                                            list_items=snapshot.describe_tables())
+            elif changes:
+                print_list_items_with_title(ctx=ctx, title=CLIStrings.DB_SCHEMA_DIFFERENCES, list_items=changes)
+                click.get_current_context().exit(1)
+            else:
+                ctx.log(CLIStrings.DB_SCHEMAS_MATCH)
+    else:
+        ctx.log(CLIStrings.DB_MIGRATION_REPOSITORY_MUST_BE_SETUP)
+
+
+def read_snapshot(ctx, source, cached):
+    """Reads a snapshot file, the saved snapshot of an environment when cached, or else the environment's catalog."""
+    try:
+        from stickshift.schema_catalog import load_snapshot
+    except ImportError:
+        from schema_catalog import load_snapshot
+    if os.path.isfile(source):
+        return load_snapshot(source)
+    if cached:
+        return load_snapshot(ctx.repository().snapshot_path(source))
+    return ctx.database_manager(environment=source).schema_snapshot()
@@ -0,0 +1,31 @@
+import click
+
+try:
+    from stickshift.shell import pass_context
+    from stickshift.cli_strings import CLIStrings
+    from stickshift.daemon_client import DAEMON_DEFAULT_POOL_SIZE
+except ImportError:
+    from shell import pass_context
+    from cli_strings import CLIStrings
+    from daemon_client import DAEMON_DEFAULT_POOL_SIZE
+
+
+@click.command('serve', short_help='Serves database operations over a local socket with warm connections.')
+@click.option('--pool-size', type=click.INT, default=DAEMON_DEFAULT_POOL_SIZE,
+              help='Maximum number of open connections kept per environment.')
+@pass_context
+def cli(ctx, pool_size):
+
+    if ctx.repository().is_repository_setup():
+        try:
+            from stickshift.migration_daemon import MigrationDaemon
+        except ImportError:
+            from migration_daemon import MigrationDaemon
+        daemon = MigrationDaemon(migration_repository=ctx.repository(), pool_size=pool_size)
+        ctx.log("{0}: {1}".format(CLIStrings.DAEMON_LISTENING, daemon.socket_path))
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    else:
+        ctx.log(CLIStrings.DB_MIGRATION_REPOSITORY_MUST_BE_SETUP)
@@ -0,0 +1,40 @@
+import click
+
+try:
+    from stickshift.shell import pass_context
+    from stickshift.cli_strings import CLIStrings
+except ImportError:
+    from shell import pass_context
+    from cli_strings import CLIStrings
+
+
+@click.command('squash', short_help='Captures the schema of a migrated database as a baseline for new databases')
+@click.argument('environment', required=True, type=click.STRING, metavar='<environment>')
+@click.option('--version', type=click.INT, default=None,
+              help='Version the database must be migrated to, defaults to its current version.')
+@click.option('--data-table', 'data_tables', multiple=True,
+              help='Table whose rows are included in the baseline, may be repeated.')
+@pass_context
+def cli(ctx, environment, version, data_tables):
+
+    if ctx.repository().is_repository_setup():
+        try:
+            from stickshift.baseline import SchemaDumpError
+        except ImportError:
+            from baseline import SchemaDumpError
+        database_manager = ctx.database_manager(environment=environment)
+        current_version = database_manager.current_database_migration_version()
+        if current_version is None:
+            ctx.log(CLIStrings.DB_DATABASE_NOT_MIGRATED_YET)
+            return
+        if version is not None and version != current_version:
+            ctx.log(CLIStrings.DB_SQUASH_VERSION_MISMATCH.format(version, current_version))
+            click.get_current_context().exit(1)
+        try:
+            contents = database_manager.dump_baseline(version=current_version, data_tables=list(data_tables))
+        except SchemaDumpError as error:
+            ctx.log(str(error))
+            click.get_current_context().exit(1)
+        ctx.repository().create_baseline(version=current_version, contents=contents)
+    else:
+        ctx.log(CLIStrings.DB_MIGRATION_REPOSITORY_MUST_BE_SETUP)
@@ -0,0 +1,115 @@
+import os
+import sys
+import hashlib
+
+try:
+    from stickshift.migration_manifest import file_checksums
+except ImportError:
+    from migration_manifest import file_checksums
+
+python_version = sys.version_info.major
+if python_version == 3:
+    from configparser import ConfigParser
+else:
+    from ConfigParser import ConfigParser
+
+COPY_MIGRATION_EXTENSION = ".copy"
+
+COPY_FORMATS = ["csv", "text"]
+COPY_DEFAULT_FORMAT = "csv"
+COPY_BUFFER_SIZE = 1024 * 1024
+
+COPY_MIGRATION_TEMPLATE = "[{0}]" \
+                          "\nfile: {0}.csv" \
+                          "\nformat: csv" \
+                          "\nheader: true\n"
+
+
+def is_copy_migration(migration_file_name):
+    return migration_file_name.endswith(COPY_MIGRATION_EXTENSION)
+
+
+class InvalidCopyMigrationError(Exception):
+    pass
+
+
+class CopyTarget(object):
+    """A data file loaded into a single table by a copy migration."""
+
+    def __init__(self, table, path, data_format=COPY_DEFAULT_FORMAT, header=False, delimiter=None, columns=None):
+        self.table = table
+        self.path = path
+        self.data_format = data_format
+        self.header = header
+        self.delimiter = delimiter
+        self.columns = columns or []
+
+    def copy_query(self):
+        options = ["FORMAT {0}".format(self.data_format)]
+        if self.header:
+            options.append("HEADER true")
+        if self.delimiter:
+            options.append("DELIMITER E'{0}'".format(self.delimiter.replace("'", "\\'")))
+        columns = " ({0})".format(", ".join(self.columns)) if self.columns else ""
+        return "COPY {0}{1} FROM STDIN WITH ({2});".format(self.table, columns, ", ".join(options))
+
+    def open(self):
+        if self.path.endswith(".gz"):
+            import gzip
+            return gzip.open(self.path, "rb")
+        return open(self.path, "rb")
+
+
+def read_copy_migration(path, data_directory, checksums=file_checksums):
+    """Parses a copy migration, returning its targets and a checksum of the migration file and its data files.
+
+    Every section of the migration file names a table, and its ``file`` option names a
+    data file relative to the repository data folder. The data files are hashed with
+    ``checksums``, such as the manifest's, which only hashes files that changed.
+    """
+    with open(path, "rb") as migration_file:
+        contents = migration_file.read()
+
+    config = ConfigParser()
+    try:
+        if python_version == 3:
+            config.read_string(contents.decode("utf-8"), source=path)
+        else:
+            import StringIO
+            config.readfp(StringIO.StringIO(contents), path)
+    except Exception as error:
+        raise InvalidCopyMigrationError("{0} is not a valid copy migration: {1}".format(path, error))
+
+    targets = []
+    for table in config.sections():
+        if not config.has_option(table, "file"):
+            raise InvalidCopyMigrationError("{0} does not declare a file for {1}".format(path, table))
+
+        def option(name, default=None):
+            return config.get(table, name).strip() if config.has_option(table, name) else default
+
+        data_format = option("format", COPY_DEFAULT_FORMAT).lower()
+        if data_format not in COPY_FORMATS:
+            raise InvalidCopyMigrationError("{0} is not a valid copy format, expected one of: {1}".format(
+                data_format, ", ".join(COPY_FORMATS)))
+        delimiter = option("delimiter")
+        if delimiter is not None and delimiter.lower() in ["tab", "\\t"]:
+            delimiter = "\\t"
+        columns = [column.strip() for column in option("columns", "").split(",") if column.strip()]
+        targets.append(CopyTarget(table=table,
+                                  path=os.path.join(data_directory, option("file")),
+                                  data_format=data_format,
+                                  header=option("header", "false").lower() in ["true", "yes", "1"],
+                                  delimiter=delimiter,
+                                  columns=columns))
+    if not targets:
+        raise InvalidCopyMigrationError("{0} does not declare any tables".format(path))
+    digest = hashlib.sha256(contents)
+    for checksum in checksums([target.path for target in targets]):
+        digest.update("\n{0}".format(checksum).encode("utf-8"))
+    return targets, digest.hexdigest()
+
+
+def copy_target(cursor, target):
+    with target.open() as data_file:
+        cursor.copy_expert(target.copy_query(), data_file, size=COPY_BUFFER_SIZE)
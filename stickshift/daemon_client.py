@@ -0,0 +1,67 @@
+import os
+import json
+import socket
+import hashlib
+
+DAEMON_SOCKET_PATH = "db/.stickshift.sock"
+DAEMON_CONNECT_TIMEOUT = 0.5
+DAEMON_READ_TIMEOUT = 6 * 60 * 60
+DAEMON_DEFAULT_POOL_SIZE = 4
+
+
+def daemon_socket_path(directory=None):
+    if directory:
+        return '/'.join([directory, DAEMON_SOCKET_PATH])
+    return DAEMON_SOCKET_PATH
+
+
+def is_daemon_running(directory=None):
+    return os.path.exists(daemon_socket_path(directory))
+
+
+def database_config_hash(database_config):
+    """Returns a digest of a resolved database config, so a daemon can tell whether it connects to the same database
+    without the credentials being sent over its socket."""
+    encoded = json.dumps(database_config, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha1(encoded).hexdigest()
+
+
+def request(operation, environment, directory=None, database_config=None, timeout=DAEMON_READ_TIMEOUT, **options):
+    """Runs a database operation through a running ``stickshift serve`` daemon.
+
+    Returns a dict holding ``exit_code``, ``stdout`` and ``stderr``, or None if no
+    daemon is listening for the repository at ``directory`` or the daemon can't run it,
+    because the environment's engine has no connection pools or because ``database_config``,
+    the environment as the caller resolves it, differs from the daemon's.
+    """
+    path = daemon_socket_path(directory)
+    if not os.path.exists(path):
+        return None
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.settimeout(DAEMON_CONNECT_TIMEOUT)
+        try:
+            client.connect(path)
+        except socket.error:
+            return None
+        client.settimeout(timeout)
+        message = {"operation": operation, "environment": environment, "options": options}
+        if database_config is not None:
+            message["database_config_hash"] = database_config_hash(database_config)
+        client.sendall(json.dumps(message).encode("utf-8") + b"\n")
+        try:
+            response = client.makefile("rb").readline()
+        except socket.timeout:
+            return {"exit_code": 1,
+                    "stdout": "",
+                    "stderr": "The daemon did not answer within {0} seconds, "
+                              "the operation may still be running\n".format(timeout)}
+    finally:
+        client.close()
+    if not response:
+        return None
+    response = json.loads(response.decode("utf-8"))
+    if not response.get("handled", True):
+        return None
+    return response
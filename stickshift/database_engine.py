@@ -0,0 +1,300 @@
+import io
+
+try:
+    from stickshift.sql_script import StatementLexer
+except ImportError:
+    from sql_script import StatementLexer
+
+ENGINE_SETTING = "engine"
+ENGINE_POSTGRES = "postgres"
+ENGINE_SQLITE = "sqlite"
+
+# Capabilities an engine may lack, which the database manager checks before relying on them.
+FEATURE_SERVER_TIMING = "server timing"
+FEATURE_SESSION_SETTINGS = "session settings"
+FEATURE_COPY = "copy migrations"
+FEATURE_SCHEMA_DUMP = "schema dumps"
+FEATURE_CONCURRENT_INDEXES = "concurrent indexes"
+FEATURE_TABLE_STATISTICS = "table statistics"
+FEATURE_TEMPLATES = "template databases"
+FEATURE_ASYNC = "asyncio connections"
+FEATURE_CONNECTION_POOLS = "daemon connection pools"
+FEATURE_PARALLEL_MIGRATIONS = "parallel migrations"
+FEATURE_BACKFILLS = "backfill migrations"
+FEATURE_SERVER_CURSORS = "server-side cursors"
+FEATURE_SCHEMA_SNAPSHOTS = "schema snapshots"
+FEATURE_MIGRATE_LOCKS = "migrate locks"
+
+SQLITE_MEMORY_DATABASE = ":memory:"
+
+# Read from pg_catalog rather than information_schema, whose views check the privileges
+# of every relation and get slow on catalogs with many relations.
+QUERY_LIST_FUNCTIONS = "SELECT p.proname " \
+                       "FROM pg_catalog.pg_proc p " \
+                       "JOIN pg_catalog.pg_namespace n ON n.oid = p.pronamespace " \
+                       "WHERE p.prokind = 'f' AND n.nspname = 'public';"
+
+QUERY_LIST_TABLES = "SELECT c.relname " \
+                    "FROM pg_catalog.pg_class c " \
+                    "JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace " \
+                    "WHERE c.relkind IN ('r', 'p', 'v', 'f') AND n.nspname = 'public';"
+
+QUERY_CREATE_MIGRATION_TABLE = 'CREATE TABLE IF NOT EXISTS "version_migration" ' \
+                               '(version INTEGER PRIMARY KEY, ' \
+                               'migrated_at INTEGER DEFAULT EXTRACT(EPOCH FROM CURRENT_TIMESTAMP), ' \
+                               'checksum VARCHAR(64), duration DOUBLE PRECISION, server_duration DOUBLE PRECISION, ' \
+                               'script_bytes BIGINT);'
+
+QUERY_UPGRADE_MIGRATION_TABLE = 'ALTER TABLE "version_migration" ADD COLUMN IF NOT EXISTS checksum VARCHAR(64), ' \
+                                'ADD COLUMN IF NOT EXISTS duration DOUBLE PRECISION, ' \
+                                'ADD COLUMN IF NOT EXISTS server_duration DOUBLE PRECISION, ' \
+                                'ADD COLUMN IF NOT EXISTS script_bytes BIGINT;' \
+                                'DO $$ BEGIN ' \
+                                'IF NOT EXISTS (SELECT 1 FROM pg_constraint ' \
+                                "WHERE conrelid = 'version_migration'::regclass AND contype = 'p') THEN " \
+                                'ALTER TABLE "version_migration" ADD PRIMARY KEY (version); ' \
+                                'END IF; END $$;'
+
+QUERY_DROP_MIGRATION_TABLE = 'DROP TABLE IF EXISTS "version_migration";'
+
+QUERY_DATABASE_MIGRATIONS_TABLE_EXISTS = "SELECT to_regclass('public.version_migration') IS NOT NULL;"
+
+# Read through to_jsonb so version tables created before the timing columns can be read as they are.
+QUERY_MIGRATION_HISTORY = "SELECT version, " \
+                          "(to_jsonb(history) ->> 'duration')::DOUBLE PRECISION, " \
+                          "(to_jsonb(history) ->> 'server_duration')::DOUBLE PRECISION, " \
+                          "(to_jsonb(history) ->> 'script_bytes')::BIGINT, " \
+                          "migrated_at " \
+                          "FROM version_migration history ORDER BY version;"
+
+QUERY_SQLITE_LIST_TABLES = "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%';"
+
+QUERY_SQLITE_CREATE_MIGRATION_TABLE = 'CREATE TABLE IF NOT EXISTS "version_migration" ' \
+                                      '(version INTEGER PRIMARY KEY, ' \
+                                      "migrated_at INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)), " \
+                                      'checksum VARCHAR(64), duration DOUBLE PRECISION, ' \
+                                      'server_duration DOUBLE PRECISION, script_bytes BIGINT);'
+
+QUERY_SQLITE_MIGRATIONS_TABLE_EXISTS = "SELECT EXISTS (" \
+                                       "SELECT 1 FROM sqlite_master " \
+                                       "WHERE type = 'table' AND name = 'version_migration'" \
+                                       ");"
+
+QUERY_SQLITE_MIGRATION_HISTORY = "SELECT version, duration, server_duration, script_bytes, migrated_at " \
+                                 "FROM version_migration ORDER BY version;"
+
+QUERY_SQLITE_BEGIN = "BEGIN;"
+QUERY_SQLITE_COMMIT = "COMMIT;"
+QUERY_SQLITE_ROLLBACK = "ROLLBACK;"
+
+
+class InvalidEngineError(Exception):
+    pass
+
+
+class UnsupportedEngineFeatureError(Exception):
+    pass
+
+
+def connection_arguments(database_config):
+    if "dsn" in database_config:
+        return {"dsn": database_config["dsn"]}
+    return {"host": database_config["host"],
+            "port": database_config["port"],
+            "user": database_config["username"],
+            "password": database_config["password"],
+            "database": database_config["database"]}
+
+
+class DatabaseEngine(object):
+    """Owns how an engine connects, keeps its version table and lists its catalog.
+
+    Queries an engine has no equivalent for are None.
+    """
+
+    name = None
+    database_fields = None
+    features = frozenset()
+
+    query_create_version_table = None
+    query_upgrade_version_table = None
+    query_drop_version_table = QUERY_DROP_MIGRATION_TABLE
+    query_version_table_exists = None
+    query_list_tables = None
+    query_list_functions = None
+    query_migration_history = None
+
+    def connect(self, database_config):
+        raise NotImplementedError()
+
+    def error_class(self):
+        """Returns the base class of the errors raised by the engine's connections."""
+        raise NotImplementedError()
+
+    def supports(self, feature):
+        return feature in self.features
+
+    def require(self, feature):
+        if not self.supports(feature):
+            raise UnsupportedEngineFeatureError("{0} are not supported by the {1} engine".format(
+                feature.capitalize(), self.name))
+
+
+class PostgresEngine(DatabaseEngine):
+
+    name = ENGINE_POSTGRES
+    features = frozenset([FEATURE_SERVER_TIMING, FEATURE_SESSION_SETTINGS, FEATURE_COPY, FEATURE_SCHEMA_DUMP,
+                          FEATURE_CONCURRENT_INDEXES, FEATURE_TABLE_STATISTICS, FEATURE_TEMPLATES, FEATURE_ASYNC,
+                          FEATURE_CONNECTION_POOLS, FEATURE_PARALLEL_MIGRATIONS, FEATURE_BACKFILLS,
+                          FEATURE_SERVER_CURSORS, FEATURE_SCHEMA_SNAPSHOTS, FEATURE_MIGRATE_LOCKS])
+
+    query_create_version_table = QUERY_CREATE_MIGRATION_TABLE
+    query_upgrade_version_table = QUERY_UPGRADE_MIGRATION_TABLE
+    query_version_table_exists = QUERY_DATABASE_MIGRATIONS_TABLE_EXISTS
+    query_list_tables = QUERY_LIST_TABLES
+    query_list_functions = QUERY_LIST_FUNCTIONS
+    query_migration_history = QUERY_MIGRATION_HISTORY
+
+    def connect(self, database_config):
+        import psycopg2
+        return psycopg2.connect(**connection_arguments(database_config))
+
+    def error_class(self):
+        import psycopg2
+        return psycopg2.Error
+
+
+class SQLiteEngine(DatabaseEngine):
+    """Runs migrations against a SQLite file, or an in-memory database when ``database`` is empty or ``:memory:``.
+
+    Every version table it creates already has the current columns, so there is nothing to upgrade.
+    """
+
+    name = ENGINE_SQLITE
+    database_fields = ["database"]
+
+    query_create_version_table = QUERY_SQLITE_CREATE_MIGRATION_TABLE
+    query_version_table_exists = QUERY_SQLITE_MIGRATIONS_TABLE_EXISTS
+    query_list_tables = QUERY_SQLITE_LIST_TABLES
+    query_migration_history = QUERY_SQLITE_MIGRATION_HISTORY
+
+    def connect(self, database_config):
+        return SQLiteConnection(database_config.get("database") or SQLITE_MEMORY_DATABASE)
+
+    def error_class(self):
+        import sqlite3
+        return sqlite3.Error
+
+
+ENGINES = {ENGINE_POSTGRES: PostgresEngine(), ENGINE_SQLITE: SQLiteEngine()}
+
+
+def engine_database_fields(name):
+    """Returns the database.ini fields an engine connects with, or None for the default fields."""
+    if name is None:
+        return None
+    return database_engine(name).database_fields
+
+
+def database_engine(name=None):
+    name = name or ENGINE_POSTGRES
+    if name not in ENGINES:
+        raise InvalidEngineError("{0} is not a valid engine, expected one of: {1}".format(
+            name, ", ".join(sorted(ENGINES))))
+    return ENGINES[name]
+
+
+def engine_for(database_config):
+    """Returns the engine a database config connects with, Postgres unless it names another."""
+    return database_engine((database_config or {}).get(ENGINE_SETTING))
+
+
+class SQLiteCursor(object):
+    """A cursor behaving like a psycopg2 cursor, executing queries of several statements one statement at a time."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = connection.connection.cursor()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def execute(self, query, parameters=None):
+        if parameters is not None:
+            self.connection.begin()
+            self.cursor.execute(query.replace("%s", "?"), parameters)
+            return
+        statements = list(StatementLexer(io.StringIO(query).read))
+        if len(statements) < 2 or not self.connection.autocommit or self.connection.connection.in_transaction:
+            for statement in statements:
+                self.connection.begin()
+                self.cursor.execute(statement)
+            return
+        # Postgres runs a query of several statements in an implicit transaction, even in autocommit.
+        self.cursor.execute(QUERY_SQLITE_BEGIN)
+        try:
+            for statement in statements:
+                self.cursor.execute(statement)
+        except Exception:
+            self.cursor.execute(QUERY_SQLITE_ROLLBACK)
+            raise
+        self.cursor.execute(QUERY_SQLITE_COMMIT)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def close(self):
+        self.cursor.close()
+
+
+class SQLiteConnection(object):
+    """Wraps a sqlite3 connection with the autocommit, cursor and transaction behaviour of a psycopg2 connection.
+
+    Outside of autocommit a transaction is begun by the first statement executed, the way psycopg2 does.
+    """
+
+    def __init__(self, database):
+        import sqlite3
+        self.connection = sqlite3.connect(database, isolation_level=None, check_same_thread=False)
+        self.autocommit = True
+
+    @property
+    def closed(self):
+        return self.connection is None
+
+    def begin(self):
+        if not self.autocommit and not self.connection.in_transaction:
+            self.connection.execute(QUERY_SQLITE_BEGIN)
+
+    def cursor(self):
+        return SQLiteCursor(self)
+
+    def commit(self):
+        if self.connection.in_transaction:
+            self.connection.execute(QUERY_SQLITE_COMMIT)
+
+    def rollback(self):
+        if self.connection.in_transaction:
+            self.connection.execute(QUERY_SQLITE_ROLLBACK)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
@@ -1,90 +1,490 @@
-import psycopg2
+import os
+import time
+import random
+import hashlib
+import itertools
+import threading
 
 try:
     from stickshift.migration_repository import find_migration_index
+    from stickshift.migration_manifest import ENTRY_FILE_NAME, ENTRY_VERSION, file_checksum
+    from stickshift.sql_script import ScriptReader, StatementLexer
+    from stickshift.copy_migration import is_copy_migration, read_copy_migration, copy_target
+    from stickshift.backfill_migration import QUERY_CREATE_BACKFILL_PROGRESS_TABLE, \
+        QUERY_DROP_BACKFILL_PROGRESS_TABLE, QUERY_BACKFILL_PROGRESS, QUERY_SAVE_BACKFILL_PROGRESS, \
+        QUERY_DELETE_BACKFILL_PROGRESS, is_backfill_migration, read_backfill_migration
+    from stickshift.lock_analyzer import LockTarget, TableStatistics, LOCK_ROW_EXCLUSIVE, COST_CATALOG, \
+        QUERY_TABLE_STATISTICS, classify_migration, plan_migrations, script_tables
+    from stickshift.script_directives import DIRECTIVE_TIMEOUTS, DIRECTIVE_NO_TRANSACTION, DIRECTIVE_DEPENDS, \
+        read_script_directives, validate_timeout
+    from stickshift.baseline import PG_DUMP_SETTING, PG_DUMP_DEFAULT_COMMAND, dump_baseline
+    from stickshift.migration_history import MigrationTimer, HistoryEntry, QUERY_SERVER_DURATION, \
+        DIRECTION_UPGRADE, DIRECTION_DOWNGRADE, EVENT_BEGIN, EVENT_END, EVENT_FAILED, can_time_query
+    from stickshift.migration_planner import OUT_OF_ORDER_SETTING, OUT_OF_ORDER_WARN, OUT_OF_ORDER_ERROR, \
+        QUERY_DATABASE_APPLIED_VERSIONS, OutOfOrderMigrationError, validate_out_of_order_policy, plan_upgrade, \
+        plan_downgrade, describe_out_of_order
+    from stickshift.database_engine import FEATURE_SERVER_TIMING, FEATURE_SESSION_SETTINGS, FEATURE_COPY, \
+        FEATURE_SCHEMA_DUMP, FEATURE_CONCURRENT_INDEXES, FEATURE_TABLE_STATISTICS, FEATURE_PARALLEL_MIGRATIONS, \
+        FEATURE_BACKFILLS, FEATURE_SERVER_CURSORS, FEATURE_SCHEMA_SNAPSHOTS, FEATURE_MIGRATE_LOCKS, engine_for
+    from stickshift.migration_graph import WORKERS_SETTING, WORKERS_DEFAULT, MigrationScheduler, build_migration_graph
+    from stickshift.schema_catalog import CATALOG_FETCH_SIZE, read_schema_snapshot
+    from stickshift.schema_gate import QUERY_CREATE_FINGERPRINT_TABLE, QUERY_DROP_FINGERPRINT_TABLE, \
+        QUERY_SAVE_SCHEMA_FINGERPRINT, recorded_fingerprint, compare_fingerprints
 except ImportError:
     from migration_repository import find_migration_index
+    from migration_manifest import ENTRY_FILE_NAME, ENTRY_VERSION, file_checksum
+    from sql_script import ScriptReader, StatementLexer
+    from copy_migration import is_copy_migration, read_copy_migration, copy_target
+    from backfill_migration import QUERY_CREATE_BACKFILL_PROGRESS_TABLE, \
+        QUERY_DROP_BACKFILL_PROGRESS_TABLE, QUERY_BACKFILL_PROGRESS, QUERY_SAVE_BACKFILL_PROGRESS, \
+        QUERY_DELETE_BACKFILL_PROGRESS, is_backfill_migration, read_backfill_migration
+    from lock_analyzer import LockTarget, TableStatistics, LOCK_ROW_EXCLUSIVE, COST_CATALOG, \
+        QUERY_TABLE_STATISTICS, classify_migration, plan_migrations, script_tables
+    from script_directives import DIRECTIVE_TIMEOUTS, DIRECTIVE_NO_TRANSACTION, DIRECTIVE_DEPENDS, \
+        read_script_directives, validate_timeout
+    from baseline import PG_DUMP_SETTING, PG_DUMP_DEFAULT_COMMAND, dump_baseline
+    from migration_history import MigrationTimer, HistoryEntry, QUERY_SERVER_DURATION, \
+        DIRECTION_UPGRADE, DIRECTION_DOWNGRADE, EVENT_BEGIN, EVENT_END, EVENT_FAILED, can_time_query
+    from migration_planner import OUT_OF_ORDER_SETTING, OUT_OF_ORDER_WARN, OUT_OF_ORDER_ERROR, \
+        QUERY_DATABASE_APPLIED_VERSIONS, OutOfOrderMigrationError, validate_out_of_order_policy, plan_upgrade, \
+        plan_downgrade, describe_out_of_order
+    from database_engine import FEATURE_SERVER_TIMING, FEATURE_SESSION_SETTINGS, FEATURE_COPY, \
+        FEATURE_SCHEMA_DUMP, FEATURE_CONCURRENT_INDEXES, FEATURE_TABLE_STATISTICS, FEATURE_PARALLEL_MIGRATIONS, \
+        FEATURE_BACKFILLS, FEATURE_SERVER_CURSORS, FEATURE_SCHEMA_SNAPSHOTS, FEATURE_MIGRATE_LOCKS, engine_for
+    from migration_graph import WORKERS_SETTING, WORKERS_DEFAULT, MigrationScheduler, build_migration_graph
+    from schema_catalog import CATALOG_FETCH_SIZE, read_schema_snapshot
+    from schema_gate import QUERY_CREATE_FINGERPRINT_TABLE, QUERY_DROP_FINGERPRINT_TABLE, \
+        QUERY_SAVE_SCHEMA_FINGERPRINT, recorded_fingerprint, compare_fingerprints
 
 
 def create_table_drop_query(table_name):
     return "DROP TABLE IF EXISTS {0} CASCADE;".format(table_name)
 
 
-QUERY_LIST_FUNCTIONS = "SELECT routine_name " \
-                       "FROM information_schema.routines " \
-                       "WHERE routine_type='FUNCTION' " \
-                       "AND specific_schema='public';"
+QUERY_DATABASE_CURRENT_VERSION = "SELECT MAX(version) FROM version_migration"
 
-QUERY_LIST_TABLES = "SELECT table_name " \
-                    "FROM information_schema.tables " \
-                    "WHERE table_schema = 'public';"
+QUERY_DATABASE_INSERT_MIGRATIONS = "INSERT INTO version_migration(version, checksum, duration, server_duration, " \
+                                   "script_bytes) VALUES {0};"
 
-QUERY_CREATE_MIGRATION_TABLE = 'CREATE TABLE IF NOT EXISTS "version_migration" ' \
-                               '(version INTEGER, migrated_at INTEGER DEFAULT EXTRACT(EPOCH FROM CURRENT_TIMESTAMP));'
+QUERY_DATABASE_MIGRATION_CHECKSUMS = "SELECT version, checksum FROM version_migration ORDER BY version;"
 
-QUERY_DROP_MIGRATION_TABLE = 'DROP TABLE IF EXISTS "version_migration";'
+QUERY_SAVEPOINT_MIGRATION = "SAVEPOINT stickshift_migration;"
 
-QUERY_DATABASE_MIGRATIONS_TABLE_EXISTS = "SELECT EXISTS (" \
-                                         "SELECT 1 " \
-                                         "FROM information_schema.tables " \
-                                         "WHERE table_schema = 'public' AND table_name = 'version_migration'" \
-                                         ");"
-QUERY_DATABASE_CURRENT_VERSION = "SELECT MAX(version) FROM version_migration"
+QUERY_RELEASE_AND_SAVEPOINT_MIGRATION = "RELEASE SAVEPOINT stickshift_migration; SAVEPOINT stickshift_migration;"
 
-QUERY_DATABASE_INSERT_MIGRATION = "INSERT INTO version_migration(version) VALUES({0});"
+QUERY_ROLLBACK_TO_SAVEPOINT_MIGRATION = "ROLLBACK TO SAVEPOINT stickshift_migration;"
 
 QUERY_DATABASE_DELETE_MIGRATION = "DELETE FROM version_migration WHERE version = {0};"
 
+QUERY_DATABASE_DELETE_MIGRATIONS = "DELETE FROM version_migration WHERE version IN ({0});"
+
 QUERY_DATABASE_MIGRATION_VERSIONS = "SELECT * FROM version_migration;"
 
+# The statements of a no-transaction migration completed so far, along with the checksum
+# of the script they were read from.
+QUERY_CREATE_CHECKPOINT_TABLE = 'CREATE TABLE IF NOT EXISTS "version_migration_checkpoint" ' \
+                                '(version INTEGER PRIMARY KEY, checksum VARCHAR(64), statements INTEGER);'
+
+QUERY_DROP_CHECKPOINT_TABLE = 'DROP TABLE IF EXISTS "version_migration_checkpoint";'
+
+QUERY_MIGRATION_CHECKPOINT = "SELECT checksum, statements FROM version_migration_checkpoint WHERE version = %s;"
+
+QUERY_SAVE_MIGRATION_CHECKPOINT = "INSERT INTO version_migration_checkpoint (version, checksum, statements) " \
+                                  "VALUES (%s, %s, %s) " \
+                                  "ON CONFLICT (version) DO UPDATE SET checksum = EXCLUDED.checksum, " \
+                                  "statements = EXCLUDED.statements;"
+
+# Appended to the query recording the version, so the checkpoint is only forgotten along with it.
+QUERY_DELETE_MIGRATION_CHECKPOINT = "\n;DELETE FROM version_migration_checkpoint WHERE version = {0};"
+
+# The versions of a parallel migrate not recorded yet. Migrations are recorded as soon as they
+# are applied, so those left behind by a failed run are older than newer recorded ones, yet
+# still pending rather than out of order.
+QUERY_CREATE_INTERRUPTED_TABLE = 'CREATE TABLE IF NOT EXISTS "version_migration_interrupted" ' \
+                                 '(version INTEGER PRIMARY KEY);'
+
+QUERY_DROP_INTERRUPTED_TABLE = 'DROP TABLE IF EXISTS "version_migration_interrupted";'
+
+QUERY_INTERRUPTED_TABLE_EXISTS = "SELECT to_regclass('public.version_migration_interrupted') IS NOT NULL;"
+
+QUERY_INTERRUPTED_VERSIONS = "SELECT version FROM version_migration_interrupted ORDER BY version;"
+
+QUERY_SAVE_INTERRUPTED_VERSIONS = "DELETE FROM version_migration_interrupted;" \
+                                  "INSERT INTO version_migration_interrupted (version) " \
+                                  "SELECT UNNEST(%s::INTEGER[]);"
+
+# Appended to the query recording the version, so it is only forgotten once recorded.
+QUERY_DELETE_INTERRUPTED_VERSION = "\n;DELETE FROM version_migration_interrupted WHERE version = {0};"
+
+# Kept alongside the version table and dropped along with it, so they aren't listed as tables.
+VERSION_SIDE_TABLES = ["version_migration_backfill", "version_migration_checkpoint", "version_migration_fingerprint",
+                       "version_migration_interrupted"]
+
+QUERY_DROP_VERSION_SIDE_TABLES = [QUERY_DROP_BACKFILL_PROGRESS_TABLE, QUERY_DROP_CHECKPOINT_TABLE,
+                                  QUERY_DROP_INTERRUPTED_TABLE, QUERY_DROP_FINGERPRINT_TABLE]
+
+# Server-side cursors are named, and numbered so that streams can be nested.
+SERVER_CURSOR_NAMES = itertools.count()
+SERVER_CURSOR_NAME = "stickshift_stream_{0}"
+
 QUERY_RESET_DATABASE_MIGRATION_TABLE = create_table_drop_query("version_migration")
 
+QUERY_INVALID_INDEXES = "SELECT n.nspname, c.relname " \
+                        "FROM pg_index i " \
+                        "JOIN pg_class c ON c.oid = i.indexrelid " \
+                        "JOIN pg_namespace n ON n.oid = c.relnamespace " \
+                        "WHERE NOT i.indisvalid;"
+
+QUERY_DROP_INDEX_CONCURRENTLY = "DROP INDEX CONCURRENTLY IF EXISTS {0}.{1};"
+
+QUERY_SET_SETTING = "SET {0} = '{1}';"
+
+QUERY_RESET_SETTING = "RESET {0};"
+
+QUERY_SET_LOCAL_SETTING = "SET LOCAL {0} = '{1}';"
+
+QUERY_RESET_TIMEOUTS = "RESET lock_timeout; RESET statement_timeout;"
+
+QUERY_RESET_SESSION = "RESET ALL;"
+
+TRANSACTION_MODE_SETTING = "transaction"
+TRANSACTION_MODE_NONE = "none"
+TRANSACTION_MODE_BATCH = "batch"
+TRANSACTION_MODE_SAVEPOINT = "savepoint"
+TRANSACTION_MODES = [TRANSACTION_MODE_NONE, TRANSACTION_MODE_BATCH, TRANSACTION_MODE_SAVEPOINT]
+
+BULK_INSERT_CHUNK_SIZE = 1000
+MIGRATION_ROW_LENGTH = 5
+
+# Scripts at least this large are read and executed a few statements at a time
+# instead of being loaded into memory and sent as a single query.
+STREAMING_THRESHOLD_SETTING = "streaming_threshold"
+STREAMING_THRESHOLD_BYTES = 16 * 1024 * 1024
+STREAMING_BATCH_BYTES = 64 * 1024
+STREAMING_PROGRESS_INTERVAL = 5.0
+
+COPY_CONCURRENCY_SETTING = "copy_concurrency"
+COPY_DEFAULT_CONCURRENCY = 4
+
+# A migration failing to acquire a lock within lock_timeout is retried after a
+# jittered, exponentially growing delay until the retry budget is spent.
+LOCK_RETRY_BUDGET_SETTING = "lock_retry_budget"
+LOCK_RETRY_DEFAULT_BUDGET = 30.0
+LOCK_RETRY_BASE_DELAY = 0.1
+LOCK_RETRY_MAX_DELAY = 5.0
+SQLSTATE_LOCK_NOT_AVAILABLE = "55P03"
+
+# Migrations and downgrades of a database are serialized by a session-level advisory lock,
+# which Postgres scopes to the database. Processes finding it taken wait in the server
+# for up to migrate_lock_wait seconds, or indefinitely when it is 0.
+MIGRATE_LOCK_WAIT_SETTING = "migrate_lock_wait"
+MIGRATE_LOCK_DEFAULT_WAIT = 600.0
+QUERY_TRY_MIGRATE_LOCK = "SELECT pg_try_advisory_lock(hashtext('stickshift'), hashtext('migrate'));"
+QUERY_MIGRATE_LOCK = "SELECT pg_advisory_lock(hashtext('stickshift'), hashtext('migrate'));"
+QUERY_MIGRATE_UNLOCK = "SELECT pg_advisory_unlock(hashtext('stickshift'), hashtext('migrate'));"
+
+VERIFY_STATUS_OK = "ok"
+VERIFY_STATUS_MODIFIED = "modified"
+VERIFY_STATUS_MISSING = "missing"
+VERIFY_STATUS_UNRECORDED = "unrecorded"
+
+
+def sql_value(value):
+    if value is None:
+        return "NULL"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'{0}'".format(value)
+
+
+def create_bulk_insert_migrations_query(rows):
+    """Inserts ``(version, checksum[, duration, server_duration, script_bytes])`` rows into the version table."""
+    queries = []
+    for start in range(0, len(rows), BULK_INSERT_CHUNK_SIZE):
+        chunk = rows[start:start + BULK_INSERT_CHUNK_SIZE]
+        queries.append(QUERY_DATABASE_INSERT_MIGRATIONS.format(", ".join(
+            "({0})".format(", ".join(sql_value(value) for value in tuple(row) + (None,) * (MIGRATION_ROW_LENGTH - len(row))))
+            for row in chunk)))
+    return "\n".join(queries)
+
+
+def create_bulk_delete_migrations_query(versions):
+    """Deletes the version rows of several migrations."""
+    queries = []
+    for start in range(0, len(versions), BULK_INSERT_CHUNK_SIZE):
+        chunk = versions[start:start + BULK_INSERT_CHUNK_SIZE]
+        queries.append(QUERY_DATABASE_DELETE_MIGRATIONS.format(", ".join(str(int(version)) for version in chunk)))
+    return "\n".join(queries)
+
+
+def migrations_through(migration_list, version):
+    """Returns the migrations of an ascending list up to and including ``version``."""
+    if version is None:
+        return migration_list
+    return [migration_file_name for migration_file_name in migration_list
+            if int(find_migration_index(migration_file_name)) <= version]
+
+
+def downgrade_range(downgrade_list, steps=None, version=None):
+    """Returns the downgrades, newest first, undoing ``steps`` migrations or every migration after ``version``.
+
+    Without either only the newest migration is undone.
+    """
+    if steps is not None and version is not None:
+        raise InvalidMigrationRangeError("A downgrade is limited either by steps or by a version, not both")
+    if version is not None:
+        return [migration_file_name for migration_file_name in downgrade_list
+                if int(find_migration_index(migration_file_name)) > version]
+    steps = 1 if steps is None else steps
+    if steps < 1:
+        raise InvalidMigrationRangeError("{0} is not a valid number of steps, expected at least 1".format(steps))
+    return downgrade_list[:steps]
+
+
+class InvalidTransactionModeError(Exception):
+    pass
+
+
+class InvalidMigrationRangeError(Exception):
+    pass
+
+
+class ChangedMigrationError(Exception):
+    pass
+
+
+class MigrateLockTimeoutError(Exception):
+    pass
+
+
+def connect_database(database_config):
+    return engine_for(database_config).connect(database_config)
+
+
+def describe_statement_failure(migration_file_name, batch, first_statement, error):
+    """Names the statement of a batch that failed, using the error position reported by the server."""
+    failed_statement = first_statement + len(batch)
+    position = getattr(getattr(error, "diag", None), "statement_position", None)
+    if position is None:
+        return "Migration:{0} failed between statements {1} and {2}".format(
+            migration_file_name, first_statement + 1, failed_statement)
+    offset = 0
+    for idx, statement in enumerate(batch):
+        offset += len(statement)
+        if int(position) <= offset:
+            failed_statement = first_statement + idx + 1
+            break
+    return "Migration:{0} failed at statement {1}".format(migration_file_name, failed_statement)
+
+
+def quote_identifier(name):
+    return '"{0}"'.format(name.replace('"', '""'))
+
+
+def script_directives(path):
+    if is_copy_migration(path) or is_backfill_migration(path):
+        return {}
+    return read_script_directives(path)
+
+
+def script_timeouts(timeouts, path):
+    """Returns the lock and statement timeouts of a migration, its header directives taking precedence."""
+    timeouts = dict(timeouts)
+    directives = script_directives(path)
+    for setting in DIRECTIVE_TIMEOUTS:
+        if setting in directives:
+            timeouts[setting] = directives[setting]
+    return timeouts
+
+
+def is_non_transactional_script(path):
+    # A backfill commits every batch on its own.
+    return is_backfill_migration(path) or script_directives(path).get(DIRECTIVE_NO_TRANSACTION) is True
+
+
+def baseline_versions(migration_repository, baseline_version):
+    """Returns the ``(version, checksum)`` of every upgrade script covered by a baseline."""
+    return [(entry[ENTRY_VERSION], migration_repository.upgrade_checksum(entry))
+            for entry in migration_repository.upgrade_index(checksums=True).entries
+            if entry[ENTRY_VERSION] <= baseline_version]
+
+
+def is_lock_timeout(error):
+    return getattr(error, "pgcode", None) == SQLSTATE_LOCK_NOT_AVAILABLE
+
+
+def lock_retry_delay(attempt):
+    return random.uniform(0, min(LOCK_RETRY_MAX_DELAY, LOCK_RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def print_output(message):
+    print(message)
+
 
 class DatabaseManager:
 
-    def __init__(self, migration_repository, environment):
+    def __init__(self, migration_repository, environment, database_config=None, connection=None, output=None,
+                 listeners=None):
         self.migration_repository = migration_repository
         self.environment = environment
-        self.database_config = migration_repository.database_config(self.environment)
-        self.connection = None
-        if self.database_config is not None:
-            self.connection = psycopg2.connect(host=self.database_config["host"],
-                                               port=self.database_config["port"],
-                                               user=self.database_config["username"],
-                                               password=self.database_config["password"],
-                                               database=self.database_config["database"])
+        self.output = output or print_output
+        self.listeners = list(listeners or [])
+        self.timer = None
+        # Counts the migrations, downgrades and baselines started, which tells whether an operation changed anything.
+        self.started_migrations = 0
+        if database_config is None:
+            database_config = migration_repository.database_config(self.environment)
+        self.database_config = database_config
+        self.engine = engine_for(database_config)
+        self.transaction_mode = migration_repository.environment_setting(environment,
+                                                                         TRANSACTION_MODE_SETTING,
+                                                                         TRANSACTION_MODE_NONE)
+        self.out_of_order = migration_repository.environment_setting(environment,
+                                                                     OUT_OF_ORDER_SETTING,
+                                                                     OUT_OF_ORDER_WARN)
+        self.workers = int(migration_repository.environment_setting(environment, WORKERS_SETTING, WORKERS_DEFAULT))
+        self.streaming_threshold = int(migration_repository.environment_setting(environment,
+                                                                                STREAMING_THRESHOLD_SETTING,
+                                                                                STREAMING_THRESHOLD_BYTES))
+        self.copy_concurrency = int(migration_repository.environment_setting(environment,
+                                                                             COPY_CONCURRENCY_SETTING,
+                                                                             COPY_DEFAULT_CONCURRENCY))
+        self.timeouts = dict((setting, migration_repository.environment_setting(environment, setting))
+                             for setting in DIRECTIVE_TIMEOUTS)
+        for setting, value in self.timeouts.items():
+            if value is not None:
+                validate_timeout(setting, value)
+        self.lock_retry_budget = float(migration_repository.environment_setting(environment,
+                                                                                LOCK_RETRY_BUDGET_SETTING,
+                                                                                LOCK_RETRY_DEFAULT_BUDGET))
+        self.migrate_lock_wait = float(migration_repository.environment_setting(environment,
+                                                                                MIGRATE_LOCK_WAIT_SETTING,
+                                                                                MIGRATE_LOCK_DEFAULT_WAIT))
+        self.pg_dump = migration_repository.environment_setting(environment, PG_DUMP_SETTING, PG_DUMP_DEFAULT_COMMAND)
+        self.timeouts_applied = False
+        self.resume = False
+        self.connection = connection
+        self.version_table_upgraded = False
+        if self.connection is None and self.database_config is not None:
+            self.connection = connect_database(self.database_config)
+        if self.connection is not None:
             self.connection.autocommit = True
 
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
     def provision_database(self):
         if self.is_database_provisioned():
+            self.upgrade_version_table()
             return False
         else :
-            self.execute_create(QUERY_CREATE_MIGRATION_TABLE)
+            self.execute_create(self.engine.query_create_version_table)
             return True
 
     def deprovision_database(self):
         if self.is_database_provisioned():
-            self.execute_create(QUERY_DROP_MIGRATION_TABLE)
+            self.execute_create(self.engine.query_drop_version_table)
+            for query in QUERY_DROP_VERSION_SIDE_TABLES:
+                self.execute_create(query)
             return True
         else:
             return False
 
     def is_database_provisioned(self):
-        result = self.execute_fetch(QUERY_DATABASE_MIGRATIONS_TABLE_EXISTS)
-        return result[0]
+        result = self.execute_fetch(self.engine.query_version_table_exists)
+        return bool(result[0])
+
+    def upgrade_version_table(self):
+        if not self.version_table_upgraded:
+            self.execute_create(self.engine.query_upgrade_version_table)
+            self.version_table_upgraded = True
 
     def current_database_migration_version(self):
         result = self.execute_fetch(QUERY_DATABASE_CURRENT_VERSION)
         return result[0]
 
+    def applied_versions(self):
+        return self.execute_fetch(QUERY_DATABASE_APPLIED_VERSIONS)
+
     def list_migrations(self):
         return self.migration_repository.current_migrations_list()
 
     def list_procedures(self):
-        return self.execute_fetch(QUERY_LIST_FUNCTIONS)
+        if self.engine.query_list_functions is None:
+            return []
+        return [row[0] for row in self.stream_rows(self.engine.query_list_functions)]
 
     def list_tables(self):
-        return self.execute_fetch(QUERY_LIST_TABLES)
+        return [row[0] for row in self.stream_rows(self.engine.query_list_tables)
+                if row[0] not in VERSION_SIDE_TABLES]
+
+    def schema_snapshot(self):
+        """Reads the tables, columns, indexes and functions of the database, along with its version."""
+        self.engine.require(FEATURE_SCHEMA_SNAPSHOTS)
+        version = self.current_database_migration_version() if self.is_database_provisioned() else None
+        snapshot = read_schema_snapshot(self.stream_rows, environment=self.environment, version=version)
+        # Side tables come and go with the operations run on a database, so they would only show up in diffs.
+        for table in VERSION_SIDE_TABLES:
+            snapshot.tables.pop(table, None)
+        snapshot.indexes = dict((name, index) for name, index in snapshot.indexes.items()
+                                if index["table"] not in VERSION_SIDE_TABLES)
+        return snapshot
+
+    def add_listener(self, listener):
+        """Registers a callable receiving a ``MigrationEvent`` as every migration and downgrade begins and ends."""
+        self.listeners.append(listener)
+
+    def notify(self, event):
+        for listener in self.listeners:
+            listener(event)
+
+    def start_timer(self, direction, migration_file_name, version_index, path):
+        self.started_migrations += 1
+        self.timer = MigrationTimer(direction=direction,
+                                    migration_file_name=migration_file_name,
+                                    version=int(version_index),
+                                    script_bytes=os.path.getsize(path))
+        self.notify(self.timer.event(EVENT_BEGIN))
+        return self.timer
+
+    def finish_timer(self, timer, error=None):
+        timer.stop()
+        self.notify(timer.event(EVENT_FAILED if error is not None else EVENT_END, error=error))
+        if self.timer is timer:
+            self.timer = None
+
+    def migration_row(self, version_index, checksum):
+        if self.timer is None:
+            return int(version_index), checksum
+        return self.timer.row(checksum)
+
+    def execute_timed(self, cursor, query):
+        """Executes a query, adding the time the server spent on it to the running migration."""
+        if self.timer is None:
+            cursor.execute(query)
+            return
+        if not self.engine.supports(FEATURE_SERVER_TIMING) or \
+                (self.connection.autocommit and not can_time_query(query)):
+            self.timer.untimed()
+            cursor.execute(query)
+            return
+        cursor.execute(query + QUERY_SERVER_DURATION)
+        self.timer.add_server_duration(cursor.fetchone()[0])
+
+    def migration_history(self):
+        """Returns a ``HistoryEntry`` for every applied version, with the timings recorded when it was applied."""
+        upgrade_index = self.migration_repository.upgrade_index()
+        with self.connection.cursor() as cursor:
+            cursor.execute(self.engine.query_migration_history)
+            return [HistoryEntry(version=version,
+                                 migration_file_name=upgrade_index.file_name_for_version(version),
+                                 duration=duration,
+                                 server_duration=server_duration,
+                                 script_bytes=script_bytes,
+                                 migrated_at=migrated_at)
+                    for version, duration, server_duration, script_bytes, migrated_at in cursor]
 
     def execute_create(self, query=None):
         if query is not None:
@@ -98,63 +498,948 @@ class DatabaseManager:
                 results = [row[0] for row in cursor]
                 return results
 
-    def migrate(self):
-        migration_list = self.migration_repository.current_migrations_list()
-        current_migration_version = self.current_database_migration_version()
-        if current_migration_version is not None:
-            migration_list = migration_list[(current_migration_version+1):]
-        for idx, migration_file_name in enumerate(migration_list):
-            self.execute_migration(migration_file_name=migration_file_name,
-                                   version_index=find_migration_index(migration_file_name))
-
-    def upgrade(self):
-        migration_list = self.migration_repository.current_migrations_list()
-        current_migration_version = self.current_database_migration_version()
-        if current_migration_version is not None:
-            migration_list = migration_list[(current_migration_version+1):]
+    def stream_rows(self, query, parameters=None):
+        """Yields the rows of a query, fetched ``CATALOG_FETCH_SIZE`` rows at a time through a server-side cursor.
+
+        Outside of a transaction, one is begun for the cursor and rolled back once the rows are read.
+        """
+        if not self.engine.supports(FEATURE_SERVER_CURSORS):
+            with self.connection.cursor() as cursor:
+                cursor.execute(query, parameters)
+                for row in cursor:
+                    yield row
+            return
+        autocommit = self.connection.autocommit
+        self.connection.autocommit = False
+        try:
+            with self.connection.cursor(name=SERVER_CURSOR_NAME.format(next(SERVER_CURSOR_NAMES))) as cursor:
+                cursor.itersize = CATALOG_FETCH_SIZE
+                cursor.execute(query, parameters)
+                for row in cursor:
+                    yield row
+        finally:
+            if autocommit and not self.connection.closed:
+                self.connection.rollback()
+                self.connection.autocommit = True
+
+    def upgrade_plan(self, out_of_order=None):
+        """Returns the ``UpgradePlan`` of the database under the given, or the configured, out of order policy."""
+        upgrade_index = self.migration_repository.upgrade_index()
+        applied_versions = self.applied_versions()
+        plan = plan_upgrade(upgrade_index=upgrade_index,
+                            applied_versions=applied_versions,
+                            policy=out_of_order or self.out_of_order)
+        if plan.out_of_order:
+            interrupted_versions = self.interrupted_versions()
+            if interrupted_versions:
+                plan = plan_upgrade(upgrade_index=upgrade_index,
+                                    applied_versions=applied_versions,
+                                    policy=out_of_order or self.out_of_order,
+                                    interrupted_versions=interrupted_versions)
+        return plan
+
+    def interrupted_versions(self):
+        """Returns the versions a failed parallel migrate left unrecorded."""
+        if not self.engine.supports(FEATURE_PARALLEL_MIGRATIONS) or \
+                not self.execute_fetch(QUERY_INTERRUPTED_TABLE_EXISTS)[0]:
+            return []
+        return self.execute_fetch(QUERY_INTERRUPTED_VERSIONS)
+
+    def pending_migrations(self, out_of_order=None):
+        return self.upgrade_plan(out_of_order=out_of_order).pending
+
+    def checked_upgrade_plan(self, out_of_order=None):
+        """Returns the upgrade plan, refusing it or reporting the migrations it skips as its policy says."""
+        plan = self.upgrade_plan(out_of_order=out_of_order)
+        if plan.out_of_order:
+            if plan.policy == OUT_OF_ORDER_ERROR:
+                raise OutOfOrderMigrationError(describe_out_of_order(plan))
+            self.output("{0}, {1}".format(describe_out_of_order(plan), "skipped" if plan.skipped() else "applying"))
+        return plan
+
+    def applied_downgrades(self):
+        applied_versions = self.applied_versions()
+        if not applied_versions:
+            return None
+        return plan_downgrade(self.migration_repository.downgrade_index(), applied_versions)
+
+    def migrate(self, transaction_mode=None, out_of_order=None, to=None, workers=None, resume=False):
+        """Applies the pending migrations, only up to and including version ``to`` when given.
+
+        With more than one worker, migrations that don't depend on each other are applied
+        at the same time over separate connections. With ``resume``, a ``no-transaction``
+        migration that failed part way continues after its last completed statement.
+        """
+        transaction_mode = transaction_mode or self.transaction_mode
+        if transaction_mode not in TRANSACTION_MODES:
+            raise InvalidTransactionModeError("{0} is not a valid transaction mode, expected one of: {1}".format(
+                transaction_mode, ", ".join(TRANSACTION_MODES)))
+        out_of_order = validate_out_of_order_policy(out_of_order or self.out_of_order)
+        workers = int(workers or self.workers)
+        if workers > 1:
+            if transaction_mode != TRANSACTION_MODE_NONE:
+                raise InvalidTransactionModeError("Migrations can only be applied by several workers in the {0} "
+                                                  "transaction mode".format(TRANSACTION_MODE_NONE))
+            self.engine.require(FEATURE_PARALLEL_MIGRATIONS)
+
+        self.resume = resume
+        try:
+            # A database that is already up to date is left alone without waiting for the lock,
+            # and the plan is made again once the lock is held, since whoever held it may have
+            # applied the pending migrations meanwhile.
+            plan = self.upgrade_plan(out_of_order=out_of_order)
+            if plan.newest_version is not None and not plan.out_of_order and not migrations_through(plan.pending, to):
+                if not plan.pending and not plan.unknown:
+                    # Databases migrated before fingerprints were recorded get one on their next migrate.
+                    self.record_fingerprint(plan=plan, only_if_changed=True)
+                return []
+            return self.with_migrate_lock(lambda: self.apply_pending_migrations(transaction_mode=transaction_mode,
+                                                                                out_of_order=out_of_order,
+                                                                                to=to,
+                                                                                workers=workers))
+        finally:
+            self.resume = False
+
+    def apply_pending_migrations(self, transaction_mode, out_of_order, to, workers):
+        self.apply_baseline(to=to)
+        migration_list = migrations_through(self.checked_upgrade_plan(out_of_order=out_of_order).pending, to)
+        if migration_list:
+            self.upgrade_version_table()
+        if transaction_mode == TRANSACTION_MODE_NONE and workers > 1 and len(migration_list) > 1:
+            self.execute_parallel_migrations(migration_list=migration_list, workers=workers)
+        elif transaction_mode == TRANSACTION_MODE_NONE:
+            for idx, migration_file_name in enumerate(migration_list):
+                self.execute_migration(migration_file_name=migration_file_name,
+                                       version_index=find_migration_index(migration_file_name))
+        else:
+            # Migrations that can't run inside a transaction split the batch, and are
+            # applied on their own between the batches before and after them.
+            for transactional, segment in itertools.groupby(migration_list, key=lambda migration_file_name:
+                                                            not self.is_non_transactional(migration_file_name)):
+                segment = list(segment)
+                if not transactional:
+                    for migration_file_name in segment:
+                        self.execute_migration(migration_file_name=migration_file_name,
+                                               version_index=find_migration_index(migration_file_name))
+                    continue
+                # A batch that timed out is rolled back, or committed up to the failed migration
+                # with savepoints, so every retry starts again from whatever is still pending.
+                self.with_lock_retry(lambda attempt, segment=segment: self.execute_migration_batch(
+                    migration_list=segment if attempt == 0 else self.still_pending(segment, out_of_order),
+                    savepoints=transaction_mode == TRANSACTION_MODE_SAVEPOINT),
+                    "batch of {0} migrations".format(len(segment)))
+        return migration_list
+
+    def migration_graph(self, migration_list):
+        """Builds the dependency graph of pending migrations from their directives and the tables they touch."""
+        declared = {}
+        tables = {}
+        for migration_file_name in migration_list:
+            path = self.upgrade_script_path(migration_file_name)
+            declared[migration_file_name] = script_directives(path).get(DIRECTIVE_DEPENDS)
+            if is_copy_migration(migration_file_name) or is_backfill_migration(migration_file_name):
+                tables[migration_file_name] = None
+                continue
+            with open(path, "rb") as script_file:
+                tables[migration_file_name] = script_tables(StatementLexer(ScriptReader(script_file).read))
+        return build_migration_graph(migration_list=migration_list,
+                                     declared=declared,
+                                     tables=tables,
+                                     applied_versions=self.applied_versions())
+
+    def execute_parallel_migrations(self, migration_list, workers):
+        """Applies migrations over several connections, each waiting for the migrations it depends on.
+
+        Every migration is committed and recorded as soon as it is applied, so none holds
+        its locks while older ones run. The versions of the run are saved beforehand and
+        forgotten as they are recorded, so those a failure leaves behind stay pending.
+        """
+        graph = self.migration_graph(migration_list)
+        scheduler = MigrationScheduler(graph=graph, workers=workers)
+        self.started_migrations += len(migration_list)
+        with self.connection.cursor() as cursor:
+            cursor.execute(QUERY_CREATE_INTERRUPTED_TABLE)
+            cursor.execute(QUERY_SAVE_INTERRUPTED_VERSIONS,
+                           ([int(find_migration_index(migration_file_name)) for migration_file_name in migration_list],))
+        output_lock = threading.Lock()
+
+        def output(message):
+            with output_lock:
+                self.output(message)
+
+        managers = []
+        try:
+            for worker in range(scheduler.workers):
+                managers.append(DatabaseManager(migration_repository=self.migration_repository,
+                                                environment=self.environment,
+                                                database_config=self.database_config,
+                                                output=output,
+                                                listeners=self.listeners))
+                managers[-1].resume = self.resume
+            return scheduler.run(lambda worker, migration_file_name:
+                                 managers[worker].execute_scheduled_migration(migration_file_name))
+        finally:
+            for database_manager in managers:
+                database_manager.close()
+
+    def execute_scheduled_migration(self, migration_file_name):
+        """Applies and records a migration for a ``MigrationScheduler``."""
+        version_index = find_migration_index(migration_file_name)
+        timer = self.start_timer(DIRECTION_UPGRADE, migration_file_name, version_index,
+                                 self.upgrade_script_path(migration_file_name))
+        non_transactional = self.is_non_transactional(migration_file_name)
+        try:
+            if non_transactional:
+                with self.connection.cursor() as cursor:
+                    self.apply_timeouts(cursor=cursor, migration_file_name=migration_file_name)
+                    checksum = self.execute_non_transactional_migration(cursor=cursor,
+                                                                        migration_file_name=migration_file_name)
+                    timer.stop()
+                    cursor.execute(self.record_migration_query(migration_file_name, timer.row(checksum)) +
+                                   QUERY_DELETE_INTERRUPTED_VERSION.format(int(version_index)))
+            else:
+                self.connection.autocommit = False
+                self.with_lock_retry(lambda attempt: self.execute_scheduled_migration_attempt(
+                    migration_file_name=migration_file_name, version_index=version_index), migration_file_name)
+                self.connection.commit()
+                timer.stop()
+        except Exception as error:
+            if not self.connection.closed and not self.connection.autocommit:
+                self.connection.rollback()
+            self.finish_timer(timer, error=error)
+            raise
+        finally:
+            if not self.connection.closed:
+                self.connection.autocommit = True
+            self.reset_timeouts()
+        self.finish_timer(timer)
+        self.output("Migration:{0} completed".format(migration_file_name))
+
+    def execute_scheduled_migration_attempt(self, migration_file_name, version_index):
+        try:
+            with self.connection.cursor() as cursor:
+                checksum = self.execute_upgrade_script(cursor=cursor, migration_file_name=migration_file_name)
+                cursor.execute(create_bulk_insert_migrations_query([self.migration_row(version_index, checksum)]) +
+                               QUERY_DELETE_INTERRUPTED_VERSION.format(int(version_index)))
+            return checksum
+        except Exception:
+            self.connection.rollback()
+            raise
+
+    def apply_baseline(self, to=None):
+        """Applies the latest baseline to a database without any migrations, recording every version it covers.
+
+        Returns the baseline file name, or None when the database has already been migrated or when
+        migrating only up to ``to``, a version before the baseline's, which applies the migrations instead.
+        """
+        baseline = self.migration_repository.latest_baseline()
+        if baseline is None or self.current_database_migration_version() is not None:
+            return None
+        baseline_version, baseline_file_name = baseline
+        if to is not None and to < baseline_version:
+            return None
+        path = self.migration_repository.repository_baseline_path() + "/" + baseline_file_name
+        covered = baseline_versions(self.migration_repository, baseline_version)
+        self.upgrade_version_table()
+        self.started_migrations += 1
+        self.connection.autocommit = False
+        try:
+            with self.connection.cursor() as cursor:
+                if os.path.getsize(path) >= self.streaming_threshold:
+                    self.execute_streamed_script(cursor=cursor, path=path, migration_file_name=baseline_file_name)
+                else:
+                    with open(path, "r") as script:
+                        cursor.execute(script.read())
+                # Dumps change session settings such as the search path, which the
+                # version table and later migrations rely on.
+                if self.engine.supports(FEATURE_SESSION_SETTINGS):
+                    cursor.execute(QUERY_RESET_SESSION)
+                    self.timeouts_applied = False
+                if covered:
+                    cursor.execute(create_bulk_insert_migrations_query(covered))
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        finally:
+            self.connection.autocommit = True
+        self.output("Baseline:{0} completed, {1} migrations recorded".format(baseline_file_name, len(covered)))
+        return baseline_file_name
+
+    def dump_baseline(self, version, data_tables=()):
+        """Dumps the schema of the database as a baseline for every migration through ``version``."""
+        self.engine.require(FEATURE_SCHEMA_DUMP)
+        return dump_baseline(command=self.pg_dump,
+                             database_config=self.database_config,
+                             version=version,
+                             data_tables=data_tables)
+
+    def still_pending(self, migration_list, out_of_order=None):
+        pending = set(self.pending_migrations(out_of_order=out_of_order))
+        return [migration_file_name for migration_file_name in migration_list if migration_file_name in pending]
+
+    def upgrade(self, out_of_order=None):
+        self.with_migrate_lock(lambda: self.apply_next_migration(out_of_order=out_of_order))
+
+    def apply_next_migration(self, out_of_order=None):
+        migration_list = self.checked_upgrade_plan(out_of_order=out_of_order).pending
         next_migration = migration_list[0]
+        self.upgrade_version_table()
         self.execute_migration(migration_file_name=next_migration,
                                version_index=find_migration_index(migration_file_name=next_migration))
 
-    def reset(self, limit=0):
-        downgrade_list = self.migration_repository.current_downgrade_list()
-        current_migration_version = self.current_database_migration_version()
-        limit = current_migration_version
-        if current_migration_version is not None:
-            downgrade_list = downgrade_list[0:limit+1]
-        else:
+    def reset(self):
+        self.with_migrate_lock(self.undo_applied_migrations)
+
+    def undo_applied_migrations(self):
+        downgrade_list = self.applied_downgrades()
+        if downgrade_list is None:
             return
-        downgrade_list.reverse()
-        for idx, migration_file_name in enumerate(downgrade_list):
-            self.execute_downgrade(migration_file_name=migration_file_name,
-                                   version_index=find_migration_index(migration_file_name))
-
-    def downgrade(self):
-        downgrade_list = self.migration_repository.current_downgrade_list()
-        current_migration_version = self.current_database_migration_version()
-        limit = current_migration_version
-        if current_migration_version is not None:
-            downgrade_list = downgrade_list[0:limit+1]
-        else:
+        self.execute_downgrades(downgrade_list)
+
+    def downgrade(self, steps=None, to=None):
+        """Undoes the newest migration, the newest ``steps`` migrations or every migration after version ``to``.
+
+        Returns whether anything was downgraded.
+        """
+        return self.with_migrate_lock(lambda: self.undo_migrations(steps=steps, to=to))
+
+    def undo_migrations(self, steps=None, to=None):
+        downgrade_list = self.applied_downgrades()
+        if not downgrade_list:
             return False
-        downgrade_list.reverse()
-        next_migration = downgrade_list[0]
-        self.execute_downgrade(migration_file_name=next_migration,
-                               version_index=find_migration_index(migration_file_name=next_migration))
+        downgrade_list = downgrade_range(downgrade_list, steps=steps, version=to)
+        if not downgrade_list:
+            return False
+        self.execute_downgrades(downgrade_list)
         return True
 
+    def downgrade_script_path(self, migration_file_name):
+        return self.migration_repository.repository_downgrade_path() + "/" + migration_file_name
+
+    def execute_downgrades(self, downgrade_list):
+        """Runs downgrades newest first, each run of scripts that can run in a transaction in a single one.
+
+        Scripts that can't run inside a transaction are run on their own between them.
+        """
+        for transactional, segment in itertools.groupby(downgrade_list, key=lambda migration_file_name:
+                                                        not is_non_transactional_script(
+                                                            self.downgrade_script_path(migration_file_name))):
+            segment = list(segment)
+            if transactional:
+                self.execute_downgrade_batch(segment)
+                continue
+            for migration_file_name in segment:
+                self.execute_downgrade(migration_file_name=migration_file_name,
+                                       version_index=find_migration_index(migration_file_name))
+
+    def read_upgrade_script(self, migration_file_name):
+        """Returns the script contents along with the SHA-256 checksum of its bytes."""
+        with open(self.upgrade_script_path(migration_file_name), "rb") as script:
+            contents = script.read()
+        return contents.decode("utf-8"), hashlib.sha256(contents).hexdigest()
+
+    def upgrade_script_path(self, migration_file_name):
+        return self.migration_repository.repository_upgrade_path() + "/" + migration_file_name
+
+    def is_non_transactional(self, migration_file_name):
+        return is_non_transactional_script(self.upgrade_script_path(migration_file_name))
+
+    def is_streamed_script(self, migration_file_name):
+        if is_copy_migration(migration_file_name) or is_backfill_migration(migration_file_name):
+            return False
+        return os.path.getsize(self.upgrade_script_path(migration_file_name)) >= self.streaming_threshold
+
+    def execute_upgrade_script(self, cursor, migration_file_name):
+        """Executes an upgrade script on the cursor and returns its checksum."""
+        self.apply_timeouts(cursor=cursor, migration_file_name=migration_file_name)
+        if is_copy_migration(migration_file_name):
+            return self.execute_copy_migration(cursor=cursor, migration_file_name=migration_file_name)
+        if self.is_streamed_script(migration_file_name):
+            return self.execute_streamed_script(cursor=cursor,
+                                                path=self.upgrade_script_path(migration_file_name),
+                                                migration_file_name=migration_file_name)
+        script, checksum = self.read_upgrade_script(migration_file_name)
+        self.execute_timed(cursor, script)
+        return checksum
+
+    def migration_timeouts(self, migration_file_name):
+        return script_timeouts(self.timeouts, self.upgrade_script_path(migration_file_name))
+
+    def with_migrate_lock(self, operation):
+        """Runs the operation holding the migrate lock of the database, on engines that have one.
+
+        The fingerprint of the database is recorded afterwards, even if the operation failed part way,
+        unless it found nothing to apply, as when another process applied it while this one waited.
+        """
+        locked = self.engine.supports(FEATURE_MIGRATE_LOCKS)
+        if locked:
+            self.acquire_migrate_lock()
+        started_migrations = self.started_migrations
+        try:
+            try:
+                result = operation()
+            except Exception:
+                try:
+                    self.record_fingerprint()
+                except Exception:
+                    pass
+                raise
+            if self.started_migrations != started_migrations:
+                self.record_fingerprint()
+            return result
+        finally:
+            if locked and not self.connection.closed:
+                with self.connection.cursor() as cursor:
+                    cursor.execute(QUERY_MIGRATE_UNLOCK)
+
+    def record_fingerprint(self, plan=None, only_if_changed=False):
+        """Records the fingerprint of the repository while the database is fully migrated, or clears it.
+
+        The newest applied version is recorded either way, which tells a database that is
+        behind the repository apart from one that is ahead of it.
+        """
+        if plan is None:
+            if not self.is_database_provisioned():
+                return
+            plan = self.upgrade_plan()
+        fingerprint = None
+        if not plan.pending and not plan.out_of_order and not plan.unknown:
+            fingerprint = self.migration_repository.fingerprint()
+        if only_if_changed and recorded_fingerprint(self.connection) == (fingerprint, plan.newest_version):
+            return
+        with self.connection.cursor() as cursor:
+            cursor.execute(QUERY_CREATE_FINGERPRINT_TABLE)
+            cursor.execute(QUERY_SAVE_SCHEMA_FINGERPRINT, (fingerprint, plan.newest_version))
+
+    def schema_status(self):
+        """Returns whether the database is up to date with, behind or ahead of the repository.
+
+        Unlike ``schema_gate.schema_status``, the fingerprint of the repository is read again on every call.
+        """
+        local = self.migration_repository.saved_fingerprint() or self.migration_repository.current_fingerprint()
+        return compare_fingerprints(local, recorded_fingerprint(self.connection))
+
+    def acquire_migrate_lock(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(QUERY_TRY_MIGRATE_LOCK)
+            if cursor.fetchone()[0]:
+                return
+        self.output("Database:{0} is being migrated by another process, waiting for it to finish".format(
+            self.environment))
+        # The wait is bounded by lock_timeout, set for this transaction only, while the
+        # lock itself is held by the session until it is unlocked.
+        self.connection.autocommit = False
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute(QUERY_SET_LOCAL_SETTING.format("lock_timeout",
+                                                              "{0}ms".format(int(self.migrate_lock_wait * 1000))))
+                cursor.execute(QUERY_MIGRATE_LOCK)
+            self.connection.commit()
+        except Exception as error:
+            if not self.connection.closed:
+                self.connection.rollback()
+            if is_lock_timeout(error):
+                raise MigrateLockTimeoutError("Database:{0} is still being migrated by another process after "
+                                              "{1:g}s".format(self.environment, self.migrate_lock_wait))
+            raise
+        finally:
+            if not self.connection.closed:
+                self.connection.autocommit = True
+
+    def with_lock_retry(self, operation, description):
+        """Runs the operation, running it again while it fails to acquire a lock within the retry budget."""
+        start = time.time()
+        attempt = 0
+        while True:
+            try:
+                return operation(attempt)
+            except Exception as error:
+                if not is_lock_timeout(error):
+                    raise
+                delay = lock_retry_delay(attempt)
+                if time.time() - start + delay > self.lock_retry_budget:
+                    raise
+                attempt += 1
+                self.output("Migration:{0} lock not available, retrying in {1:.2f}s (attempt {2})".format(
+                    description, delay, attempt + 1))
+                time.sleep(delay)
+
+    def apply_timeouts(self, cursor, migration_file_name):
+        if not self.engine.supports(FEATURE_SESSION_SETTINGS):
+            return
+        for setting, value in self.migration_timeouts(migration_file_name).items():
+            if value is not None:
+                cursor.execute(QUERY_SET_SETTING.format(setting, value))
+                self.timeouts_applied = True
+            elif self.timeouts_applied:
+                cursor.execute(QUERY_RESET_SETTING.format(setting))
+
+    def reset_timeouts(self):
+        if self.timeouts_applied and self.connection is not None and not self.connection.closed:
+            with self.connection.cursor() as cursor:
+                cursor.execute(QUERY_RESET_TIMEOUTS)
+            self.timeouts_applied = False
+
     def execute_migration(self,
                           migration_file_name=None,
                           version_index=None):
-        with self.connection.cursor() as cursor:
-            cursor.execute(open(self.migration_repository.repository_upgrade_path() + "/" + migration_file_name, "r").read())
-            cursor.execute(QUERY_DATABASE_INSERT_MIGRATION.format(version_index))
-            print("Migration:{0} completed".format(migration_file_name))
+        timer = self.start_timer(DIRECTION_UPGRADE, migration_file_name, version_index,
+                                 self.upgrade_script_path(migration_file_name))
+        try:
+            self.with_lock_retry(lambda attempt: self.execute_migration_attempt(
+                migration_file_name=migration_file_name, version_index=version_index), migration_file_name)
+        except Exception as error:
+            self.finish_timer(timer, error=error)
+            raise
+        self.finish_timer(timer)
+        self.output("Migration:{0} completed".format(migration_file_name))
+
+    def execute_migration_attempt(self,
+                                  migration_file_name=None,
+                                  version_index=None):
+        if self.is_non_transactional(migration_file_name):
+            try:
+                with self.connection.cursor() as cursor:
+                    self.apply_timeouts(cursor=cursor, migration_file_name=migration_file_name)
+                    checksum = self.execute_non_transactional_migration(cursor=cursor,
+                                                                        migration_file_name=migration_file_name)
+                    cursor.execute(self.record_migration_query(migration_file_name,
+                                                               self.migration_row(version_index, checksum)))
+            finally:
+                self.reset_timeouts()
+            return
+        if self.is_streamed_script(migration_file_name):
+            # A streamed script is sent in several queries, so it needs an explicit
+            # transaction to stay as atomic as a script sent in a single query.
+            self.connection.autocommit = False
+        try:
+            with self.connection.cursor() as cursor:
+                checksum = self.execute_upgrade_script(cursor=cursor, migration_file_name=migration_file_name)
+                cursor.execute(create_bulk_insert_migrations_query([self.migration_row(version_index, checksum)]))
+            if not self.connection.autocommit:
+                self.connection.commit()
+        except Exception:
+            if not self.connection.autocommit:
+                self.connection.rollback()
+            raise
+        finally:
+            self.connection.autocommit = True
+            self.reset_timeouts()
+
+    def execute_streamed_script(self, cursor, path, migration_file_name):
+        total_bytes = os.path.getsize(path)
+        statement_count = 0
+        last_progress = time.time()
+        with open(path, "rb") as script_file:
+            reader = ScriptReader(script_file)
+            batch = []
+            batch_length = 0
+            for statement in StatementLexer(reader.read):
+                batch.append(statement)
+                batch_length += len(statement)
+                if batch_length >= STREAMING_BATCH_BYTES:
+                    self.execute_statement_batch(cursor, migration_file_name, batch, statement_count)
+                    statement_count += len(batch)
+                    batch = []
+                    batch_length = 0
+                    if time.time() - last_progress >= STREAMING_PROGRESS_INTERVAL:
+                        self.output("Migration:{0} {1} statements, {2}/{3} bytes".format(
+                            migration_file_name, statement_count, reader.bytes_read, total_bytes))
+                        last_progress = time.time()
+            if batch:
+                self.execute_statement_batch(cursor, migration_file_name, batch, statement_count)
+                statement_count += len(batch)
+        self.output("Migration:{0} {1} statements executed".format(migration_file_name, statement_count))
+        return reader.checksum()
+
+    def execute_copy_migration(self, cursor, migration_file_name):
+        """Streams the data files of a copy migration into their tables and returns its checksum.
+
+        Outside of a transaction several tables are loaded at once over separate
+        connections, which are only committed once every table has loaded.
+        """
+        self.engine.require(FEATURE_COPY)
+        targets, checksum = read_copy_migration(path=self.upgrade_script_path(migration_file_name),
+                                                data_directory=self.migration_repository.repository_data_path(),
+                                                checksums=self.migration_repository.manifest.file_checksums)
+        if self.timer is not None:
+            self.timer.untimed()
+            self.timer.script_bytes = sum(os.path.getsize(target.path) for target in targets)
+        if len(targets) == 1 or self.copy_concurrency < 2 or not self.connection.autocommit:
+            for target in targets:
+                copy_target(cursor, target)
+                self.output("Migration:{0} loaded {1}".format(migration_file_name, target.table))
+            return checksum
+
+        def load(target):
+            try:
+                connection = connect_database(self.database_config)
+            except Exception as error:
+                return None, error
+            try:
+                with connection.cursor() as copy_cursor:
+                    copy_target(copy_cursor, target)
+                return connection, None
+            except Exception as error:
+                connection.rollback()
+                return connection, error
+
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(self.copy_concurrency, len(targets)))
+        try:
+            results = pool.map(load, targets, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        try:
+            errors = [error for connection, error in results if error is not None]
+            if errors:
+                raise errors[0]
+            for connection, error in results:
+                connection.commit()
+        finally:
+            for connection, error in results:
+                if connection is not None:
+                    connection.close()
+        for target in targets:
+            self.output("Migration:{0} loaded {1}".format(migration_file_name, target.table))
+        return checksum
+
+    def execute_statement_batch(self, cursor, migration_file_name, batch, first_statement):
+        try:
+            self.execute_timed(cursor, "".join(batch))
+        except self.engine.error_class() as error:
+            self.output(describe_statement_failure(migration_file_name, batch, first_statement, error))
+            raise
+
+    def execute_non_transactional_migration(self, cursor, migration_file_name):
+        if is_backfill_migration(migration_file_name):
+            return self.execute_backfill_migration(cursor=cursor, migration_file_name=migration_file_name)
+        return self.execute_non_transactional_script(cursor=cursor,
+                                                     path=self.upgrade_script_path(migration_file_name),
+                                                     migration_file_name=migration_file_name,
+                                                     version=int(find_migration_index(migration_file_name)))
+
+    def record_migration_query(self, migration_file_name, row):
+        """Returns the query recording a migration, which also forgets its checkpoint or backfill progress."""
+        query = create_bulk_insert_migrations_query([row])
+        if is_backfill_migration(migration_file_name):
+            query += QUERY_DELETE_BACKFILL_PROGRESS.format(int(row[0]))
+        else:
+            query += QUERY_DELETE_MIGRATION_CHECKPOINT.format(int(row[0]))
+        return query
+
+    def execute_backfill_migration(self, cursor, migration_file_name):
+        """Runs every backfill of a migration in batches committed on their own, and returns its checksum.
+
+        The last key of every committed batch is saved along with it, so a backfill that
+        failed or was interrupted resumes after the last committed batch.
+        """
+        self.engine.require(FEATURE_BACKFILLS)
+        targets, checksum = read_backfill_migration(self.upgrade_script_path(migration_file_name))
+        version = int(find_migration_index(migration_file_name))
+        if self.timer is not None:
+            self.timer.untimed()
+        cursor.execute(QUERY_CREATE_BACKFILL_PROGRESS_TABLE)
+        cursor.execute(QUERY_BACKFILL_PROGRESS, (version,))
+        progress = dict((target, (last_key, rows, finished)) for target, last_key, rows, finished in cursor.fetchall())
+        for target in targets:
+            last_key, rows, finished = progress.get(target.table, (None, 0, False))
+            if not finished:
+                self.execute_backfill_target(cursor=cursor,
+                                             migration_file_name=migration_file_name,
+                                             version=version,
+                                             target=target,
+                                             last_key=last_key,
+                                             rows=rows)
+        return checksum
+
+    def execute_backfill_target(self, cursor, migration_file_name, version, target, last_key, rows):
+        if last_key is not None:
+            self.output("Migration:{0} resuming {1} after {2} {3}".format(migration_file_name, target.table,
+                                                                          target.key, last_key))
+        batch_size = target.batch_size
+        batches = 0
+        last_progress = time.time()
+        while True:
+            cursor.execute(target.range_query(last_key), target.range_parameters(last_key, batch_size))
+            start, end = cursor.fetchone()
+            if end is None:
+                break
+            started = time.time()
+            rows += self.execute_backfill_batch(cursor=cursor, version=version, target=target, start=start, end=end,
+                                                rows=rows)
+            batch_size = target.next_batch_size(batch_size, time.time() - started)
+            batches += 1
+            last_key = str(end)
+            if time.time() - last_progress >= STREAMING_PROGRESS_INTERVAL:
+                self.output("Migration:{0} {1} {2} rows, {3} {4}, batches of {5}".format(
+                    migration_file_name, target.table, rows, target.key, last_key, batch_size))
+                last_progress = time.time()
+            if target.sleep:
+                time.sleep(target.sleep)
+        cursor.execute(QUERY_SAVE_BACKFILL_PROGRESS, (version, target.table, last_key, rows, True))
+        self.output("Migration:{0} backfilled {1} rows of {2} in {3} batches".format(migration_file_name, rows,
+                                                                                   target.table, batches))
+
+    def execute_backfill_batch(self, cursor, version, target, start, end, rows):
+        """Runs the backfill SQL over a key range and saves the progress in the same transaction."""
+        self.connection.autocommit = False
+        try:
+            cursor.execute(target.sql, {"start": start, "end": end})
+            updated = max(0, cursor.rowcount)
+            cursor.execute(QUERY_SAVE_BACKFILL_PROGRESS, (version, target.table, str(end), rows + updated, False))
+            self.connection.commit()
+            return updated
+        except Exception:
+            self.connection.rollback()
+            raise
+        finally:
+            self.connection.autocommit = True
+
+    def execute_non_transactional_script(self, cursor, path, migration_file_name, version=None):
+        """Executes every statement of a script on its own, outside of any transaction, and returns its checksum.
+
+        With a ``version``, the number of completed statements is saved after each one,
+        and a resumed migration skips the statements its checkpoint already completed.
+
+        Statements that fail to acquire a lock are retried on their own. Indexes left
+        invalid by a failed concurrent build are dropped before the error is raised.
+        """
+        invalid_indexes = set(self.invalid_indexes(cursor))
+        checksum = None
+        completed = 0
+        if version is not None:
+            checksum = file_checksum(path)
+            completed = self.migration_checkpoint(cursor=cursor, migration_file_name=migration_file_name,
+                                                  version=version, checksum=checksum)
+        with open(path, "rb") as script_file:
+            reader = ScriptReader(script_file)
+            for idx, statement in enumerate(StatementLexer(reader.read)):
+                if idx < completed:
+                    continue
+                self.with_lock_retry(lambda attempt: self.execute_non_transactional_statement(
+                    cursor=cursor,
+                    migration_file_name=migration_file_name,
+                    statement=statement,
+                    statement_index=idx,
+                    invalid_indexes=invalid_indexes,
+                    checkpointed=version is not None),
+                    "{0} statement {1}".format(migration_file_name, idx + 1))
+                if version is not None:
+                    cursor.execute(QUERY_SAVE_MIGRATION_CHECKPOINT, (version, checksum, idx + 1))
+        return reader.checksum()
+
+    def migration_checkpoint(self, cursor, migration_file_name, version, checksum):
+        """Returns the number of statements to skip, which is only ever more than 0 when resuming."""
+        cursor.execute(QUERY_CREATE_CHECKPOINT_TABLE)
+        if not self.resume:
+            return 0
+        cursor.execute(QUERY_MIGRATION_CHECKPOINT, (version,))
+        row = cursor.fetchone()
+        if row is None or not row[1]:
+            return 0
+        if row[0] != checksum:
+            raise ChangedMigrationError("{0} has changed since it failed at statement {1}, migrate it again "
+                                        "without --resume".format(migration_file_name, row[1] + 1))
+        self.output("Migration:{0} resuming after statement {1}".format(migration_file_name, row[1]))
+        return row[1]
+
+    def execute_non_transactional_statement(self, cursor, migration_file_name, statement, statement_index,
+                                            invalid_indexes, checkpointed=False):
+        try:
+            self.execute_timed(cursor, statement)
+        except Exception:
+            self.output("Migration:{0} failed at statement {1}".format(migration_file_name, statement_index + 1))
+            if checkpointed:
+                self.output("Migration:{0} continues from statement {1} with migrate --resume".format(
+                    migration_file_name, statement_index + 1))
+            self.drop_invalid_indexes(cursor=cursor, migration_file_name=migration_file_name, keep=invalid_indexes)
+            raise
+
+    def invalid_indexes(self, cursor):
+        if not self.engine.supports(FEATURE_CONCURRENT_INDEXES):
+            return []
+        cursor.execute(QUERY_INVALID_INDEXES)
+        return [(schema, name) for schema, name in cursor.fetchall()]
+
+    def drop_invalid_indexes(self, cursor, migration_file_name, keep):
+        for schema, name in self.invalid_indexes(cursor):
+            if (schema, name) not in keep:
+                cursor.execute(QUERY_DROP_INDEX_CONCURRENTLY.format(quote_identifier(schema), quote_identifier(name)))
+                self.output("Migration:{0} dropped invalid index {1}.{2}".format(migration_file_name, schema, name))
 
     def execute_downgrade(self,
                           migration_file_name=None,
                           version_index=None):
+        path = self.downgrade_script_path(migration_file_name)
+        timer = self.start_timer(DIRECTION_DOWNGRADE, migration_file_name, version_index, path)
+        try:
+            with self.connection.cursor() as cursor:
+                if is_non_transactional_script(path):
+                    self.execute_non_transactional_script(cursor=cursor, path=path,
+                                                          migration_file_name=migration_file_name)
+                else:
+                    with open(path, "r") as script:
+                        self.execute_timed(cursor, script.read())
+                cursor.execute(QUERY_DATABASE_DELETE_MIGRATION.format(version_index))
+        except Exception as error:
+            self.finish_timer(timer, error=error)
+            raise
+        self.finish_timer(timer)
+        self.output("Downgrade:{0} completed".format(migration_file_name))
+
+    def execute_downgrade_batch(self, downgrade_list):
+        """Runs downgrades in one transaction and deletes their versions with a single statement."""
+        undone = []
+        self.connection.autocommit = False
+        try:
+            with self.connection.cursor() as cursor:
+                for migration_file_name in downgrade_list:
+                    path = self.downgrade_script_path(migration_file_name)
+                    timer = self.start_timer(DIRECTION_DOWNGRADE, migration_file_name,
+                                             find_migration_index(migration_file_name), path)
+                    try:
+                        with open(path, "r") as script:
+                            self.execute_timed(cursor, script.read())
+                    except Exception as error:
+                        self.finish_timer(timer, error=error)
+                        raise
+                    timer.stop()
+                    self.timer = None
+                    undone.append((migration_file_name, timer))
+                cursor.execute(create_bulk_delete_migrations_query(
+                    [find_migration_index(migration_file_name) for migration_file_name, timer in undone]))
+            self.connection.commit()
+        except Exception as error:
+            if not self.connection.closed:
+                self.connection.rollback()
+            for migration_file_name, timer in undone:
+                self.finish_timer(timer, error=error)
+            raise
+        finally:
+            self.timer = None
+            if not self.connection.closed:
+                self.connection.autocommit = True
+        for migration_file_name, timer in undone:
+            self.finish_timer(timer)
+            self.output("Downgrade:{0} completed".format(migration_file_name))
+
+    def execute_migration_batch(self,
+                                migration_list=None,
+                                savepoints=False):
+        """Applies every migration in one transaction and records their versions in bulk.
+
+        With savepoints a failing migration is rolled back on its own and the migrations
+        before it are committed, otherwise the whole batch is rolled back.
+        """
+        if not migration_list:
+            return
+        applied = []
+        self.connection.autocommit = False
+        try:
+            with self.connection.cursor() as cursor:
+                for migration_file_name in migration_list:
+                    if savepoints:
+                        cursor.execute(QUERY_RELEASE_AND_SAVEPOINT_MIGRATION if applied else QUERY_SAVEPOINT_MIGRATION)
+                    timer = self.start_timer(DIRECTION_UPGRADE, migration_file_name,
+                                             find_migration_index(migration_file_name),
+                                             self.upgrade_script_path(migration_file_name))
+                    try:
+                        checksum = self.execute_upgrade_script(cursor=cursor, migration_file_name=migration_file_name)
+                    except Exception as error:
+                        self.finish_timer(timer, error=error)
+                        if savepoints:
+                            cursor.execute(QUERY_ROLLBACK_TO_SAVEPOINT_MIGRATION)
+                            self.commit_migration_batch(cursor=cursor, applied=applied)
+                        raise
+                    timer.stop()
+                    self.timer = None
+                    applied.append((migration_file_name, checksum, timer))
+                self.commit_migration_batch(cursor=cursor, applied=applied)
+        except Exception as error:
+            if not self.connection.closed:
+                self.connection.rollback()
+            # Migrations rolled back along with the batch fail with the error of the batch.
+            for migration_file_name, checksum, timer in applied:
+                self.finish_timer(timer, error=error)
+            raise
+        finally:
+            self.timer = None
+            if not self.connection.closed:
+                self.connection.autocommit = True
+            self.reset_timeouts()
+
+    def commit_migration_batch(self, cursor, applied):
+        if applied:
+            cursor.execute(create_bulk_insert_migrations_query(
+                [timer.row(checksum) for migration_file_name, checksum, timer in applied]))
+        self.connection.commit()
+        for migration_file_name, checksum, timer in applied:
+            self.finish_timer(timer)
+            self.output("Migration:{0} completed".format(migration_file_name))
+        del applied[:]
+
+    def verify_migrations(self):
+        """Compares the checksums recorded for applied migrations with the repository.
+
+        Returns ``(version, migration_file_name, status)`` tuples for every applied version.
+        """
+        with self.connection.cursor() as cursor:
+            cursor.execute(QUERY_DATABASE_MIGRATION_CHECKSUMS)
+            applied = cursor.fetchall()
+        upgrade_index = self.migration_repository.upgrade_index(checksums=True)
+
+        results = []
+        for version, checksum in applied:
+            position = upgrade_index.find(version)
+            if position is None:
+                results.append((version, None, VERIFY_STATUS_MISSING))
+                continue
+            entry = upgrade_index.entries[position]
+            if checksum is None:
+                status = VERIFY_STATUS_UNRECORDED
+            elif checksum != self.migration_repository.upgrade_checksum(entry):
+                status = VERIFY_STATUS_MODIFIED
+            else:
+                status = VERIFY_STATUS_OK
+            results.append((version, entry[ENTRY_FILE_NAME], status))
+        return results
+
+    def plan_migrations(self):
+        """Predicts the locks every pending migration takes and how long it holds them.
+
+        Returns a ``MigrationPlan`` per pending migration, sized using the statistics of
+        every table they touch, which are fetched in a single catalog query.
+        """
+        classified_migrations = []
+        for migration_file_name in self.pending_migrations():
+            path = self.upgrade_script_path(migration_file_name)
+            if is_copy_migration(migration_file_name):
+                targets, checksum = read_copy_migration(path=path,
+                                                        data_directory=self.migration_repository.repository_data_path(),
+                                                        checksums=self.migration_repository.manifest.file_checksums)
+                classified = [["COPY {0}".format(target.table), LockTarget(target.table, LOCK_ROW_EXCLUSIVE, COST_CATALOG), 1]
+                              for target in targets]
+            elif is_backfill_migration(migration_file_name):
+                # Each batch only holds its row locks for as long as the batch takes.
+                targets, checksum = read_backfill_migration(path)
+                classified = [[target.sql, LockTarget(target.table, LOCK_ROW_EXCLUSIVE, COST_CATALOG), 1]
+                              for target in targets]
+            else:
+                with open(path, "rb") as script_file:
+                    classified = classify_migration(StatementLexer(ScriptReader(script_file).read))
+            classified_migrations.append((migration_file_name, classified))
+
+        tables = sorted(set(target.table for migration_file_name, classified in classified_migrations
+                            for statement, target, count in classified))
+        return plan_migrations(classified_migrations, self.table_statistics(tables))
+
+    def table_statistics(self, tables):
+        if not tables or not self.engine.supports(FEATURE_TABLE_STATISTICS):
+            return {}
         with self.connection.cursor() as cursor:
-            cursor.execute(open(self.migration_repository.repository_downgrade_path() + "/" + migration_file_name, "r").read())
-            cursor.execute(QUERY_DATABASE_DELETE_MIGRATION.format(version_index))
-            print("Downgrade:{0} completed".format(migration_file_name))
+            cursor.execute(QUERY_TABLE_STATISTICS, (tables,))
+            return dict((table, TableStatistics(rows=rows, heap_bytes=heap_bytes, total_bytes=total_bytes))
+                        for table, rows, heap_bytes, total_bytes in cursor)
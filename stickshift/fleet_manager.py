@@ -0,0 +1,161 @@
+import re
+import time
+import threading
+from multiprocessing.pool import ThreadPool
+
+try:
+    from stickshift.database_manager import DatabaseManager, VERIFY_STATUS_OK
+    from stickshift.migration_repository import DB_GROUP_ON_ERROR_FAIL_FAST
+except ImportError:
+    from database_manager import DatabaseManager, VERIFY_STATUS_OK
+    from migration_repository import DB_GROUP_ON_ERROR_FAIL_FAST
+
+FLEET_STATUS_MIGRATED = "migrated"
+FLEET_STATUS_FAILED = "failed"
+FLEET_STATUS_SKIPPED = "skipped"
+FLEET_STATUS_VERIFIED = "verified"
+FLEET_STATUS_DRIFTED = "drifted"
+
+
+def mask_dsn(target):
+    target = re.sub(r'(://[^:/@]+:)[^@]*@', r'\1***@', target)
+    return re.sub(r'(password\s*=\s*)\S+', r'\1***', target)
+
+
+class FleetTargetResult(object):
+
+    def __init__(self, target, status, migrations=None, error=None, duration=0.0):
+        self.target = target
+        self.status = status
+        self.migrations = migrations or []
+        self.error = error
+        self.duration = duration
+
+    def describe(self):
+        if self.status == FLEET_STATUS_MIGRATED:
+            return "{0}: {1} ({2} migrations, {3:.2f}s)".format(mask_dsn(self.target), self.status,
+                                                              len(self.migrations), self.duration)
+        elif self.status == FLEET_STATUS_VERIFIED:
+            return "{0}: {1} ({2:.2f}s)".format(mask_dsn(self.target), self.status, self.duration)
+        elif self.status == FLEET_STATUS_DRIFTED:
+            return "{0}: {1} ({2})".format(mask_dsn(self.target), self.status, ", ".join(self.migrations))
+        elif self.status == FLEET_STATUS_FAILED:
+            return "{0}: {1} ({2})".format(mask_dsn(self.target), self.status, str(self.error).strip())
+        return "{0}: {1}".format(mask_dsn(self.target), self.status)
+
+
+class FleetManager(object):
+    """Runs a database operation against every member of an environment group.
+
+    Canary members are handled first; the remaining members are then handled
+    through a pool of at most ``concurrency`` workers, each holding its own connection.
+    """
+
+    def __init__(self, migration_repository, group, concurrency=None, canary=None, on_error=None,
+                 transaction_mode=None, out_of_order=None, to=None, workers=None, resume=False):
+        self.migration_repository = migration_repository
+        self.group = group
+        self.members = group["members"]
+        self.canary = canary if canary else group["canary"]
+        self.concurrency = max(1, concurrency if concurrency else group["concurrency"])
+        self.on_error = on_error if on_error else group["on_error"]
+        self.transaction_mode = transaction_mode
+        self.out_of_order = out_of_order
+        self.to = to
+        self.workers = workers
+        self.resume = resume
+        self.halted = threading.Event()
+
+    def database_manager(self, target):
+        return DatabaseManager(migration_repository=self.migration_repository,
+                               environment=target,
+                               database_config=self.migration_repository.target_database_config(target))
+
+    def migrate(self):
+        return self.run(self.migrate_target)
+
+    def verify(self):
+        # Hash the repository once up front so workers only fetch recorded checksums.
+        self.migration_repository.upgrade_index(checksums=True)
+        return self.run(self.verify_target)
+
+    def histories(self):
+        """Reads the migration history of every member.
+
+        Returns ``(member, history, error)`` tuples in member order, where either the
+        history or the error reading it is None.
+        """
+        def read(target):
+            database_manager = None
+            try:
+                database_manager = self.database_manager(target)
+                return target, database_manager.migration_history(), None
+            except Exception as error:
+                return target, None, error
+            finally:
+                if database_manager is not None:
+                    database_manager.close()
+
+        pool = ThreadPool(min(self.concurrency, len(self.members)))
+        try:
+            return pool.map(read, self.members, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    def run(self, operation):
+        canaries = [member for member in self.members if member in self.canary]
+        remaining = [member for member in self.members if member not in self.canary]
+
+        results = self.run_targets(canaries, operation)
+        if any(result.status == FLEET_STATUS_FAILED for result in results):
+            self.halted.set()
+        return results + self.run_targets(remaining, operation)
+
+    def run_targets(self, targets, operation):
+        if not targets:
+            return []
+        pool = ThreadPool(min(self.concurrency, len(targets)))
+        try:
+            return pool.map(lambda target: self.run_target(target, operation), targets, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    def migrate_target(self, target, database_manager):
+        migrations = database_manager.migrate(transaction_mode=self.transaction_mode,
+                                              out_of_order=self.out_of_order,
+                                              to=self.to,
+                                              workers=self.workers,
+                                              resume=self.resume)
+        return FLEET_STATUS_MIGRATED, migrations
+
+    def verify_target(self, target, database_manager):
+        drifted = ["V{0} {1}".format(version, status)
+                   for version, migration_file_name, status in database_manager.verify_migrations()
+                   if status != VERIFY_STATUS_OK]
+        return (FLEET_STATUS_DRIFTED if drifted else FLEET_STATUS_VERIFIED), drifted
+
+    def run_target(self, target, operation):
+        if self.halted.is_set():
+            return FleetTargetResult(target=target, status=FLEET_STATUS_SKIPPED)
+
+        start = time.time()
+        database_manager = None
+        try:
+            database_manager = self.database_manager(target)
+            status, migrations = operation(target, database_manager)
+            return FleetTargetResult(target=target,
+                                     status=status,
+                                     migrations=migrations,
+                                     duration=time.time() - start)
+        except Exception as error:
+            if self.on_error == DB_GROUP_ON_ERROR_FAIL_FAST:
+                self.halted.set()
+            return FleetTargetResult(target=target,
+                                     status=FLEET_STATUS_FAILED,
+                                     error=error,
+                                     duration=time.time() - start)
+        finally:
+            if database_manager is not None:
+                database_manager.close()
@@ -0,0 +1,328 @@
+import re
+
+LOCK_NONE = "NONE"
+LOCK_ROW_EXCLUSIVE = "ROW EXCLUSIVE"
+LOCK_SHARE_UPDATE_EXCLUSIVE = "SHARE UPDATE EXCLUSIVE"
+LOCK_SHARE = "SHARE"
+LOCK_SHARE_ROW_EXCLUSIVE = "SHARE ROW EXCLUSIVE"
+LOCK_EXCLUSIVE = "EXCLUSIVE"
+LOCK_ACCESS_EXCLUSIVE = "ACCESS EXCLUSIVE"
+LOCK_LEVELS = [LOCK_NONE, LOCK_ROW_EXCLUSIVE, LOCK_SHARE_UPDATE_EXCLUSIVE, LOCK_SHARE, LOCK_SHARE_ROW_EXCLUSIVE,
+               LOCK_EXCLUSIVE, LOCK_ACCESS_EXCLUSIVE]
+
+# Locks at least this strong block writes to the table while they are held.
+LOCK_BLOCKS_WRITES = LOCK_LEVELS.index(LOCK_SHARE)
+
+COST_CATALOG = "catalog"
+COST_SCAN = "scan"
+COST_REWRITE = "rewrite"
+
+RISK_NONE = "none"
+RISK_LOW = "low"
+RISK_MEDIUM = "medium"
+RISK_HIGH = "high"
+RISK_LEVELS = [RISK_NONE, RISK_LOW, RISK_MEDIUM, RISK_HIGH]
+
+# Rough throughput of a sequential scan and of a table rewrite including its indexes.
+PLAN_SCAN_BYTES_PER_SECOND = 200 * 1024 * 1024
+PLAN_REWRITE_BYTES_PER_SECOND = 50 * 1024 * 1024
+
+# Holding a blocking lock for longer than this is a high risk, and running a
+# non-blocking statement for longer than this is a medium risk.
+PLAN_RISK_SECONDS = 1.0
+
+PLAN_STATEMENT_PREVIEW_LENGTH = 72
+
+QUERY_TABLE_STATISTICS = "SELECT t.name, c.reltuples::BIGINT, pg_relation_size(c.oid), pg_total_relation_size(c.oid) " \
+                         "FROM unnest(%s::TEXT[]) AS t(name) " \
+                         "JOIN pg_class c ON c.oid = to_regclass(t.name);"
+
+IGNORED_TEXT = re.compile(r"--[^\n]*|/\*.*?\*/|'(?:[^']|'')*'|\$(\w*)\$.*?\$\1\$", re.DOTALL)
+WHITESPACE = re.compile(r"\s+")
+
+IDENTIFIER = r'(?:"[^"]+"|[\w$]+)(?:\.(?:"[^"]+"|[\w$]+))?'
+
+STATEMENT_PATTERNS = [
+    ("create_table", re.compile(r"^CREATE (?:(?:GLOBAL|LOCAL) )?(?:(?:TEMP|TEMPORARY|UNLOGGED) )?TABLE "
+                                r"(?:IF NOT EXISTS )?(" + IDENTIFIER + ")", re.I)),
+    ("create_index", re.compile(r"^CREATE (?:UNIQUE )?INDEX (CONCURRENTLY )?(?:IF NOT EXISTS )?(?:" + IDENTIFIER +
+                                r" )?ON (?:ONLY )?(" + IDENTIFIER + ")", re.I)),
+    ("alter_table", re.compile(r"^ALTER TABLE (?:IF EXISTS )?(?:ONLY )?(" + IDENTIFIER + r") (.*)$", re.I)),
+    ("drop_table", re.compile(r"^DROP TABLE (?:IF EXISTS )?(" + IDENTIFIER + ")", re.I)),
+    ("truncate", re.compile(r"^TRUNCATE (?:TABLE )?(?:ONLY )?(" + IDENTIFIER + ")", re.I)),
+    ("update", re.compile(r"^UPDATE (?:ONLY )?(" + IDENTIFIER + ")", re.I)),
+    ("delete", re.compile(r"^DELETE FROM (?:ONLY )?(" + IDENTIFIER + ")", re.I)),
+    ("insert", re.compile(r"^INSERT INTO (" + IDENTIFIER + ")", re.I)),
+    ("vacuum_full", re.compile(r"^VACUUM (?:\([^)]*\bFULL\b[^)]*\) |FULL )(?:\w+ )*?(" + IDENTIFIER + ")", re.I)),
+    ("cluster", re.compile(r"^CLUSTER (?:VERBOSE )?(" + IDENTIFIER + ")", re.I)),
+    ("reindex", re.compile(r"^REINDEX (?:\([^)]*\) )?TABLE (CONCURRENTLY )?(" + IDENTIFIER + ")", re.I)),
+    ("refresh", re.compile(r"^REFRESH MATERIALIZED VIEW (CONCURRENTLY )?(" + IDENTIFIER + ")", re.I)),
+    ("lock", re.compile(r"^LOCK (?:TABLE )?(?:ONLY )?(" + IDENTIFIER + r")(?: IN ([A-Z ]+?) MODE)?", re.I)),
+]
+
+# Tables a statement reads or refers to besides the one it locks, such as the source of an
+# INSERT ... SELECT, a joined table, a foreign key target or the new name of a renamed table.
+TABLE_REFERENCE = re.compile(r"\b(?:FROM|JOIN|REFERENCES|USING|RENAME TO) (?:ONLY )?(" + IDENTIFIER + ")", re.I)
+
+VOLATILE_DEFAULT = re.compile(r"\bDEFAULT [^,]*\b(?:random|clock_timestamp|timeofday|nextval|gen_random_uuid|"
+                              r"uuid_generate_v\d)\s*\(", re.I)
+SERIAL_TYPE = re.compile(r"\b(?:small|big)?serial\b|\bGENERATED .* STORED\b", re.I)
+
+ALTER_TABLE_ACTIONS = [
+    (re.compile(r"^ADD (?:CONSTRAINT \S+ )?(?:FOREIGN KEY|.*\bREFERENCES\b).* NOT VALID\b", re.I),
+     LOCK_SHARE_ROW_EXCLUSIVE, COST_CATALOG),
+    (re.compile(r"^ADD (?:CONSTRAINT \S+ )?(?:FOREIGN KEY|.*\bREFERENCES\b)", re.I),
+     LOCK_SHARE_ROW_EXCLUSIVE, COST_SCAN),
+    (re.compile(r"^ADD (?:CONSTRAINT \S+ )?CHECK\b.* NOT VALID\b", re.I), LOCK_ACCESS_EXCLUSIVE, COST_CATALOG),
+    (re.compile(r"^ADD (?:CONSTRAINT \S+ )?CHECK\b", re.I), LOCK_ACCESS_EXCLUSIVE, COST_SCAN),
+    (re.compile(r"^ADD (?:CONSTRAINT \S+ )?(?:PRIMARY KEY|UNIQUE|EXCLUDE)\b.*\bUSING INDEX\b", re.I),
+     LOCK_ACCESS_EXCLUSIVE, COST_CATALOG),
+    (re.compile(r"^ADD (?:CONSTRAINT \S+ )?(?:PRIMARY KEY|UNIQUE|EXCLUDE)\b", re.I), LOCK_ACCESS_EXCLUSIVE, COST_SCAN),
+    (re.compile(r"^VALIDATE CONSTRAINT\b", re.I), LOCK_SHARE_UPDATE_EXCLUSIVE, COST_SCAN),
+    (re.compile(r"^ALTER (?:COLUMN )?\S+ (?:SET DATA )?TYPE\b", re.I), LOCK_ACCESS_EXCLUSIVE, COST_REWRITE),
+    (re.compile(r"^ALTER (?:COLUMN )?\S+ SET NOT NULL\b", re.I), LOCK_ACCESS_EXCLUSIVE, COST_SCAN),
+    (re.compile(r"^ALTER (?:COLUMN )?\S+ SET (?:STATISTICS|\()", re.I), LOCK_SHARE_UPDATE_EXCLUSIVE, COST_CATALOG),
+    (re.compile(r"^(?:SET TABLESPACE|SET LOGGED|SET UNLOGGED|SET ACCESS METHOD)\b", re.I),
+     LOCK_ACCESS_EXCLUSIVE, COST_REWRITE),
+    (re.compile(r"^(?:SET \(|RESET \(|SET STATISTICS|CLUSTER ON|SET WITHOUT CLUSTER)", re.I),
+     LOCK_SHARE_UPDATE_EXCLUSIVE, COST_CATALOG),
+    (re.compile(r"^ATTACH PARTITION\b", re.I), LOCK_SHARE_UPDATE_EXCLUSIVE, COST_SCAN),
+    (re.compile(r"^DETACH PARTITION .*\bCONCURRENTLY\b", re.I), LOCK_SHARE_UPDATE_EXCLUSIVE, COST_CATALOG),
+    (re.compile(r"^(?:ENABLE|DISABLE) TRIGGER\b", re.I), LOCK_SHARE_ROW_EXCLUSIVE, COST_CATALOG),
+]
+
+
+class LockTarget(object):
+    """A lock a statement takes on a table, and the work it does while holding it."""
+
+    def __init__(self, table, lock, cost, created=False):
+        self.table = table
+        self.lock = lock
+        self.cost = cost
+        self.created = created
+
+
+def normalize_statement(statement):
+    """Strips comments, string literals and dollar quoted bodies, and collapses whitespace."""
+    def replace(match):
+        return "''" if match.group(0).startswith("'") else " "
+    return WHITESPACE.sub(" ", IGNORED_TEXT.sub(replace, statement)).strip().rstrip(";").strip()
+
+
+def split_alter_table_actions(actions):
+    parts = []
+    depth = 0
+    start = 0
+    for idx, character in enumerate(actions):
+        if character == "(":
+            depth += 1
+        elif character == ")":
+            depth -= 1
+        elif character == "," and depth == 0:
+            parts.append(actions[start:idx].strip())
+            start = idx + 1
+    parts.append(actions[start:].strip())
+    return [part for part in parts if part]
+
+
+def classify_alter_table_action(action):
+    if re.match(r"^ADD (?:COLUMN )?", action, re.I) and \
+            not re.match(r"^ADD (?:CONSTRAINT|PRIMARY KEY|UNIQUE|EXCLUDE|FOREIGN KEY|CHECK)\b", action, re.I):
+        if VOLATILE_DEFAULT.search(action) or SERIAL_TYPE.search(action):
+            return LOCK_ACCESS_EXCLUSIVE, COST_REWRITE
+        return LOCK_ACCESS_EXCLUSIVE, COST_CATALOG
+    for pattern, lock, cost in ALTER_TABLE_ACTIONS:
+        if pattern.match(action):
+            return lock, cost
+    return LOCK_ACCESS_EXCLUSIVE, COST_CATALOG
+
+
+def strongest(locks_and_costs):
+    costs = [COST_CATALOG, COST_SCAN, COST_REWRITE]
+    lock = max((lock for lock, cost in locks_and_costs), key=LOCK_LEVELS.index)
+    cost = max((cost for lock, cost in locks_and_costs), key=costs.index)
+    return lock, cost
+
+
+def classify_statement(statement):
+    """Returns the ``LockTarget`` list of a single SQL statement, empty if it locks no existing table."""
+    normalized = normalize_statement(statement)
+    for kind, pattern in STATEMENT_PATTERNS:
+        match = pattern.match(normalized)
+        if match is None:
+            continue
+        if kind == "create_table":
+            return [LockTarget(match.group(1), LOCK_ACCESS_EXCLUSIVE, COST_CATALOG, created=True)]
+        elif kind == "create_index":
+            if match.group(1):
+                return [LockTarget(match.group(2), LOCK_SHARE_UPDATE_EXCLUSIVE, COST_SCAN)]
+            return [LockTarget(match.group(2), LOCK_SHARE, COST_SCAN)]
+        elif kind == "alter_table":
+            lock, cost = strongest([classify_alter_table_action(action)
+                                    for action in split_alter_table_actions(match.group(2))] or
+                                   [(LOCK_ACCESS_EXCLUSIVE, COST_CATALOG)])
+            return [LockTarget(match.group(1), lock, cost)]
+        elif kind in ["drop_table", "truncate"]:
+            return [LockTarget(match.group(1), LOCK_ACCESS_EXCLUSIVE, COST_CATALOG)]
+        elif kind in ["update", "delete"]:
+            return [LockTarget(match.group(1), LOCK_ROW_EXCLUSIVE, COST_SCAN)]
+        elif kind == "insert":
+            return [LockTarget(match.group(1), LOCK_ROW_EXCLUSIVE, COST_CATALOG)]
+        elif kind in ["vacuum_full", "cluster"]:
+            return [LockTarget(match.group(1), LOCK_ACCESS_EXCLUSIVE, COST_REWRITE)]
+        elif kind == "reindex":
+            return [LockTarget(match.group(2), LOCK_SHARE_UPDATE_EXCLUSIVE if match.group(1) else LOCK_SHARE,
+                               COST_REWRITE)]
+        elif kind == "refresh":
+            return [LockTarget(match.group(2), LOCK_EXCLUSIVE if match.group(1) else LOCK_ACCESS_EXCLUSIVE,
+                               COST_REWRITE)]
+        elif kind == "lock":
+            mode = (match.group(2) or LOCK_ACCESS_EXCLUSIVE).upper()
+            return [LockTarget(match.group(1), mode if mode in LOCK_LEVELS else LOCK_ACCESS_EXCLUSIVE, COST_CATALOG)]
+    return []
+
+
+def canonical_table_name(identifier):
+    """Folds unquoted names to lower case and drops the public schema, so every spelling of a table compares equal."""
+    parts = [part[1:-1] if part.startswith('"') else part.lower()
+             for part in re.findall(r'"[^"]+"|[^.]+', identifier)]
+    if len(parts) == 2 and parts[0] == "public":
+        parts = parts[1:]
+    return ".".join(parts)
+
+
+def statement_tables(statement):
+    """Returns the set of tables a statement touches, or None if it isn't a statement on known tables.
+
+    Statements that lock no table, such as functions, views or sequences, may touch
+    anything, so they are not known to be independent of any other statement.
+    """
+    targets = classify_statement(statement)
+    if not targets:
+        return set() if not normalize_statement(statement) else None
+    normalized = normalize_statement(statement)
+    tables = set(target.table for target in targets)
+    tables.update(TABLE_REFERENCE.findall(normalized))
+    return set(canonical_table_name(table) for table in tables)
+
+
+def script_tables(statements):
+    """Returns the set of tables a script touches, or None if any of its statements might touch others."""
+    tables = set()
+    for statement in statements:
+        touched = statement_tables(statement)
+        if touched is None:
+            return None
+        tables.update(touched)
+    return tables
+
+
+class TableStatistics(object):
+
+    def __init__(self, rows, heap_bytes, total_bytes):
+        self.rows = rows
+        self.heap_bytes = heap_bytes
+        self.total_bytes = total_bytes
+
+
+class StatementPlan(object):
+    """The predicted impact of one or more consecutive statements taking the same lock on the same table."""
+
+    def __init__(self, statement, target, statistics=None, count=1):
+        self.statement = statement
+        self.table = target.table
+        self.lock = target.lock
+        self.cost = target.cost
+        self.created = target.created
+        self.statistics = statistics
+        self.count = count
+
+    def seconds(self):
+        if self.statistics is None or self.cost == COST_CATALOG:
+            return 0.0
+        if self.cost == COST_SCAN:
+            return self.count * self.statistics.heap_bytes / float(PLAN_SCAN_BYTES_PER_SECOND)
+        return self.count * self.statistics.total_bytes / float(PLAN_REWRITE_BYTES_PER_SECOND)
+
+    def risk(self):
+        if self.created:
+            return RISK_NONE
+        lock_level = LOCK_LEVELS.index(self.lock)
+        long_running = self.seconds() >= PLAN_RISK_SECONDS
+        if lock_level >= LOCK_BLOCKS_WRITES:
+            return RISK_HIGH if long_running else RISK_LOW
+        return RISK_MEDIUM if long_running else RISK_NONE
+
+    def describe(self):
+        if self.created:
+            size = "new table"
+        elif self.statistics is None:
+            size = "size unknown"
+        else:
+            size = "{0} rows, {1} MB".format(max(0, self.statistics.rows),
+                                             int(round(self.statistics.total_bytes / (1024.0 * 1024.0))))
+        statement = normalize_statement(self.statement)
+        if len(statement) > PLAN_STATEMENT_PREVIEW_LENGTH:
+            statement = statement[:PLAN_STATEMENT_PREVIEW_LENGTH - 3] + "..."
+        if self.count > 1:
+            statement = "{0} (x{1})".format(statement, self.count)
+        return "  {0}: {1} {2} ({3}, {4}, ~{5:.1f}s): {6}".format(self.risk(), self.lock, self.table, self.cost,
+                                                                 size, self.seconds(), statement)
+
+
+class MigrationPlan(object):
+
+    def __init__(self, migration_file_name, statements):
+        self.migration_file_name = migration_file_name
+        self.statements = statements
+
+    def risk(self):
+        return max([statement.risk() for statement in self.statements] or [RISK_NONE], key=RISK_LEVELS.index)
+
+    def seconds(self):
+        return sum(statement.seconds() for statement in self.statements)
+
+    def describe(self):
+        lines = ["{0}: {1} risk, ~{2:.1f}s".format(self.migration_file_name, self.risk(), self.seconds())]
+        lines.extend(statement.describe() for statement in self.statements)
+        return "\n".join(lines)
+
+
+def classify_migration(statements):
+    """Classifies the statements of a migration, returning ``(statement, LockTarget)`` pairs.
+
+    Consecutive statements taking the same lock on the same table, such as a run of
+    inserts, are collapsed into a single pair with a count.
+    """
+    classified = []
+    for statement in statements:
+        for target in classify_statement(statement):
+            previous = classified[-1] if classified else None
+            if previous is not None and (previous[1].table, previous[1].lock, previous[1].cost) == \
+                    (target.table, target.lock, target.cost):
+                previous[2] += 1
+            else:
+                classified.append([statement, target, 1])
+    return classified
+
+
+def plan_migrations(classified_migrations, statistics):
+    """Builds a ``MigrationPlan`` per migration from classified statements and table statistics.
+
+    Tables created by an earlier statement of the plan are treated as new, empty tables.
+    """
+    created = set()
+    plans = []
+    for migration_file_name, classified in classified_migrations:
+        statements = []
+        for statement, target, count in classified:
+            if target.created:
+                created.add(target.table)
+            elif target.table in created:
+                target.created = True
+            statements.append(StatementPlan(statement=statement,
+                                            target=target,
+                                            statistics=statistics.get(target.table),
+                                            count=count))
+        plans.append(MigrationPlan(migration_file_name=migration_file_name, statements=statements))
+    return plans
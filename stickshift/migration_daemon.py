@@ -0,0 +1,255 @@
+import os
+import json
+import threading
+import traceback
+
+import psycopg2
+import psycopg2.pool
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+try:
+    from stickshift.shell import ShellContext
+    from stickshift.database_engine import FEATURE_CONNECTION_POOLS, connection_arguments, engine_for
+    from stickshift.cmd_db import run_database_operation, DB_OPERATIONS
+    from stickshift.daemon_client import daemon_socket_path, database_config_hash, DAEMON_DEFAULT_POOL_SIZE
+except ImportError:
+    from shell import ShellContext
+    from database_engine import FEATURE_CONNECTION_POOLS, connection_arguments, engine_for
+    from cmd_db import run_database_operation, DB_OPERATIONS
+    from daemon_client import daemon_socket_path, database_config_hash, DAEMON_DEFAULT_POOL_SIZE
+
+# Operations that only read from the database can share an environment, every other
+# operation holds the environment exclusively for as long as it runs.
+DAEMON_READ_OPERATIONS = ["version", "procedures", "tables", "verify", "plan", "history", "status"]
+
+
+class DaemonContext(ShellContext):
+    """Shell context collecting the output of one request instead of writing it to the terminal."""
+
+    def __init__(self, migration_repository):
+        ShellContext.__init__(self)
+        self.migration_repository = migration_repository
+        self.directory = migration_repository.directory
+        self.stdout = []
+        self.stderr = []
+
+    def repository(self):
+        return self.migration_repository
+
+    def log(self, msg, *args):
+        if args:
+            msg %= args
+        self.stderr.append("{0}\n".format(msg))
+
+    def echo(self, msg):
+        self.stdout.append("{0}\n".format(msg))
+
+    def database_manager(self, environment, connection=None, database_config=None):
+        try:
+            from stickshift.database_manager import DatabaseManager
+        except ImportError:
+            from database_manager import DatabaseManager
+        return DatabaseManager(migration_repository=self.repository(),
+                               environment=environment,
+                               database_config=database_config,
+                               connection=connection,
+                               output=self.echo)
+
+
+class EnvironmentPool(object):
+    """A bounded pool of open connections to a single environment.
+
+    A retired pool, one whose environment has since been configured differently, is closed
+    once the last connection borrowed from it is released.
+    """
+
+    def __init__(self, database_config, size):
+        engine_for(database_config).require(FEATURE_CONNECTION_POOLS)
+        self.database_config = database_config
+        self.slots = threading.BoundedSemaphore(size)
+        self.pool = psycopg2.pool.ThreadedConnectionPool(0, size, **connection_arguments(database_config))
+        self.lock = threading.Lock()
+        self.borrowed = 0
+        self.retired = False
+
+    def acquire(self):
+        self.slots.acquire()
+        try:
+            connection = self.pool.getconn()
+            if connection.closed:
+                self.pool.putconn(connection, close=True)
+                connection = self.pool.getconn()
+        except Exception:
+            self.slots.release()
+            raise
+        with self.lock:
+            self.borrowed += 1
+        return connection
+
+    def release(self, connection, broken=False):
+        try:
+            if not broken and not connection.closed and not connection.autocommit:
+                connection.rollback()
+            self.pool.putconn(connection, close=broken or bool(connection.closed))
+        finally:
+            self.slots.release()
+            with self.lock:
+                self.borrowed -= 1
+                drained = self.retired and self.borrowed == 0
+            if drained:
+                self.pool.closeall()
+
+    def retire(self):
+        with self.lock:
+            self.retired = True
+            drained = self.borrowed == 0
+        if drained:
+            self.pool.closeall()
+
+    def close(self):
+        self.pool.closeall()
+
+
+class MigrationDaemon(object):
+    """Serves database operations over a Unix socket using warm connections.
+
+    Each request is a single line of JSON naming an ``operation``, an ``environment``
+    and ``options``, and is answered with a single line of JSON holding the
+    ``exit_code``, ``stdout`` and ``stderr`` the same command would have produced.
+    A request the daemon can't run, because the environment's engine has no connection
+    pools or because its ``database_config_hash`` differs from the environment as the
+    daemon resolves it, is answered with ``handled`` false for the client to run it itself.
+    """
+
+    def __init__(self, migration_repository, socket_path=None, pool_size=DAEMON_DEFAULT_POOL_SIZE):
+        self.migration_repository = migration_repository
+        self.socket_path = socket_path or daemon_socket_path(migration_repository.directory)
+        self.pool_size = pool_size
+        self.pools = {}
+        self.pools_lock = threading.Lock()
+        self.write_locks = {}
+        self.server = None
+        self.server_lock = threading.Lock()
+        self.stopped = False
+        self.serving = threading.Event()
+
+    def environment_pool(self, environment, database_config):
+        """Returns the pool of the environment, replacing it once database.ini configures it differently."""
+        with self.pools_lock:
+            pool = self.pools.get(environment)
+            if pool is not None and pool.database_config != database_config:
+                pool.retire()
+                pool = None
+            if pool is None:
+                pool = self.pools[environment] = EnvironmentPool(database_config=database_config,
+                                                                 size=self.pool_size)
+            return pool
+
+    def write_lock(self, environment):
+        with self.pools_lock:
+            return self.write_locks.setdefault(environment, threading.Lock())
+
+    def handle(self, message):
+        operation = message.get("operation")
+        environment = message.get("environment")
+        options = message.get("options") or {}
+        ctx = DaemonContext(migration_repository=self.migration_repository)
+        if operation not in DB_OPERATIONS:
+            ctx.log("{0} is not a valid operation".format(operation))
+            return self.response(ctx, 2)
+
+        try:
+            database_config = self.migration_repository.database_config(environment)
+            if not engine_for(database_config).supports(FEATURE_CONNECTION_POOLS):
+                return self.not_handled()
+            client_config_hash = message.get("database_config_hash")
+            if client_config_hash is not None and client_config_hash != database_config_hash(database_config):
+                return self.not_handled()
+            pool = self.environment_pool(environment, database_config)
+            write_lock = None if operation in DAEMON_READ_OPERATIONS else self.write_lock(environment)
+            if write_lock is not None:
+                write_lock.acquire()
+            try:
+                connection = pool.acquire()
+                broken = False
+                try:
+                    database_manager = ctx.database_manager(environment=environment,
+                                                            connection=connection,
+                                                            database_config=database_config)
+                    exit_code = run_database_operation(ctx=ctx,
+                                                       operation=operation,
+                                                       database_manager=database_manager,
+                                                       transaction_mode=options.get("transaction_mode"),
+                                                       out_of_order=options.get("out_of_order"),
+                                                       to=options.get("to"),
+                                                       steps=options.get("steps"),
+                                                       workers=options.get("workers"),
+                                                       resume=options.get("resume", False))
+                except psycopg2.OperationalError:
+                    broken = True
+                    raise
+                finally:
+                    pool.release(connection, broken=broken)
+            finally:
+                if write_lock is not None:
+                    write_lock.release()
+        except Exception:
+            ctx.log(traceback.format_exc().rstrip())
+            exit_code = 1
+        return self.response(ctx, exit_code)
+
+    def response(self, ctx, exit_code):
+        return {"exit_code": exit_code, "stdout": "".join(ctx.stdout), "stderr": "".join(ctx.stderr)}
+
+    def not_handled(self):
+        return {"handled": False, "exit_code": None, "stdout": "", "stderr": ""}
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        daemon = self
+
+        class RequestHandler(socketserver.StreamRequestHandler):
+
+            def handle(self):
+                line = self.rfile.readline()
+                if not line:
+                    return
+                try:
+                    response = daemon.handle(json.loads(line.decode("utf-8")))
+                except ValueError:
+                    response = {"exit_code": 2, "stdout": "", "stderr": "Invalid request\n"}
+                self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+        # The socket appears before the server listens and is assigned, so a shutdown waits for both.
+        with self.server_lock:
+            if self.stopped:
+                return
+            self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, RequestHandler)
+            self.server.daemon_threads = True
+        self.serving.set()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.close()
+
+    def shutdown(self):
+        with self.server_lock:
+            self.stopped = True
+            server = self.server
+        if server is not None:
+            server.shutdown()
+
+    def close(self):
+        if self.server is not None:
+            self.server.server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        with self.pools_lock:
+            for pool in self.pools.values():
+                pool.close()
+            self.pools = {}
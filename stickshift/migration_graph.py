@@ -0,0 +1,154 @@
+import heapq
+import threading
+
+try:
+    from stickshift.migration_repository import find_migration_index
+except ImportError:
+    from migration_repository import find_migration_index
+
+# Number of migrations applied at the same time, each over its own connection.
+WORKERS_SETTING = "workers"
+WORKERS_DEFAULT = 1
+
+
+class InvalidDependencyError(Exception):
+    pass
+
+
+class MigrationGraph(object):
+    """The pending migrations in version order, along with the pending migrations each one waits for."""
+
+    def __init__(self, migration_list, dependencies):
+        self.migration_list = migration_list
+        self.dependencies = dependencies
+
+    def dependents(self):
+        dependents = dict((migration_file_name, []) for migration_file_name in self.migration_list)
+        for migration_file_name in self.migration_list:
+            for dependency in self.dependencies[migration_file_name]:
+                dependents[dependency].append(migration_file_name)
+        return dependents
+
+    def roots(self):
+        return [migration_file_name for migration_file_name in self.migration_list
+                if not self.dependencies[migration_file_name]]
+
+
+def build_migration_graph(migration_list, declared, tables, applied_versions=()):
+    """Builds the dependency graph of the pending migrations, in a single pass over them.
+
+    ``declared`` maps a migration to the versions its ``depends`` directive names, or
+    None to infer them, and ``tables`` maps it to the tables it touches, or None when
+    it might touch any. An inferred migration depends on every older migration sharing
+    a table with it and on every older migration that might touch any table. Only the
+    newest migrations covering the others are kept as dependencies, since the older
+    ones are already waited for through them.
+    """
+    by_version = dict((int(find_migration_index(migration_file_name)), migration_file_name)
+                      for migration_file_name in migration_list)
+    applied = set(applied_versions)
+    dependencies = {}
+    # The migrations no later migration depends on yet, the newest migrations touching
+    # every table, and the newest migrations that might touch any table.
+    tips = set()
+    by_table = {}
+    untabled = set()
+    for migration_file_name in migration_list:
+        version = int(find_migration_index(migration_file_name))
+        touched = tables.get(migration_file_name)
+        if declared.get(migration_file_name) is not None:
+            depends = set()
+            for dependency in declared[migration_file_name]:
+                if dependency >= version:
+                    raise InvalidDependencyError("{0} depends on version {1}, which is not older".format(
+                        migration_file_name, dependency))
+                if dependency in by_version:
+                    depends.add(by_version[dependency])
+                elif dependency not in applied:
+                    raise InvalidDependencyError("{0} depends on version {1}, which is neither applied nor "
+                                                 "pending".format(migration_file_name, dependency))
+            if touched is None:
+                untabled = (untabled - depends) | {migration_file_name}
+            else:
+                for table in touched:
+                    by_table[table] = (by_table.get(table, set()) - depends) | {migration_file_name}
+        elif touched is None:
+            depends = set(tips)
+            untabled = {migration_file_name}
+            by_table = {}
+        else:
+            depends = set(untabled)
+            for table in touched:
+                depends.update(by_table.get(table, ()))
+                by_table[table] = {migration_file_name}
+        tips = (tips - depends) | {migration_file_name}
+        dependencies[migration_file_name] = depends
+    return MigrationGraph(migration_list=migration_list, dependencies=dependencies)
+
+
+class MigrationScheduler(object):
+    """Applies the migrations of a graph over several workers, recording each one as soon as it is applied.
+
+    ``apply(worker, migration_file_name)`` applies and records a migration on a worker.
+    A migration becomes ready once the migrations it depends on are recorded, and the
+    oldest ready migration is always handed to the next free worker. After a failure no
+    further migration is started, while those already running are still recorded.
+    """
+
+    def __init__(self, graph, workers):
+        self.graph = graph
+        self.workers = max(1, min(workers, len(graph.migration_list)))
+        self.position = dict((migration_file_name, idx) for idx, migration_file_name in enumerate(graph.migration_list))
+        self.dependents = graph.dependents()
+        self.remaining = dict((migration_file_name, len(dependencies))
+                              for migration_file_name, dependencies in graph.dependencies.items())
+        self.ready = [self.position[migration_file_name] for migration_file_name in graph.roots()]
+        heapq.heapify(self.ready)
+        self.recorded = []
+        self.error = None
+        self.condition = threading.Condition()
+
+    def run(self, apply):
+        """Applies every migration, returning the recorded ones in version order or raising the first error."""
+        threads = [threading.Thread(target=self.work, args=(worker, apply)) for worker in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error
+        return sorted(self.recorded, key=self.position.get)
+
+    def work(self, worker, apply):
+        while True:
+            migration_file_name = self.next_migration()
+            if migration_file_name is None:
+                return
+            try:
+                apply(worker, migration_file_name)
+            except Exception as error:
+                with self.condition:
+                    if self.error is None:
+                        self.error = error
+                    self.condition.notify_all()
+                return
+            self.record(migration_file_name)
+
+    def next_migration(self):
+        with self.condition:
+            while self.error is None:
+                if self.ready:
+                    return self.graph.migration_list[heapq.heappop(self.ready)]
+                if len(self.recorded) == len(self.graph.migration_list):
+                    return None
+                self.condition.wait()
+            return None
+
+    def record(self, migration_file_name):
+        with self.condition:
+            self.recorded.append(migration_file_name)
+            for dependent in self.dependents[migration_file_name]:
+                self.remaining[dependent] -= 1
+                if not self.remaining[dependent]:
+                    heapq.heappush(self.ready, self.position[dependent])
+            self.condition.notify_all()
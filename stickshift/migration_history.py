@@ -0,0 +1,161 @@
+import re
+import time
+
+try:
+    from stickshift.lock_analyzer import normalize_statement
+except ImportError:
+    from lock_analyzer import normalize_statement
+
+DIRECTION_UPGRADE = "upgrade"
+DIRECTION_DOWNGRADE = "downgrade"
+
+EVENT_BEGIN = "begin"
+EVENT_END = "end"
+EVENT_FAILED = "failed"
+
+HISTORY_DEFAULT_LIMIT = 10
+
+# Appended to a query so its last result is the time the server spent executing it, since
+# statement_timestamp() is when the server received the whole query.
+QUERY_SERVER_DURATION = "\n;SELECT EXTRACT(EPOCH FROM clock_timestamp() - statement_timestamp());"
+
+# Statements that refuse to run in a transaction block, which the query becomes once
+# the timing query is appended to it.
+NON_TRANSACTIONAL_STATEMENT = re.compile(r"^(VACUUM|ALTER\s+SYSTEM|(CREATE|DROP|ALTER)\s+(DATABASE|TABLESPACE|SUBSCRIPTION)"
+                                         r"|REINDEX\s+(SYSTEM|DATABASE)|(CREATE|DROP|REINDEX)\b[^;]*\bCONCURRENTLY\b)",
+                                         re.I)
+TIMING_CHECK_BYTES = 4096
+
+
+def can_time_query(query):
+    """Returns whether the timing query can be appended to a query sent outside of a transaction."""
+    return NON_TRANSACTIONAL_STATEMENT.match(normalize_statement(query[:TIMING_CHECK_BYTES])) is None
+
+
+def describe_duration(seconds):
+    return "{0:.3f}s".format(seconds) if seconds is not None else "-"
+
+
+def describe_bytes(count):
+    if count is None:
+        return "-"
+    if count < 1024:
+        return "{0} B".format(count)
+    for unit in ["KB", "MB", "GB"]:
+        count /= 1024.0
+        if count < 1024 or unit == "GB":
+            return "{0:.1f} {1}".format(count, unit)
+
+
+class MigrationEvent(object):
+    """Passed to the listeners of a database manager as every migration or downgrade begins and ends.
+
+    ``duration``, ``server_duration`` and ``script_bytes`` are only set once it has ended or failed.
+    """
+
+    def __init__(self, event, direction, migration_file_name, version, duration=None, server_duration=None,
+                 script_bytes=None, error=None):
+        self.event = event
+        self.direction = direction
+        self.migration_file_name = migration_file_name
+        self.version = version
+        self.duration = duration
+        self.server_duration = server_duration
+        self.script_bytes = script_bytes
+        self.error = error
+
+
+class MigrationTimer(object):
+    """Measures the wall clock and server time of a single migration.
+
+    ``server_duration`` becomes None when part of the migration ran without being timed
+    by the server, such as a COPY.
+    """
+
+    def __init__(self, direction, migration_file_name, version, script_bytes=None):
+        self.direction = direction
+        self.migration_file_name = migration_file_name
+        self.version = version
+        self.script_bytes = script_bytes
+        self.server_duration = 0.0
+        self.started_at = time.time()
+        self.finished_at = None
+
+    def add_server_duration(self, seconds):
+        if self.server_duration is not None and seconds is not None:
+            self.server_duration += float(seconds)
+
+    def untimed(self):
+        self.server_duration = None
+
+    def stop(self):
+        if self.finished_at is None:
+            self.finished_at = time.time()
+
+    def duration(self):
+        return (self.finished_at or time.time()) - self.started_at
+
+    def event(self, event, error=None):
+        if event == EVENT_BEGIN:
+            return MigrationEvent(event, self.direction, self.migration_file_name, self.version)
+        return MigrationEvent(event, self.direction, self.migration_file_name, self.version,
+                              duration=self.duration(),
+                              server_duration=self.server_duration,
+                              script_bytes=self.script_bytes,
+                              error=error)
+
+    def row(self, checksum):
+        """Returns the values recorded in the version table for the migration."""
+        return self.version, checksum, self.duration(), self.server_duration, self.script_bytes
+
+
+class HistoryEntry(object):
+
+    def __init__(self, version, migration_file_name, duration, server_duration, script_bytes, migrated_at):
+        self.version = version
+        self.migration_file_name = migration_file_name
+        self.duration = duration
+        self.server_duration = server_duration
+        self.script_bytes = script_bytes
+        self.migrated_at = migrated_at
+
+    def describe(self):
+        return "V{0} {1}: {2} (server {3}, {4})".format(self.version, self.migration_file_name or "",
+                                                        describe_duration(self.duration),
+                                                        describe_duration(self.server_duration),
+                                                        describe_bytes(self.script_bytes))
+
+
+def slowest_migrations(history, limit=HISTORY_DEFAULT_LIMIT):
+    """Returns the timed entries of a history, slowest first."""
+    timed = [entry for entry in history if entry.duration is not None]
+    timed.sort(key=lambda entry: entry.duration, reverse=True)
+    return timed[:limit]
+
+
+def describe_history_totals(history):
+    timed = [entry for entry in history if entry.duration is not None]
+    server_durations = [entry.server_duration for entry in timed if entry.server_duration is not None]
+    return "{0} migrations, {1} timed, {2} (server {3})".format(
+        len(history), len(timed),
+        describe_duration(sum(entry.duration for entry in timed)),
+        describe_duration(sum(server_durations) if server_durations else None))
+
+
+def compare_histories(histories, limit=HISTORY_DEFAULT_LIMIT):
+    """Lines comparing the durations of the slowest migrations across several environments.
+
+    ``histories`` is a list of ``(environment, history)`` pairs; migrations are ordered by
+    their slowest duration in any environment.
+    """
+    durations = {}
+    file_names = {}
+    for environment, history in histories:
+        for entry in history:
+            if entry.duration is not None:
+                durations.setdefault(entry.version, {})[environment] = entry.duration
+                file_names[entry.version] = entry.migration_file_name
+    versions = sorted(durations, key=lambda version: max(durations[version].values()), reverse=True)[:limit]
+    return ["V{0} {1}: {2}".format(version, file_names[version] or "", ", ".join(
+        "{0} {1}".format(environment, describe_duration(durations[version].get(environment)))
+        for environment, history in histories)) for version in versions]
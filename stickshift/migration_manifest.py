@@ -0,0 +1,209 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+
+MANIFEST_FORMAT_VERSION = 1
+
+MIGRATION_FILE_PATTERN = re.compile(r'^V(\d+)__(.+)$')
+
+# Directories modified this close to their last scan are always rescanned, since
+# coarse filesystem timestamps can hide a change made in the same tick as the scan.
+MANIFEST_MTIME_SLACK = 2.0
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Below this many files the cost of starting worker processes outweighs hashing in parallel.
+PARALLEL_HASH_MIN_FILES = 256
+PARALLEL_HASH_CHUNK_SIZE = 32
+
+ENTRY_VERSION = 0
+ENTRY_NAME = 1
+ENTRY_FILE_NAME = 2
+ENTRY_SIZE = 3
+ENTRY_MTIME = 4
+ENTRY_CHECKSUM = 5
+
+# Files outside the migration directories are kept as ``[size, mtime, checksum]`` by path.
+FILE_SIZE = 0
+FILE_MTIME = 1
+FILE_CHECKSUM = 2
+
+
+def parse_migration_file_name(file_name):
+    match = MIGRATION_FILE_PATTERN.match(file_name)
+    if match is None:
+        return None
+    return int(match.group(1)), os.path.splitext(match.group(2))[0]
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as migration_file:
+        for chunk in iter(lambda: migration_file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_checksums(paths):
+    import multiprocessing
+    if len(paths) < PARALLEL_HASH_MIN_FILES or multiprocessing.cpu_count() < 2:
+        return [file_checksum(path) for path in paths]
+    pool = multiprocessing.Pool()
+    try:
+        return pool.map(file_checksum, paths, chunksize=PARALLEL_HASH_CHUNK_SIZE)
+    finally:
+        pool.close()
+        pool.join()
+
+
+class MigrationIndex(object):
+    """Version ordered view of a migration directory.
+
+    Entries are ``[version, name, file_name, size, mtime, checksum]`` lists, and
+    versions are kept in a parallel integer array so lookups are binary searches.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.versions = array('l', [entry[ENTRY_VERSION] for entry in entries])
+        self.file_names = [entry[ENTRY_FILE_NAME] for entry in entries]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def find(self, version):
+        position = bisect_left(self.versions, version)
+        if position < len(self.versions) and self.versions[position] == version:
+            return position
+        return None
+
+    def file_name_for_version(self, version):
+        position = self.find(version)
+        return self.file_names[position] if position is not None else None
+
+    def file_names_after(self, version):
+        return self.file_names[bisect_right(self.versions, version):]
+
+    def file_names_through(self, version):
+        return self.file_names[:bisect_right(self.versions, version)]
+
+
+class MigrationManifest(object):
+    """On-disk cache of the parsed contents of the migration directories.
+
+    A directory is only listed again when its mtime changes, and files whose size and
+    mtime are unchanged keep their previously computed checksums. The checksums of other
+    files the migrations load, such as baselines and data files, are kept the same way.
+    """
+
+    def __init__(self, manifest_path, directories):
+        self.manifest_path = manifest_path
+        self.directories = directories
+        self.lock = threading.Lock()
+        self.indexes = {}
+        self.data = None
+
+    def index(self, key, checksums=False):
+        with self.lock:
+            if self.data is None:
+                self.data = self.load()
+            changed = self.refresh_directory(key)
+            if checksums:
+                changed = self.refresh_checksums(key) or changed
+            if changed or key not in self.indexes:
+                self.indexes[key] = MigrationIndex(self.data["directories"][key]["entries"])
+            if changed:
+                self.save()
+            return self.indexes[key]
+
+    def file_checksums(self, paths):
+        """Returns the checksums of the files, only hashing those whose size or mtime changed."""
+        with self.lock:
+            if self.data is None:
+                self.data = self.load()
+            files = self.data.setdefault("files", {})
+            stale = []
+            for path in paths:
+                stat = os.stat(path)
+                cached = files.get(path)
+                if cached is None or cached[FILE_SIZE] != stat.st_size or cached[FILE_MTIME] != stat.st_mtime:
+                    stale.append((path, stat))
+            checksums = file_checksums([path for path, stat in stale])
+            for (path, stat), checksum in zip(stale, checksums):
+                files[path] = [stat.st_size, stat.st_mtime, checksum]
+            if stale:
+                self.save()
+            return [files[path][FILE_CHECKSUM] for path in paths]
+
+    def load(self):
+        try:
+            with open(self.manifest_path, "r") as manifest_file:
+                data = json.load(manifest_file)
+            if data.get("format") == MANIFEST_FORMAT_VERSION:
+                return data
+        except (IOError, OSError, ValueError):
+            pass
+        return {"format": MANIFEST_FORMAT_VERSION, "directories": {}}
+
+    def save(self):
+        if not os.path.isdir(os.path.dirname(self.manifest_path) or "."):
+            return
+        temporary_path = "{0}.{1}.tmp".format(self.manifest_path, os.getpid())
+        with open(temporary_path, "w") as manifest_file:
+            json.dump(self.data, manifest_file, separators=(",", ":"))
+        os.rename(temporary_path, self.manifest_path)
+
+    def invalidate(self):
+        with self.lock:
+            self.indexes = {}
+            self.data = {"format": MANIFEST_FORMAT_VERSION, "directories": {}}
+
+    def refresh_directory(self, key):
+        path = self.directories[key]
+        cached = self.data["directories"].get(key)
+        directory_mtime = os.stat(path).st_mtime
+        if cached is not None and cached["mtime"] == directory_mtime \
+                and directory_mtime < cached["scanned_at"] - MANIFEST_MTIME_SLACK:
+            return False
+
+        scanned_at = time.time()
+        previous = dict((entry[ENTRY_FILE_NAME], entry) for entry in cached["entries"]) if cached else {}
+        entries = []
+        for file_name in os.listdir(path):
+            parsed = parse_migration_file_name(file_name)
+            if parsed is None:
+                continue
+            stat = os.stat(os.path.join(path, file_name))
+            checksum = None
+            entry = previous.get(file_name)
+            if entry is not None and entry[ENTRY_SIZE] == stat.st_size and entry[ENTRY_MTIME] == stat.st_mtime:
+                checksum = entry[ENTRY_CHECKSUM]
+            entries.append([parsed[0], parsed[1], file_name, stat.st_size, stat.st_mtime, checksum])
+
+        import natsort
+        file_name_key = natsort.natsort_keygen()
+        entries.sort(key=lambda entry: (entry[ENTRY_VERSION], file_name_key(entry[ENTRY_FILE_NAME])))
+
+        self.data["directories"][key] = {"mtime": directory_mtime, "scanned_at": scanned_at, "entries": entries}
+        return True
+
+    def refresh_checksums(self, key):
+        path = self.directories[key]
+        stale = []
+        for entry in self.data["directories"][key]["entries"]:
+            stat = os.stat(os.path.join(path, entry[ENTRY_FILE_NAME]))
+            if entry[ENTRY_CHECKSUM] is None or entry[ENTRY_SIZE] != stat.st_size \
+                    or entry[ENTRY_MTIME] != stat.st_mtime:
+                entry[ENTRY_SIZE] = stat.st_size
+                entry[ENTRY_MTIME] = stat.st_mtime
+                stale.append(entry)
+
+        checksums = file_checksums([os.path.join(path, entry[ENTRY_FILE_NAME]) for entry in stale])
+        for entry, checksum in zip(stale, checksums):
+            entry[ENTRY_CHECKSUM] = checksum
+        return len(stale) > 0
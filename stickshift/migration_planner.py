@@ -0,0 +1,100 @@
+try:
+    from stickshift.migration_manifest import ENTRY_FILE_NAME, ENTRY_VERSION
+except ImportError:
+    from migration_manifest import ENTRY_FILE_NAME, ENTRY_VERSION
+
+# What happens to pending migrations older than the newest applied version, such as
+# migrations merged from a branch developed in parallel.
+OUT_OF_ORDER_SETTING = "out_of_order"
+OUT_OF_ORDER_WARN = "warn"
+OUT_OF_ORDER_ERROR = "error"
+OUT_OF_ORDER_APPLY = "apply"
+OUT_OF_ORDER_POLICIES = [OUT_OF_ORDER_WARN, OUT_OF_ORDER_ERROR, OUT_OF_ORDER_APPLY]
+
+# Served by the primary key of the version table, so it never scans the table.
+QUERY_DATABASE_APPLIED_VERSIONS = "SELECT version FROM version_migration ORDER BY version;"
+
+
+class InvalidOutOfOrderPolicyError(Exception):
+    pass
+
+
+class OutOfOrderMigrationError(Exception):
+    pass
+
+
+class DuplicateMigrationVersionError(Exception):
+    pass
+
+
+def validate_out_of_order_policy(policy):
+    if policy not in OUT_OF_ORDER_POLICIES:
+        raise InvalidOutOfOrderPolicyError("{0} is not a valid out of order policy, expected one of: {1}".format(
+            policy, ", ".join(OUT_OF_ORDER_POLICIES)))
+    return policy
+
+
+class UpgradePlan(object):
+    """The upgrade scripts to apply to a database, in the order they will be applied.
+
+    ``out_of_order`` holds the unapplied scripts older than the newest applied version,
+    which are only part of ``pending`` under the apply policy. ``unknown`` holds the
+    applied versions that have no upgrade script.
+    """
+
+    def __init__(self, pending, out_of_order, unknown, newest_version, policy):
+        self.pending = pending
+        self.out_of_order = out_of_order
+        self.unknown = unknown
+        self.newest_version = newest_version
+        self.policy = policy
+
+    def skipped(self):
+        return self.out_of_order if self.policy != OUT_OF_ORDER_APPLY else []
+
+
+def plan_upgrade(upgrade_index, applied_versions, policy=OUT_OF_ORDER_WARN, interrupted_versions=()):
+    """Diffs the applied versions against the upgrade scripts in a single pass over both.
+
+    ``interrupted_versions`` are left unrecorded by a failed parallel migrate, and are
+    pending even when older than the newest applied version.
+    """
+    validate_out_of_order_policy(policy)
+    applied = set(applied_versions)
+    interrupted = set(interrupted_versions)
+    newest_version = max(applied) if applied else None
+    pending = []
+    out_of_order = []
+    previous = None
+    for entry in upgrade_index.entries:
+        # Entries are in version order, so migrations numbered alike on separate branches are next to each other.
+        if previous is not None and previous[ENTRY_VERSION] == entry[ENTRY_VERSION]:
+            raise DuplicateMigrationVersionError("{0} and {1} share version {2}, renumber one of them".format(
+                previous[ENTRY_FILE_NAME], entry[ENTRY_FILE_NAME], entry[ENTRY_VERSION]))
+        previous = entry
+        if entry[ENTRY_VERSION] in applied:
+            continue
+        if newest_version is not None and entry[ENTRY_VERSION] < newest_version and \
+                entry[ENTRY_VERSION] not in interrupted:
+            out_of_order.append(entry[ENTRY_FILE_NAME])
+            if policy != OUT_OF_ORDER_APPLY:
+                continue
+        pending.append(entry[ENTRY_FILE_NAME])
+    unknown = sorted(applied.difference(upgrade_index.versions))
+    return UpgradePlan(pending=pending,
+                       out_of_order=out_of_order,
+                       unknown=unknown,
+                       newest_version=newest_version,
+                       policy=policy)
+
+
+def plan_downgrade(downgrade_index, applied_versions):
+    """Returns the downgrade scripts of the applied versions, newest first."""
+    applied = set(applied_versions)
+    return [entry[ENTRY_FILE_NAME] for entry in reversed(downgrade_index.entries) if entry[ENTRY_VERSION] in applied]
+
+
+def describe_out_of_order(plan):
+    return "{0} older than the applied version {1}: {2}".format(
+        "Migration is" if len(plan.out_of_order) == 1 else "Migrations are",
+        plan.newest_version, ", ".join(plan.out_of_order))
@@ -1,7 +1,27 @@
 import os
+import re
 import sys
+import json
+import time
 import shutil
-import natsort
+import hashlib
+
+try:
+    from stickshift.migration_manifest import MigrationManifest, parse_migration_file_name, \
+        ENTRY_FILE_NAME, ENTRY_CHECKSUM, MANIFEST_MTIME_SLACK
+    from stickshift.copy_migration import COPY_MIGRATION_EXTENSION, COPY_MIGRATION_TEMPLATE, is_copy_migration, \
+        read_copy_migration
+    from stickshift.backfill_migration import BACKFILL_MIGRATION_EXTENSION, BACKFILL_MIGRATION_TEMPLATE
+    from stickshift.baseline import BASELINE_NAME
+    from stickshift.database_engine import ENGINE_SETTING, engine_database_fields
+except ImportError:
+    from migration_manifest import MigrationManifest, parse_migration_file_name, \
+        ENTRY_FILE_NAME, ENTRY_CHECKSUM, MANIFEST_MTIME_SLACK
+    from copy_migration import COPY_MIGRATION_EXTENSION, COPY_MIGRATION_TEMPLATE, is_copy_migration, \
+        read_copy_migration
+    from backfill_migration import BACKFILL_MIGRATION_EXTENSION, BACKFILL_MIGRATION_TEMPLATE
+    from baseline import BASELINE_NAME
+    from database_engine import ENGINE_SETTING, engine_database_fields
 
 python_version = sys.version_info.major
 if python_version == 3:
@@ -19,17 +39,58 @@ DB_CONFIG_FILE_CONTENTS = "[DATABASE]" \
                           "\ndatabase: [DB_NAME]\n"
 DB_UPGRADE_DIR = "db/upgrade"
 DB_DOWNGRADE_DIR = "db/downgrade"
+DB_DATA_DIR = "db/data"
+DB_BASELINE_DIR = "db/baseline"
+DB_MANIFEST_PATH = "db/manifest.json"
+DB_SNAPSHOT_DIR = "db/snapshots"
+DB_FINGERPRINT_PATH = "db/fingerprint.json"
+
+MANIFEST_UPGRADE = "upgrade"
+MANIFEST_DOWNGRADE = "downgrade"
+
+CONCURRENT_INDEX_UPGRADE_TEMPLATE = "-- stickshift: no-transaction\n" \
+                                   "CREATE INDEX CONCURRENTLY IF NOT EXISTS {0} ON {1} ({2});\n"
+CONCURRENT_INDEX_DOWNGRADE_TEMPLATE = "-- stickshift: no-transaction\n" \
+                                      "DROP INDEX CONCURRENTLY IF EXISTS {0};\n"
 
 DB_MAP_OPTIONS = ["host", "port", "username", "password", "database"]
 
+DB_GROUP_MEMBERS_OPTION = "members"
+DB_GROUP_CANARY_OPTION = "canary"
+DB_GROUP_CONCURRENCY_OPTION = "concurrency"
+DB_GROUP_ON_ERROR_OPTION = "on_error"
+
+DB_GROUP_ON_ERROR_FAIL_FAST = "fail-fast"
+DB_GROUP_ON_ERROR_CONTINUE = "continue"
+DB_GROUP_ON_ERROR_POLICIES = [DB_GROUP_ON_ERROR_FAIL_FAST, DB_GROUP_ON_ERROR_CONTINUE]
+DB_GROUP_DEFAULT_CONCURRENCY = 4
+
 
 def find_migration_index(migration_file_name):
     underscore_index = migration_file_name.index("_")
     return migration_file_name[1:underscore_index]
 
 
+def migration_file_prefix(migration_index):
+    if migration_index < 10:
+        return "V0{0}__".format(migration_index)
+    return "V{0}__".format(migration_index)
+
+
+def parse_migration_version(migration_file_name):
+    parsed = parse_migration_file_name(migration_file_name)
+    return parsed[0] if parsed is not None else None
+
+
+def is_dsn(text):
+    return "://" in text or "=" in text
+
+
+def parse_group_members(text):
+    return [member.strip() for member in re.split(r'[,\n]', text) if member.strip()]
+
+
 def parse_environment_variable(text):
-    import re
     matches = re.findall(r'\[(.*?)\]', text)
     return matches
 
@@ -42,10 +103,18 @@ class InvalidDatabaseFieldError(Exception):
     pass
 
 
+class InvalidEnvironmentGroupError(Exception):
+    pass
+
+
 class MigrationRepository(object):
 
     def __init__(self, directory=None):
         self.directory = directory
+        self.manifest = MigrationManifest(manifest_path=self.repository_manifest_path(),
+                                          directories={MANIFEST_UPGRADE: self.repository_upgrade_path(),
+                                                       MANIFEST_DOWNGRADE: self.repository_downgrade_path()})
+        self.cached_database_config = None
 
     def repository_path(self):
         return self.path_for_directory_at_root_directory(path=DB_DIR)
@@ -59,6 +128,24 @@ class MigrationRepository(object):
     def repository_database_config_path(self):
         return self.path_for_directory_at_root_directory(path=DB_CONFIG_PATH)
 
+    def repository_data_path(self):
+        return self.path_for_directory_at_root_directory(path=DB_DATA_DIR)
+
+    def repository_baseline_path(self):
+        return self.path_for_directory_at_root_directory(path=DB_BASELINE_DIR)
+
+    def repository_manifest_path(self):
+        return self.path_for_directory_at_root_directory(path=DB_MANIFEST_PATH)
+
+    def repository_fingerprint_path(self):
+        return self.path_for_directory_at_root_directory(path=DB_FINGERPRINT_PATH)
+
+    def repository_snapshot_path(self):
+        return self.path_for_directory_at_root_directory(path=DB_SNAPSHOT_DIR)
+
+    def snapshot_path(self, environment):
+        return self.repository_snapshot_path() + "/" + environment + ".json"
+
     def path_for_directory_at_root_directory(self, path):
         if self.directory:
             path = '/'.join([self.directory, path])
@@ -70,6 +157,7 @@ class MigrationRepository(object):
     def clear(self):
         if self.is_repository_setup():
             shutil.rmtree(self.repository_path())
+            self.manifest.invalidate()
             return True
         else:
             return False
@@ -87,12 +175,14 @@ class MigrationRepository(object):
         else:
             return False
 
-    def database_config(self, environment=None, database_fields=DB_MAP_OPTIONS):
+    def database_config(self, environment=None, database_fields=None):
         if environment is None:
             return None
 
-        config = ConfigParser()
-        config.read(self.repository_database_config_path())
+        config = self.read_database_config()
+        engine = self.environment_setting(environment, ENGINE_SETTING)
+        if database_fields is None:
+            database_fields = engine_database_fields(engine) or DB_MAP_OPTIONS
 
         dict_map = {}
         for option in database_fields:
@@ -107,19 +197,173 @@ class MigrationRepository(object):
             except NoOptionError:
                 raise InvalidDatabaseFieldError("{0} is not a valid database field. \n"
                                                 "Either add it to the database.ini file or see if its a valid field.".format(option))
+        if engine is not None:
+            dict_map[ENGINE_SETTING] = engine
         return dict_map
 
+    def read_database_config(self):
+        """Returns the parsed database.ini, which is only parsed again once its mtime or size changes.
+
+        A file modified this close to when it was parsed is always parsed again, the way
+        the manifest rescans directories.
+        """
+        path = self.repository_database_config_path()
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stat = None
+        cached = self.cached_database_config
+        if stat is not None and cached is not None and cached[0] == path \
+                and cached[1] == (stat.st_mtime, stat.st_size) and stat.st_mtime < cached[2] - MANIFEST_MTIME_SLACK:
+            return cached[3]
+        parsed_at = time.time()
+        config = ConfigParser()
+        config.read(path)
+        if stat is not None:
+            self.cached_database_config = (path, (stat.st_mtime, stat.st_size), parsed_at, config)
+        return config
+
+    def environment_setting(self, environment, option, default=None):
+        config = self.read_database_config()
+        if environment is not None and config.has_option(environment, option):
+            return config.get(environment, option).strip()
+        return default
+
+    def is_environment_group(self, environment=None):
+        if environment is None:
+            return False
+        config = self.read_database_config()
+        return config.has_section(environment) and config.has_option(environment, DB_GROUP_MEMBERS_OPTION)
+
+    def environment_group(self, environment=None):
+        config = self.read_database_config()
+        if not config.has_section(environment):
+            raise InvalidEnvironmentError("{0} is not a validly declared environment".format(environment))
+        if not config.has_option(environment, DB_GROUP_MEMBERS_OPTION):
+            raise InvalidEnvironmentGroupError("{0} does not declare any {1}".format(environment,
+                                                                                    DB_GROUP_MEMBERS_OPTION))
+
+        def option(name, default):
+            if config.has_option(environment, name):
+                return config.get(environment, name)
+            return default
+
+        members = parse_group_members(config.get(environment, DB_GROUP_MEMBERS_OPTION))
+        canary = parse_group_members(option(DB_GROUP_CANARY_OPTION, ""))
+        for member in canary:
+            if member not in members:
+                raise InvalidEnvironmentGroupError("Canary {0} is not a member of {1}".format(member, environment))
+
+        on_error = option(DB_GROUP_ON_ERROR_OPTION, DB_GROUP_ON_ERROR_FAIL_FAST).strip()
+        if on_error not in DB_GROUP_ON_ERROR_POLICIES:
+            raise InvalidEnvironmentGroupError("{0} is not a valid {1} policy, expected one of: {2}".format(
+                on_error, DB_GROUP_ON_ERROR_OPTION, ", ".join(DB_GROUP_ON_ERROR_POLICIES)))
+
+        return {"members": members,
+                "canary": canary,
+                "concurrency": int(option(DB_GROUP_CONCURRENCY_OPTION, DB_GROUP_DEFAULT_CONCURRENCY)),
+                "on_error": on_error}
+
+    def target_database_config(self, target):
+        if is_dsn(target):
+            return {"dsn": target}
+        return self.database_config(environment=target)
+
     def current_migration_count(self):
-        return len(self.current_migrations_list())
+        return len(self.upgrade_index())
 
     def current_downgrade_count(self):
-        return len(self.current_downgrade_list())
+        return len(self.downgrade_index())
 
     def current_migrations_list(self):
-        return natsort.natsorted(os.listdir(self.repository_upgrade_path()))
+        return list(self.upgrade_index().file_names)
 
     def current_downgrade_list(self):
-        return natsort.natsorted(os.listdir(self.repository_downgrade_path()))
+        return list(self.downgrade_index().file_names)
+
+    def upgrade_index(self, checksums=False):
+        return self.manifest.index(MANIFEST_UPGRADE, checksums=checksums)
+
+    def downgrade_index(self, checksums=False):
+        return self.manifest.index(MANIFEST_DOWNGRADE, checksums=checksums)
+
+    def latest_baseline(self):
+        """Returns the ``(version, file_name)`` of the baseline covering the most migrations, if any."""
+        if not os.path.isdir(self.repository_baseline_path()):
+            return None
+        baselines = []
+        for file_name in os.listdir(self.repository_baseline_path()):
+            parsed = parse_migration_file_name(file_name)
+            if parsed is not None and parsed[1] == BASELINE_NAME:
+                baselines.append((parsed[0], file_name))
+        return max(baselines) if baselines else None
+
+    def upgrade_checksum(self, entry):
+        """Returns the checksum recorded for an upgrade index entry, which for copy migrations covers their data files.
+
+        Returns None when a copy migration's data file is missing.
+        """
+        if not is_copy_migration(entry[ENTRY_FILE_NAME]):
+            return entry[ENTRY_CHECKSUM]
+        try:
+            return read_copy_migration(path=self.repository_upgrade_path() + "/" + entry[ENTRY_FILE_NAME],
+                                       data_directory=self.repository_data_path(),
+                                       checksums=self.manifest.file_checksums)[1]
+        except (IOError, OSError):
+            return None
+
+    def fingerprint(self):
+        """Returns a SHA-256 digest of every file that decides the schema produced by a migrate.
+
+        Covers the upgrade scripts, the latest baseline and the data files loaded by copy
+        migrations, by name and contents, so it is the same for every checkout of a repository.
+        Checksums are kept in the manifest, so files are only hashed again once they change.
+        """
+        files = [(entry[ENTRY_FILE_NAME], entry[ENTRY_CHECKSUM]) for entry in self.upgrade_index(checksums=True).entries]
+        paths = []
+        baseline = self.latest_baseline()
+        if baseline is not None:
+            paths.append(self.repository_baseline_path() + "/" + baseline[1])
+        if os.path.isdir(self.repository_data_path()):
+            for file_name in sorted(os.listdir(self.repository_data_path())):
+                path = self.repository_data_path() + "/" + file_name
+                if os.path.isfile(path):
+                    paths.append(path)
+        files.extend(zip([os.path.relpath(path, self.repository_path()) for path in paths],
+                         self.manifest.file_checksums(paths)))
+
+        digest = hashlib.sha256()
+        for name, checksum in files:
+            digest.update("{0}:{1}\n".format(name, checksum).encode("utf-8"))
+        return digest.hexdigest()
+
+    def current_fingerprint(self):
+        """Returns the fingerprint of the repository along with the version of its newest upgrade script."""
+        index = self.upgrade_index()
+        return self.fingerprint(), (index.versions[-1] if len(index) else None)
+
+    def save_fingerprint(self):
+        """Saves the current fingerprint, so it can be checked without reading the migration files."""
+        fingerprint, version = self.current_fingerprint()
+        with open(self.repository_fingerprint_path(), "w") as fingerprint_file:
+            json.dump({"fingerprint": fingerprint, "version": version}, fingerprint_file, indent=1, sort_keys=True)
+        return fingerprint, version
+
+    def saved_fingerprint(self):
+        if not os.path.isfile(self.repository_fingerprint_path()):
+            return None
+        with open(self.repository_fingerprint_path(), "r") as fingerprint_file:
+            contents = json.load(fingerprint_file)
+        return contents["fingerprint"], contents["version"]
+
+    def create_baseline(self, version, contents):
+        if not os.path.exists(self.repository_baseline_path()):
+            os.mkdir(self.repository_baseline_path())
+        migration_path = self.repository_baseline_path() + "/" + migration_file_prefix(version) + BASELINE_NAME + ".sql"
+        with open(migration_path, "w") as baseline_file:
+            baseline_file.write(contents)
+        print("Created baseline:{0}".format(migration_path))
+        return migration_path
 
     def create_new_table_migration(self, name=None):
         if name:
@@ -158,17 +402,55 @@ class MigrationRepository(object):
                                   contents="DROP FUNCTION IF EXISTS sp_{0};".format(name),
                                   migration_index=migration_count)
 
+    def create_new_index_migration(self, table=None, columns=None):
+        if table and columns:
+            migration_count = self.current_migration_count()
+            index_name = re.sub(r'\W+', '_', "{0}_{1}_idx".format(table, "_".join(columns)))
+            self.create_migration(name="create_index_{0}".format(index_name),
+                                  directory=self.repository_upgrade_path(),
+                                  contents=CONCURRENT_INDEX_UPGRADE_TEMPLATE.format(index_name, table,
+                                                                                    ", ".join(columns)),
+                                  migration_index=migration_count)
+            self.create_migration(name="drop_index_{0}".format(index_name),
+                                  directory=self.repository_downgrade_path(),
+                                  contents=CONCURRENT_INDEX_DOWNGRADE_TEMPLATE.format(index_name),
+                                  migration_index=migration_count)
+
+    def create_new_data_migration(self, name=None):
+        if name:
+            if not os.path.exists(self.repository_data_path()):
+                os.mkdir(self.repository_data_path())
+            migration_count = self.current_migration_count()
+            self.create_migration(name="load_{0}".format(name),
+                                  directory=self.repository_upgrade_path(),
+                                  contents=COPY_MIGRATION_TEMPLATE.format(name),
+                                  migration_index=migration_count,
+                                  extension=COPY_MIGRATION_EXTENSION)
+            self.create_migration(name="truncate_{0}".format(name),
+                                  directory=self.repository_downgrade_path(),
+                                  contents="TRUNCATE TABLE {0};".format(name),
+                                  migration_index=migration_count)
+
+    def create_new_backfill_migration(self, table=None):
+        if table:
+            migration_count = self.current_migration_count()
+            self.create_migration(name="backfill_{0}".format(table),
+                                  directory=self.repository_upgrade_path(),
+                                  contents=BACKFILL_MIGRATION_TEMPLATE.format(table),
+                                  migration_index=migration_count,
+                                  extension=BACKFILL_MIGRATION_EXTENSION)
+            self.create_migration(name="undo_backfill_{0}".format(table),
+                                  directory=self.repository_downgrade_path(),
+                                  contents="/* Insert statements undoing the backfill here */ SELECT 1;",
+                                  migration_index=migration_count)
+
     def create_migration(self,
                          directory,
                          name,
                          contents,
-                         migration_index=0):
-        if migration_index < 10:
-            migration_prefix = "V0{0}__".format(migration_index)
-        else:
-            migration_prefix = "V{0}__".format(migration_index)
-
-        migration_file_name = migration_prefix + name + ".sql"
+                         migration_index=0,
+                         extension=".sql"):
+        migration_file_name = migration_file_prefix(migration_index) + name + extension
         migration_path = directory + "/" + migration_file_name
         print("Created migration:{0}".format(migration_path))
         migration_file = open(migration_path, 'a')
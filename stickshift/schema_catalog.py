@@ -0,0 +1,176 @@
+import json
+import time
+
+try:
+    from stickshift.migration_history import describe_bytes
+except ImportError:
+    from migration_history import describe_bytes
+
+# Rows fetched from a server-side cursor at a time, so a large catalog is never held in memory at once.
+CATALOG_FETCH_SIZE = 2000
+
+SNAPSHOT_FORMAT = 1
+
+# Tables, partitioned tables, views, materialized views and foreign tables.
+CATALOG_RELKINDS = "('r', 'p', 'v', 'm', 'f')"
+
+QUERY_CATALOG_TABLES = "SELECT c.relname, c.relkind, " \
+                       "CASE WHEN c.reltuples < 0 THEN NULL ELSE c.reltuples::BIGINT END, " \
+                       "pg_total_relation_size(c.oid) " \
+                       "FROM pg_catalog.pg_class c " \
+                       "JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace " \
+                       "WHERE n.nspname = 'public' AND c.relkind IN " + CATALOG_RELKINDS + " " \
+                       "ORDER BY c.relname;"
+
+QUERY_CATALOG_COLUMNS = "SELECT c.relname, a.attname, format_type(a.atttypid, a.atttypmod), a.attnotnull, " \
+                        "pg_get_expr(d.adbin, d.adrelid) " \
+                        "FROM pg_catalog.pg_attribute a " \
+                        "JOIN pg_catalog.pg_class c ON c.oid = a.attrelid " \
+                        "JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace " \
+                        "LEFT JOIN pg_catalog.pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum " \
+                        "WHERE n.nspname = 'public' AND c.relkind IN " + CATALOG_RELKINDS + " " \
+                        "AND a.attnum > 0 AND NOT a.attisdropped " \
+                        "ORDER BY c.relname, a.attnum;"
+
+QUERY_CATALOG_INDEXES = "SELECT i.relname, t.relname, pg_get_indexdef(i.oid), x.indisvalid, pg_relation_size(i.oid) " \
+                        "FROM pg_catalog.pg_index x " \
+                        "JOIN pg_catalog.pg_class i ON i.oid = x.indexrelid " \
+                        "JOIN pg_catalog.pg_class t ON t.oid = x.indrelid " \
+                        "JOIN pg_catalog.pg_namespace n ON n.oid = i.relnamespace " \
+                        "WHERE n.nspname = 'public' " \
+                        "ORDER BY i.relname;"
+
+QUERY_CATALOG_FUNCTIONS = "SELECT p.proname || '(' || pg_get_function_identity_arguments(p.oid) || ')', " \
+                          "md5(pg_get_functiondef(p.oid)) " \
+                          "FROM pg_catalog.pg_proc p " \
+                          "JOIN pg_catalog.pg_namespace n ON n.oid = p.pronamespace " \
+                          "WHERE n.nspname = 'public' AND p.prokind IN ('f', 'p') " \
+                          "ORDER BY 1;"
+
+RELKIND_NAMES = {"r": "table", "p": "partitioned table", "v": "view", "m": "materialized view",
+                 "f": "foreign table"}
+
+
+class InvalidSnapshotError(Exception):
+    pass
+
+
+def describe_column(data_type, not_null, default):
+    definition = data_type
+    if not_null:
+        definition += " NOT NULL"
+    if default is not None:
+        definition += " DEFAULT " + default
+    return definition
+
+
+class SchemaSnapshot(object):
+    """The tables, columns, indexes and functions of a database at one point in time.
+
+    Row estimates and sizes are kept alongside the structure, but only the structure is compared.
+    """
+
+    def __init__(self, environment=None, version=None, taken_at=None, tables=None, indexes=None, functions=None):
+        self.environment = environment
+        self.version = version
+        self.taken_at = taken_at
+        self.tables = tables if tables is not None else {}
+        self.indexes = indexes if indexes is not None else {}
+        self.functions = functions if functions is not None else {}
+
+    def describe(self):
+        table_bytes = sum(table["bytes"] or 0 for table in self.tables.values())
+        return "{0} tables, {1} indexes, {2} functions, {3}".format(len(self.tables), len(self.indexes),
+                                                                  len(self.functions), describe_bytes(table_bytes))
+
+    def describe_tables(self):
+        return ["{0}: {1} rows, {2}".format(name, "-" if table["rows"] is None else table["rows"],
+                                            describe_bytes(table["bytes"]))
+                for name, table in sorted(self.tables.items())]
+
+    def to_dict(self):
+        return {"format": SNAPSHOT_FORMAT,
+                "environment": self.environment,
+                "version": self.version,
+                "taken_at": self.taken_at,
+                "tables": self.tables,
+                "indexes": self.indexes,
+                "functions": self.functions}
+
+    @classmethod
+    def from_dict(cls, contents):
+        return cls(environment=contents.get("environment"),
+                   version=contents.get("version"),
+                   taken_at=contents.get("taken_at"),
+                   tables=contents["tables"],
+                   indexes=contents["indexes"],
+                   functions=contents["functions"])
+
+
+def read_schema_snapshot(stream_rows, environment=None, version=None):
+    """Builds a snapshot from one query per kind of object, whose rows ``stream_rows(query)`` yields."""
+    snapshot = SchemaSnapshot(environment=environment, version=version, taken_at=int(time.time()))
+    for name, kind, rows, size in stream_rows(QUERY_CATALOG_TABLES):
+        snapshot.tables[name] = {"kind": kind, "rows": rows, "bytes": size, "columns": {}}
+    for table, name, data_type, not_null, default in stream_rows(QUERY_CATALOG_COLUMNS):
+        if table in snapshot.tables:
+            snapshot.tables[table]["columns"][name] = describe_column(data_type, not_null, default)
+    for name, table, definition, valid, size in stream_rows(QUERY_CATALOG_INDEXES):
+        snapshot.indexes[name] = {"table": table, "definition": definition, "valid": valid, "bytes": size}
+    for signature, checksum in stream_rows(QUERY_CATALOG_FUNCTIONS):
+        snapshot.functions[signature] = checksum
+    return snapshot
+
+
+def save_snapshot(snapshot, path):
+    with open(path, "w") as snapshot_file:
+        json.dump(snapshot.to_dict(), snapshot_file, indent=1, sort_keys=True)
+
+
+def load_snapshot(path):
+    try:
+        with open(path, "r") as snapshot_file:
+            contents = json.load(snapshot_file)
+        if contents.get("format") != SNAPSHOT_FORMAT:
+            raise ValueError("unknown format {0}".format(contents.get("format")))
+        return SchemaSnapshot.from_dict(contents)
+    except (IOError, OSError, ValueError, KeyError, AttributeError) as error:
+        raise InvalidSnapshotError("{0} is not a valid schema snapshot: {1}".format(path, error))
+
+
+def diff_entries(kind, old, new, describe, show_changes=True):
+    changes = []
+    for name in sorted(set(old) | set(new)):
+        if name not in new:
+            changes.append("- {0} {1}".format(kind, name))
+        elif name not in old:
+            changes.append("+ {0} {1}".format(kind, name))
+        elif describe(old[name]) != describe(new[name]):
+            if show_changes:
+                changes.append("~ {0} {1}: {2} -> {3}".format(kind, name, describe(old[name]), describe(new[name])))
+            else:
+                changes.append("~ {0} {1}".format(kind, name))
+    return changes
+
+
+def describe_index(index):
+    return index["definition"] if index["valid"] else index["definition"] + " INVALID"
+
+
+def diff_snapshots(old, new):
+    """Returns the structural differences between two snapshots, one line per added, removed or changed object.
+
+    Objects are matched by name through the dicts of both snapshots rather than compared pairwise.
+    """
+    changes = diff_entries("table", old.tables, new.tables, lambda table: RELKIND_NAMES.get(table["kind"],
+                                                                                              table["kind"]))
+    for name in sorted(set(old.tables) & set(new.tables)):
+        changes.extend(diff_entries("column", dict(("{0}.{1}".format(name, column), definition)
+                                                   for column, definition in old.tables[name]["columns"].items()),
+                                    dict(("{0}.{1}".format(name, column), definition)
+                                         for column, definition in new.tables[name]["columns"].items()),
+                                    lambda definition: definition))
+    changes.extend(diff_entries("index", old.indexes, new.indexes, describe_index))
+    changes.extend(diff_entries("function", old.functions, new.functions, lambda checksum: checksum,
+                                show_changes=False))
+    return changes
@@ -0,0 +1,105 @@
+try:
+    from stickshift.migration_repository import MigrationRepository
+except ImportError:
+    from migration_repository import MigrationRepository
+
+SCHEMA_UP_TO_DATE = "up-to-date"
+SCHEMA_BEHIND = "behind"
+SCHEMA_AHEAD = "ahead"
+
+SQLSTATE_UNDEFINED_TABLE = "42P01"
+
+# A single row holding the fingerprint of the repository the database was last fully
+# migrated with, or NULL while it isn't, along with its newest applied version.
+QUERY_CREATE_FINGERPRINT_TABLE = 'CREATE TABLE IF NOT EXISTS "version_migration_fingerprint" ' \
+                                 '(id INTEGER PRIMARY KEY, fingerprint VARCHAR(64), version INTEGER);'
+
+QUERY_DROP_FINGERPRINT_TABLE = 'DROP TABLE IF EXISTS "version_migration_fingerprint";'
+
+# Joined with the newest applied version, which the primary key of the version table serves, so a
+# database whose version table is missing, or was changed without recording a fingerprint, has none.
+QUERY_SCHEMA_FINGERPRINT = "SELECT f.fingerprint, f.version FROM version_migration_fingerprint f " \
+                           "CROSS JOIN (SELECT MAX(version) AS version FROM version_migration) applied " \
+                           "WHERE f.id = 1 AND (f.version = applied.version " \
+                           "OR (f.version IS NULL AND applied.version IS NULL));"
+
+QUERY_SAVE_SCHEMA_FINGERPRINT = "INSERT INTO version_migration_fingerprint (id, fingerprint, version) " \
+                                "VALUES (1, %s, %s) " \
+                                "ON CONFLICT (id) DO UPDATE SET fingerprint = EXCLUDED.fingerprint, " \
+                                "version = EXCLUDED.version;"
+
+# The fingerprint of every repository directory checked so far, since it only changes on a deploy.
+LOCAL_FINGERPRINTS = {}
+
+
+def local_fingerprint(directory=None):
+    """Returns the ``(fingerprint, version)`` of a repository, computed once per process.
+
+    They are read from ``db/fingerprint.json`` when it was saved with ``stickshift fingerprint``,
+    and only computed from the migration files otherwise.
+    """
+    if directory not in LOCAL_FINGERPRINTS:
+        migration_repository = MigrationRepository(directory=directory)
+        LOCAL_FINGERPRINTS[directory] = migration_repository.saved_fingerprint() or \
+            migration_repository.current_fingerprint()
+    return LOCAL_FINGERPRINTS[directory]
+
+
+def is_undefined_table(error):
+    return getattr(error, "pgcode", None) == SQLSTATE_UNDEFINED_TABLE or "no such table" in str(error)
+
+
+def recorded_fingerprint(connection):
+    """Returns the ``(fingerprint, version)`` recorded in a database, or None if it has none.
+
+    A database without a version table, or whose newest applied version isn't the recorded
+    one, has none. A connection outside of autocommit is rolled back when either table is missing.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute(QUERY_SCHEMA_FINGERPRINT)
+        row = cursor.fetchone()
+    except Exception as error:
+        if not is_undefined_table(error):
+            raise
+        if not connection.autocommit:
+            connection.rollback()
+        return None
+    finally:
+        cursor.close()
+    return tuple(row) if row is not None else None
+
+
+def compare_fingerprints(local, recorded):
+    """Returns whether the database that recorded a fingerprint is up to date with, behind or ahead of a repository."""
+    if recorded is None:
+        return SCHEMA_BEHIND
+    if recorded[0] is not None and recorded[0] == local[0]:
+        return SCHEMA_UP_TO_DATE
+    if recorded[1] is not None and (local[1] is None or recorded[1] > local[1]):
+        return SCHEMA_AHEAD
+    return SCHEMA_BEHIND
+
+
+def schema_status(connection=None, environment=None, directory=None):
+    """Returns whether a database is up to date with, behind or ahead of the repository at ``directory``.
+
+    Runs a single query reading the fingerprint the database recorded, over ``connection``
+    or over a connection to ``environment`` opened for the check. Only the newest version
+    of the version table is read, and the migration directory isn't read at all once the
+    repository fingerprint was saved.
+    """
+    local = local_fingerprint(directory)
+    if connection is not None:
+        return compare_fingerprints(local, recorded_fingerprint(connection))
+    try:
+        from stickshift.database_engine import engine_for
+    except ImportError:
+        from database_engine import engine_for
+    database_config = MigrationRepository(directory=directory).database_config(environment)
+    connection = engine_for(database_config).connect(database_config)
+    try:
+        connection.autocommit = True
+        return compare_fingerprints(local, recorded_fingerprint(connection))
+    finally:
+        connection.close()
@@ -0,0 +1,75 @@
+import re
+
+DIRECTIVE_PREFIX = re.compile(r"^--\s*stickshift:\s*(.*)$", re.I)
+DIRECTIVE_OPTION = re.compile(r"([\w-]+)(?:\s*=\s*([^\s,]+))?")
+
+# Directives are only read from the comment block at the top of a script.
+DIRECTIVE_HEADER_BYTES = 4096
+
+TIMEOUT_VALUE = re.compile(r"^\d+\s*(?:us|ms|s|min|h|d)?$")
+
+DIRECTIVE_LOCK_TIMEOUT = "lock_timeout"
+DIRECTIVE_STATEMENT_TIMEOUT = "statement_timeout"
+DIRECTIVE_TIMEOUTS = [DIRECTIVE_LOCK_TIMEOUT, DIRECTIVE_STATEMENT_TIMEOUT]
+
+# Runs the script one statement at a time outside of any transaction, as needed by
+# statements such as CREATE INDEX CONCURRENTLY.
+DIRECTIVE_NO_TRANSACTION = "no-transaction"
+
+# Versions of older migrations a migration depends on, which may be repeated. Migrations
+# applied in parallel only wait for the migrations they depend on.
+DIRECTIVE_DEPENDS = "depends"
+
+DEPENDENCY_VALUE = re.compile(r"^[vV]?(\d+)$")
+
+
+class InvalidDirectiveError(Exception):
+    pass
+
+
+def parse_script_directives(header):
+    """Parses ``-- stickshift: name=value, flag`` comments at the top of a script.
+
+    Options without a value are flags set to True, and ``depends`` collects the list of
+    versions it names. Parsing stops at the first line that is neither blank nor a comment.
+    """
+    directives = {}
+    for line in header.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if not line.startswith("--"):
+            break
+        match = DIRECTIVE_PREFIX.match(line)
+        if match is None:
+            continue
+        for name, value in DIRECTIVE_OPTION.findall(match.group(1)):
+            if name.lower() == DIRECTIVE_DEPENDS:
+                directives.setdefault(DIRECTIVE_DEPENDS, []).append(validate_dependency(value or True))
+            else:
+                directives[name.lower()] = value if value else True
+    for name in DIRECTIVE_TIMEOUTS:
+        if name in directives:
+            validate_timeout(name, directives[name])
+    return directives
+
+
+def read_script_directives(path):
+    with open(path, "rb") as script_file:
+        header = script_file.read(DIRECTIVE_HEADER_BYTES)
+    return parse_script_directives(header.decode("utf-8", "replace"))
+
+
+def validate_timeout(name, value):
+    if value is True or not TIMEOUT_VALUE.match(str(value)):
+        raise InvalidDirectiveError("{0} is not a valid value for {1}, expected a duration such as 500ms".format(
+            value, name))
+    return value
+
+
+def validate_dependency(value):
+    match = DEPENDENCY_VALUE.match(str(value)) if value is not True else None
+    if match is None:
+        raise InvalidDirectiveError("{0} is not a valid value for {1}, expected a version such as V12".format(
+            value, DIRECTIVE_DEPENDS))
+    return int(match.group(1))
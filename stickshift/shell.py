@@ -1,12 +1,6 @@
 import os
 import sys
 import click
-try:
-    from stickshift.migration_repository import MigrationRepository
-    from stickshift.database_manager import DatabaseManager
-except ImportError:
-    from migration_repository import MigrationRepository
-    from database_manager import DatabaseManager
 
 cmd_folder = os.path.abspath(os.path.dirname(__file__))
 
@@ -16,6 +10,7 @@ class ShellContext(object):
     def __init__(self):
         self.verbose = False
         self.directory = ""
+        self.migration_repository = None
 
     def log(self, msg, *args):
         """Logs a message to stderr."""
@@ -23,16 +18,34 @@ class ShellContext(object):
             msg %= args
         click.echo(msg, file=sys.stderr)
 
+    def echo(self, msg):
+        """Writes a message to stdout."""
+        click.echo(msg)
+
     def vlog(self, msg, *args):
         """Logs a message to stderr only if verbose is enabled."""
         if self.verbose:
             self.log(msg, *args)
 
     def repository(self):
-        return MigrationRepository(directory=self.directory) if self.directory else MigrationRepository()
+        try:
+            from stickshift.migration_repository import MigrationRepository
+        except ImportError:
+            from migration_repository import MigrationRepository
+        directory = self.directory or None
+        if self.migration_repository is None or self.migration_repository.directory != directory:
+            self.migration_repository = MigrationRepository(directory=directory)
+        return self.migration_repository
 
-    def database_manager(self, environment):
-        return DatabaseManager(migration_repository=self.repository(), environment=environment)
+    def database_manager(self, environment, connection=None):
+        try:
+            from stickshift.database_manager import DatabaseManager
+        except ImportError:
+            from database_manager import DatabaseManager
+        return DatabaseManager(migration_repository=self.repository(),
+                               environment=environment,
+                               connection=connection,
+                               output=self.echo)
 
 pass_context = click.make_pass_decorator(ShellContext, ensure=True)
 
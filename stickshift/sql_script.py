@@ -0,0 +1,216 @@
+import re
+import codecs
+import hashlib
+
+SCRIPT_READ_CHUNK_SIZE = 1024 * 1024
+
+LEXER_NORMAL = 0
+LEXER_SINGLE_QUOTE = 1
+LEXER_ESCAPE_QUOTE = 2
+LEXER_DOUBLE_QUOTE = 3
+LEXER_LINE_COMMENT = 4
+LEXER_BLOCK_COMMENT = 5
+LEXER_DOLLAR_QUOTE = 6
+
+NORMAL_TOKEN = re.compile(r"""[;'"$/-]""")
+ESCAPE_QUOTE_TOKEN = re.compile(r"[\\']")
+BLOCK_COMMENT_TOKEN = re.compile(r"/\*|\*/")
+DOLLAR_TAG = re.compile(r"\$(?:[^\W\d]\w*)?\$", re.UNICODE)
+PARTIAL_DOLLAR_TAG = re.compile(r"\$(?:[^\W\d]\w*)?", re.UNICODE)
+IDENTIFIER_CHARACTER = re.compile(r"[\w$]", re.UNICODE)
+
+# Characters of already scanned input kept ahead of the unscanned input, so a token
+# such as E'' can still look behind itself after the scanned text has been handed off.
+LEXER_LOOKBEHIND = 2
+
+
+class ScriptReader(object):
+    """Reads a script as text in chunks while computing the SHA-256 checksum of its bytes."""
+
+    def __init__(self, script_file, chunk_size=SCRIPT_READ_CHUNK_SIZE):
+        self.script_file = script_file
+        self.chunk_size = chunk_size
+        self.digest = hashlib.sha256()
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.bytes_read = 0
+
+    def read(self):
+        """Returns the next chunk of text, or an empty string at the end of the script."""
+        while True:
+            data = self.script_file.read(self.chunk_size)
+            self.digest.update(data)
+            self.bytes_read += len(data)
+            text = self.decoder.decode(data, final=not data)
+            if text or not data:
+                return text
+
+    def checksum(self):
+        return self.digest.hexdigest()
+
+
+class StatementLexer(object):
+    """Splits SQL text read in chunks into individual statements.
+
+    Semicolons inside string literals, quoted identifiers, comments and dollar
+    quoted bodies do not end a statement. Statements are returned exactly as they
+    appear in the script, including any leading whitespace and comments, so that
+    their lengths add up to the length of the script.
+    """
+
+    def __init__(self, read):
+        self.read = read
+        self.pending = []
+        self.buffer = ""
+        self.position = 0
+        self.statement_start = 0
+        self.final = False
+        self.reset_statement()
+
+    def reset_statement(self):
+        self.state = LEXER_NORMAL
+        self.depth = 0
+        self.tag = None
+        self.has_code = False
+
+    def __iter__(self):
+        while True:
+            end = self.advance()
+            if end is not None:
+                statement = "".join(self.pending) + self.buffer[self.statement_start:end]
+                self.pending = []
+                self.statement_start = end
+                self.reset_statement()
+                yield statement
+            elif self.final:
+                if self.has_code:
+                    yield "".join(self.pending) + self.buffer[self.statement_start:]
+                return
+            else:
+                chunk = self.read()
+                if not chunk:
+                    self.final = True
+                keep = max(0, self.position - LEXER_LOOKBEHIND)
+                if self.statement_start < keep:
+                    self.pending.append(self.buffer[self.statement_start:keep])
+                    self.statement_start = keep
+                self.buffer = self.buffer[keep:] + chunk
+                self.position -= keep
+                self.statement_start -= keep
+
+    def advance(self):
+        """Scans the buffer, returning the end of the next statement or None if more input is needed."""
+        buffer = self.buffer
+        length = len(buffer)
+        position = self.position
+        final = self.final
+        while position < length:
+            if self.state == LEXER_NORMAL:
+                match = NORMAL_TOKEN.search(buffer, position)
+                start = match.start() if match else length
+                if not self.has_code and buffer[position:start].strip():
+                    self.has_code = True
+                if match is None:
+                    position = length
+                    break
+                character = buffer[start]
+                if character == ";":
+                    position = start + 1
+                    if self.has_code:
+                        self.position = position
+                        return position
+                elif character == "'":
+                    self.has_code = True
+                    self.state = LEXER_SINGLE_QUOTE
+                    if start > 0 and buffer[start - 1] in "eE" \
+                            and (start < 2 or not IDENTIFIER_CHARACTER.match(buffer[start - 2])):
+                        self.state = LEXER_ESCAPE_QUOTE
+                    position = start + 1
+                elif character == '"':
+                    self.has_code = True
+                    self.state = LEXER_DOUBLE_QUOTE
+                    position = start + 1
+                elif character in "-/":
+                    if start + 1 >= length and not final:
+                        position = start
+                        break
+                    following = buffer[start + 1:start + 2]
+                    if character == "-" and following == "-":
+                        self.state = LEXER_LINE_COMMENT
+                        position = start + 2
+                    elif character == "/" and following == "*":
+                        self.state = LEXER_BLOCK_COMMENT
+                        self.depth = 1
+                        position = start + 2
+                    else:
+                        self.has_code = True
+                        position = start + 1
+                else:
+                    self.has_code = True
+                    tag = DOLLAR_TAG.match(buffer, start)
+                    if start > 0 and IDENTIFIER_CHARACTER.match(buffer[start - 1]):
+                        position = start + 1
+                    elif tag is not None:
+                        self.state = LEXER_DOLLAR_QUOTE
+                        self.tag = tag.group(0)
+                        position = tag.end()
+                    elif not final and PARTIAL_DOLLAR_TAG.match(buffer, start).end() == length:
+                        position = start
+                        break
+                    else:
+                        position = start + 1
+            elif self.state in (LEXER_SINGLE_QUOTE, LEXER_DOUBLE_QUOTE):
+                quote = "'" if self.state == LEXER_SINGLE_QUOTE else '"'
+                end = buffer.find(quote, position)
+                if end == -1:
+                    position = length
+                elif end + 1 >= length and not final:
+                    position = end
+                    break
+                elif buffer[end + 1:end + 2] == quote:
+                    position = end + 2
+                else:
+                    self.state = LEXER_NORMAL
+                    position = end + 1
+            elif self.state == LEXER_ESCAPE_QUOTE:
+                match = ESCAPE_QUOTE_TOKEN.search(buffer, position)
+                if match is None:
+                    position = length
+                elif match.start() + 1 >= length and not final:
+                    position = match.start()
+                    break
+                elif buffer[match.start()] == "\\" or buffer[match.start() + 1:match.start() + 2] == "'":
+                    position = match.start() + 2
+                else:
+                    self.state = LEXER_NORMAL
+                    position = match.start() + 1
+            elif self.state == LEXER_LINE_COMMENT:
+                end = buffer.find("\n", position)
+                if end == -1:
+                    position = length
+                else:
+                    self.state = LEXER_NORMAL
+                    position = end + 1
+            elif self.state == LEXER_BLOCK_COMMENT:
+                match = BLOCK_COMMENT_TOKEN.search(buffer, position)
+                if match is None:
+                    position = length if final else max(position, length - 1)
+                    break
+                self.depth += 1 if match.group(0) == "/*" else -1
+                if self.depth == 0:
+                    self.state = LEXER_NORMAL
+                position = match.end()
+            else:
+                end = buffer.find(self.tag, position)
+                if end == -1:
+                    position = length if final else max(position, length - len(self.tag) + 1)
+                    break
+                position = end + len(self.tag)
+                self.state = LEXER_NORMAL
+                self.tag = None
+        self.position = position
+        return None
+
+
+def split_statements(text):
+    chunks = [text]
+    return list(StatementLexer(lambda: chunks.pop() if chunks else ""))
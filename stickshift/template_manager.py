@@ -0,0 +1,177 @@
+try:
+    from stickshift.database_manager import DatabaseManager, connect_database, quote_identifier, print_output
+    from stickshift.database_engine import FEATURE_TEMPLATES, engine_for
+except ImportError:
+    from database_manager import DatabaseManager, connect_database, quote_identifier, print_output
+    from database_engine import FEATURE_TEMPLATES, engine_for
+
+TEMPLATE_KEEP_SETTING = "template_keep"
+TEMPLATE_DEFAULT_KEEP = 1
+
+# Postgres truncates identifiers longer than 63 bytes, which would make names collide.
+TEMPLATE_NAME_FORMAT = "{0}_tpl_{1}"
+TEMPLATE_DATABASE_NAME_LENGTH = 40
+TEMPLATE_FINGERPRINT_LENGTH = 16
+
+QUERY_DATABASE_IS_TEMPLATE = "SELECT datistemplate FROM pg_database WHERE datname = %s;"
+
+# Templates are ordered newest first, since OIDs are assigned in creation order.
+QUERY_LIST_TEMPLATES = "SELECT datname FROM pg_database WHERE datistemplate ORDER BY oid DESC;"
+
+QUERY_CREATE_DATABASE = "CREATE DATABASE {0};"
+
+QUERY_CREATE_DATABASE_FROM_TEMPLATE = "CREATE DATABASE {0} TEMPLATE {1};"
+
+QUERY_MARK_TEMPLATE = "ALTER DATABASE {0} WITH IS_TEMPLATE true ALLOW_CONNECTIONS false;"
+
+QUERY_UNMARK_TEMPLATE = "ALTER DATABASE {0} WITH IS_TEMPLATE false;"
+
+QUERY_DROP_DATABASE = "DROP DATABASE IF EXISTS {0};"
+
+QUERY_LOCK_TEMPLATE = "SELECT pg_advisory_lock(hashtext(%s));"
+
+QUERY_UNLOCK_TEMPLATE = "SELECT pg_advisory_unlock(hashtext(%s));"
+
+
+class DatabaseAlreadyExistsError(Exception):
+    pass
+
+
+def database_config_for(database_config, database):
+    """Returns a copy of the database config connecting to another database on the same server."""
+    if "dsn" in database_config:
+        import psycopg2.extensions
+        return {"dsn": psycopg2.extensions.make_dsn(database_config["dsn"], dbname=database)}
+    database_config = dict(database_config)
+    database_config["database"] = database
+    return database_config
+
+
+def template_prefix(database):
+    return TEMPLATE_NAME_FORMAT.format(database[:TEMPLATE_DATABASE_NAME_LENGTH], "")
+
+
+class TemplateManager(object):
+    """Creates databases by copying a fully migrated template database.
+
+    Templates are named after the environment database and the repository fingerprint,
+    so a template is only built the first time a migration set is cloned.
+    """
+
+    def __init__(self, migration_repository, environment, database_config=None, connection=None, output=None):
+        self.migration_repository = migration_repository
+        self.environment = environment
+        self.output = output or print_output
+        if database_config is None:
+            database_config = migration_repository.database_config(self.environment)
+        self.database_config = database_config
+        engine_for(database_config).require(FEATURE_TEMPLATES)
+        self.keep = max(1, int(migration_repository.environment_setting(environment,
+                                                                        TEMPLATE_KEEP_SETTING,
+                                                                        TEMPLATE_DEFAULT_KEEP)))
+        self.connection = connection
+        if self.connection is None:
+            self.connection = connect_database(self.database_config)
+        self.connection.autocommit = True
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def database_name(self):
+        return self.connection.get_dsn_parameters()["dbname"]
+
+    def template_name(self):
+        return template_prefix(self.database_name()) + \
+            self.migration_repository.fingerprint()[:TEMPLATE_FINGERPRINT_LENGTH]
+
+    def database_is_template(self, name):
+        """Returns whether the database is a finished template, or None when it doesn't exist."""
+        with self.connection.cursor() as cursor:
+            cursor.execute(QUERY_DATABASE_IS_TEMPLATE, (name,))
+            row = cursor.fetchone()
+        return row[0] if row is not None else None
+
+    def list_templates(self):
+        prefix = template_prefix(self.database_name())
+        with self.connection.cursor() as cursor:
+            cursor.execute(QUERY_LIST_TEMPLATES)
+            return [name for name, in cursor if name.startswith(prefix)]
+
+    def clone(self, name, prune=True):
+        """Creates the database ``name`` from the template of the current migration set and returns the template."""
+        if self.database_is_template(name) is not None:
+            raise DatabaseAlreadyExistsError("{0} already exists".format(name))
+        template = self.template_name()
+        self.ensure_template(template)
+        with self.connection.cursor() as cursor:
+            cursor.execute(QUERY_CREATE_DATABASE_FROM_TEMPLATE.format(quote_identifier(name),
+                                                                      quote_identifier(template)))
+        self.output("Database:{0} created from {1}".format(name, template))
+        if prune:
+            self.prune_templates(current=template)
+        return template
+
+    def ensure_template(self, template):
+        # Jobs cloning the same migration set at once wait for a single build.
+        with self.connection.cursor() as cursor:
+            cursor.execute(QUERY_LOCK_TEMPLATE, (template,))
+        try:
+            if not self.database_is_template(template):
+                self.build_template(template)
+        finally:
+            with self.connection.cursor() as cursor:
+                cursor.execute(QUERY_UNLOCK_TEMPLATE, (template,))
+
+    def build_template(self, template):
+        """Migrates a new database and marks it as a template, dropping it if the migrate fails."""
+        self.output("Template:{0} building".format(template))
+        with self.connection.cursor() as cursor:
+            # A database that was never marked as a template is left over from a failed build.
+            cursor.execute(QUERY_DROP_DATABASE.format(quote_identifier(template)))
+            cursor.execute(QUERY_CREATE_DATABASE.format(quote_identifier(template)))
+        try:
+            database_manager = DatabaseManager(migration_repository=self.migration_repository,
+                                               environment=self.environment,
+                                               database_config=database_config_for(self.database_config, template),
+                                               output=self.output)
+            try:
+                database_manager.provision_database()
+                database_manager.migrate()
+            finally:
+                database_manager.close()
+        except Exception:
+            with self.connection.cursor() as cursor:
+                cursor.execute(QUERY_DROP_DATABASE.format(quote_identifier(template)))
+            raise
+        with self.connection.cursor() as cursor:
+            cursor.execute(QUERY_MARK_TEMPLATE.format(quote_identifier(template)))
+        self.output("Template:{0} built".format(template))
+
+    def prune_templates(self, current=None):
+        """Drops all but the ``keep`` newest templates of the environment, always keeping ``current``.
+
+        Templates that can't be dropped, such as one being cloned at the same time, are skipped.
+        """
+        import psycopg2
+        templates = [template for template in self.list_templates() if template != current]
+        dropped = []
+        for template in templates[self.keep - (1 if current is not None else 0):]:
+            try:
+                self.drop_template(template)
+            except psycopg2.Error as error:
+                self.output("Template:{0} not dropped, {1}".format(template, str(error).strip()))
+                continue
+            dropped.append(template)
+        return dropped
+
+    def drop_template(self, template):
+        with self.connection.cursor() as cursor:
+            cursor.execute(QUERY_UNMARK_TEMPLATE.format(quote_identifier(template)))
+            try:
+                cursor.execute(QUERY_DROP_DATABASE.format(quote_identifier(template)))
+            except Exception:
+                cursor.execute(QUERY_MARK_TEMPLATE.format(quote_identifier(template)))
+                raise
+        self.output("Template:{0} dropped".format(template))
@@ -0,0 +1,154 @@
+import sys
+import asyncio
+import unittest
+
+from stickshift.migration_repository import MigrationRepository
+from stickshift.database_manager import DatabaseManager, MigrateLockTimeoutError, QUERY_MIGRATE_LOCK, \
+    QUERY_MIGRATE_UNLOCK
+
+# The asyncio manager uses async/await and asynccontextmanager, which older Pythons can't import.
+ASYNC_SUPPORTED = sys.version_info >= (3, 7)
+if ASYNC_SUPPORTED:
+    from stickshift.async_database_manager import AsyncDatabaseManager, migrate_targets
+
+
+@unittest.skipUnless(ASYNC_SUPPORTED, "AsyncDatabaseManager needs Python 3.7 or later")
+class AsyncDatabaseManagerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.migration_repository = MigrationRepository()
+        self.migration_repository.clear()
+        self.migration_repository.create_repository()
+        self.database_manager = DatabaseManager(migration_repository=self.migration_repository,
+                                                environment="DATABASE")
+        self.async_database_manager = AsyncDatabaseManager(migration_repository=self.migration_repository,
+                                                           environment="DATABASE",
+                                                           output=lambda message: None)
+
+    def tearDown(self):
+        self.async_database_manager.close()
+        if self.database_manager.is_database_provisioned():
+            self.database_manager.reset()
+            self.database_manager.deprovision_database()
+        self.database_manager.close()
+        self.migration_repository.clear()
+
+    def run_async(self, coroutine):
+        return asyncio.run(coroutine)
+
+    def test_provision_database(self):
+        self.assertTrue(self.run_async(self.async_database_manager.provision_database()))
+        self.assertTrue(self.database_manager.is_database_provisioned())
+        self.assertFalse(self.run_async(self.async_database_manager.provision_database()))
+
+    def test_migrate_runs_multiple_migrations(self):
+        self.run_async(self.async_database_manager.provision_database())
+        self.migration_repository.create_new_table_migration("test_1")
+        self.migration_repository.create_new_table_migration("test_2")
+        migrations = self.run_async(self.async_database_manager.migrate())
+        self.assertEqual(len(migrations), 2)
+        self.assertEqual(len(self.database_manager.list_tables()), 3)
+        self.assertEqual(self.run_async(self.async_database_manager.current_database_migration_version()), 1)
+
+    def test_migrate_batch_rolls_back_on_failure(self):
+        self.run_async(self.async_database_manager.provision_database())
+        self.migration_repository.create_new_table_migration("test_1")
+        self.migration_repository.create_new_table_alteration_migration("test_1_invalid")
+        with open(self.migration_repository.repository_upgrade_path() + "/V01__alter_table_test_1_invalid.sql", "w") as script:
+            script.write("ALTER TABLE missing ADD COLUMN id INTEGER;")
+        self.assertRaises(Exception, self.run_async, self.async_database_manager.migrate(transaction_mode="batch"))
+        self.assertEqual(len(self.database_manager.list_tables()), 1)
+        self.assertIsNone(self.database_manager.current_database_migration_version())
+
+    def test_timeouts_do_not_carry_over_in_a_batch(self):
+        self.run_async(self.async_database_manager.provision_database())
+        self.migration_repository.create_new_table_migration("test_1")
+        with open(self.migration_repository.repository_upgrade_path() + "/V00__create_table_test_1.sql", "w") as script:
+            script.write("-- stickshift: lock_timeout=150ms, statement_timeout=10min\n"
+                         "CREATE TABLE test_1 AS SELECT current_setting('lock_timeout') AS lock_timeout, "
+                         "current_setting('statement_timeout') AS statement_timeout;")
+        self.migration_repository.create_new_table_migration("test_2")
+        with open(self.migration_repository.repository_upgrade_path() + "/V01__create_table_test_2.sql", "w") as script:
+            script.write("CREATE TABLE test_2 AS SELECT current_setting('lock_timeout') AS lock_timeout, "
+                         "current_setting('statement_timeout') AS statement_timeout;")
+        for transaction_mode in ["batch", "savepoint"]:
+            self.run_async(self.async_database_manager.migrate(transaction_mode=transaction_mode))
+            self.assertEqual(self.database_manager.execute_fetch("SELECT lock_timeout FROM test_1;"), ["150ms"])
+            self.assertEqual(self.database_manager.execute_fetch("SELECT statement_timeout FROM test_1;"), ["10min"])
+            self.assertEqual(self.database_manager.execute_fetch("SELECT lock_timeout FROM test_2;"), ["0"])
+            self.assertEqual(self.database_manager.execute_fetch("SELECT statement_timeout FROM test_2;"), ["0"])
+            self.run_async(self.async_database_manager.reset())
+
+    def test_migrate_applies_interrupted_migrations(self):
+        self.run_async(self.async_database_manager.provision_database())
+        self.migration_repository.create_new_table_migration("test_1")
+        with open(self.migration_repository.repository_upgrade_path() + "/V00__create_table_test_1.sql", "w") as script:
+            script.write("CREATE TABLE test_1 AS SELECT pg_sleep(0.3)::TEXT AS name; INSERT INTO missing VALUES (1);")
+        self.migration_repository.create_new_table_migration("test_2")
+        self.database_manager.output = lambda message: None
+        self.assertRaises(Exception, self.database_manager.migrate, workers=2)
+        self.assertEqual(self.database_manager.applied_versions(), [1])
+
+        with open(self.migration_repository.repository_upgrade_path() + "/V00__create_table_test_1.sql", "w") as script:
+            script.write("CREATE TABLE test_1 (name TEXT);")
+        migrations = self.run_async(self.async_database_manager.migrate(out_of_order="error"))
+        self.assertEqual(migrations, ["V00__create_table_test_1.sql"])
+        self.assertEqual(self.database_manager.applied_versions(), [0, 1])
+
+    def test_upgrade_and_downgrade(self):
+        self.run_async(self.async_database_manager.provision_database())
+        self.migration_repository.create_new_table_migration("test_1")
+        self.migration_repository.create_new_table_migration("test_2")
+        self.run_async(self.async_database_manager.upgrade())
+        self.assertEqual(len(self.database_manager.list_tables()), 2)
+        self.assertTrue(self.run_async(self.async_database_manager.downgrade()))
+        self.assertEqual(len(self.database_manager.list_tables()), 1)
+        self.assertFalse(self.run_async(self.async_database_manager.downgrade()))
+
+    def test_reset(self):
+        self.run_async(self.async_database_manager.provision_database())
+        self.migration_repository.create_new_table_migration("test_1")
+        self.migration_repository.create_new_table_migration("test_2")
+        self.run_async(self.async_database_manager.migrate())
+        self.run_async(self.async_database_manager.reset())
+        self.assertEqual(len(self.database_manager.list_tables()), 1)
+        self.assertIsNone(self.database_manager.current_database_migration_version())
+
+    def test_operations_record_the_fingerprint(self):
+        self.run_async(self.async_database_manager.provision_database())
+        self.migration_repository.create_new_table_migration("test_1")
+        self.migration_repository.create_new_table_migration("test_2")
+        self.database_manager.migrate()
+        self.assertEqual(self.database_manager.schema_status(), "up-to-date")
+        self.assertTrue(self.run_async(self.async_database_manager.downgrade()))
+        self.assertEqual(self.database_manager.schema_status(), "behind")
+        self.run_async(self.async_database_manager.migrate())
+        self.assertEqual(self.database_manager.schema_status(), "up-to-date")
+        self.run_async(self.async_database_manager.reset())
+        self.assertEqual(self.database_manager.schema_status(), "behind")
+        self.run_async(self.async_database_manager.migrate())
+        self.assertTrue(self.run_async(self.async_database_manager.deprovision_database()))
+        self.assertEqual(self.database_manager.list_tables(), ["test_1", "test_2"])
+        self.assertEqual(self.database_manager.execute_fetch(
+            "SELECT to_regclass('version_migration_fingerprint') IS NULL;"), [True])
+        self.assertEqual(self.database_manager.schema_status(), "behind")
+        self.database_manager.execute_create("DROP TABLE test_1; DROP TABLE test_2;")
+
+    def test_migrate_targets(self):
+        self.database_manager.provision_database()
+        self.migration_repository.create_new_table_migration("test_1")
+        results = self.run_async(migrate_targets(self.migration_repository, ["DATABASE", "MISSING"],
+                                                 output=lambda message: None))
+        self.assertEqual([result.status for result in results], ["migrated", "failed"])
+        self.assertEqual(self.database_manager.current_database_migration_version(), 0)
+
+    def test_migrate_waits_for_the_migrate_lock(self):
+        self.run_async(self.async_database_manager.provision_database())
+        self.migration_repository.create_new_table_migration("test_1")
+        self.async_database_manager.migrate_lock_wait = 0.2
+        self.database_manager.execute_create(QUERY_MIGRATE_LOCK)
+        self.assertRaises(MigrateLockTimeoutError, self.run_async, self.async_database_manager.migrate())
+        self.database_manager.execute_create(QUERY_MIGRATE_UNLOCK)
+        self.assertEqual(self.run_async(self.async_database_manager.migrate()), ["V00__create_table_test_1.sql"])
+        self.assertEqual(self.database_manager.execute_fetch(
+            "SELECT COUNT(*) FROM pg_locks WHERE locktype = 'advisory';"), [0])
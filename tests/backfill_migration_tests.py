@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from stickshift.backfill_migration import BackfillTarget, InvalidBackfillMigrationError, read_backfill_migration
+
+
+class BackfillMigrationTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "V00__backfill_users.backfill")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_migration(self, contents):
+        with open(self.path, "w") as migration_file:
+            migration_file.write(contents)
+
+    def test_read_backfill_migration(self):
+        self.write_migration("[users]\nkey: id\nbatch_size: 500\nsleep: 0.1\n"
+                             "sql: UPDATE users SET name = lower(name)\n"
+                             "     WHERE id BETWEEN %(start)s AND %(end)s AND name LIKE 'A%%'\n"
+                             "\n[orders]\nkey: order_id\nsql: UPDATE orders SET total = 0 "
+                             "WHERE order_id BETWEEN %(start)s AND %(end)s\n")
+        targets, checksum = read_backfill_migration(self.path)
+        self.assertEqual([(target.table, target.key, target.batch_size, target.max_batch_size, target.sleep)
+                          for target in targets], [("users", "id", 500, 5000, 0.1), ("orders", "order_id", 1000,
+                                                                                     10000, 0.0)])
+        self.assertEqual(targets[0].sql, "UPDATE users SET name = lower(name)\n"
+                                         "WHERE id BETWEEN %(start)s AND %(end)s AND name LIKE 'A%%'")
+        self.assertEqual(len(checksum), 64)
+
+    def test_read_invalid_backfill_migration(self):
+        self.write_migration("[users]\nkey: id\n")
+        self.assertRaises(InvalidBackfillMigrationError, read_backfill_migration, self.path)
+        self.write_migration("[users]\nkey: id\nsql: SELECT 1\nbatch_size: many\n")
+        self.assertRaises(InvalidBackfillMigrationError, read_backfill_migration, self.path)
+        self.write_migration("")
+        self.assertRaises(InvalidBackfillMigrationError, read_backfill_migration, self.path)
+
+    def test_next_batch_size_follows_latency(self):
+        target = BackfillTarget(table="users", key="id", sql="", batch_size=1000, target_seconds=0.5)
+        self.assertEqual(target.next_batch_size(1000, 0.25), 2000)
+        self.assertEqual(target.next_batch_size(1000, 0.0), 2000)
+        self.assertEqual(target.next_batch_size(1000, 0.625), 800)
+        self.assertEqual(target.next_batch_size(1000, 30.0), 500)
+        self.assertEqual(target.next_batch_size(8000, 0.1), 10000)
+        self.assertEqual(target.next_batch_size(1, 30.0), 1)
@@ -1,4 +1,6 @@
+import sys
 import unittest
+import subprocess
 
 from click.testing import CliRunner
 
@@ -65,6 +67,13 @@ class CLITests(unittest.TestCase):
         self.assertEqual(result.exit_code, 0)
         self.assertEqual(result.output.rstrip(), CLIStrings.DB_MIGRATION_REPOSITORY_MUST_BE_SETUP)
 
+    def test_cli_startup_does_not_import_database_modules(self):
+        script = "import sys; from stickshift.cli import cli\n" \
+                 "try:\n    cli.main(['--help'])\nexcept SystemExit:\n    pass\n" \
+                 "print('imported:' + ','.join(m for m in ['psycopg2', 'natsort', 'multiprocessing', 'gzip'] if m in sys.modules))"
+        output = subprocess.check_output([sys.executable, "-c", script])
+        self.assertEqual(output.decode("utf-8").strip().splitlines()[-1], "imported:")
+
 
 class CLIDatabaseTests(unittest.TestCase):
 
@@ -172,6 +181,21 @@ class CLIDatabaseTests(unittest.TestCase):
         self.assertEqual(result.exit_code, 0)
         self.assertEqual(self.database_manager.current_database_migration_version(), None)
 
+    def test_cli_migrate_to_and_downgrade_steps(self):
+        result = self.runner.invoke(cli, ["db", "provision", "DATABASE"])
+        self.assertEqual(result.exit_code, 0)
+
+        for name in ["test_1", "test_2", "test_3"]:
+            self.runner.invoke(cli, ["new", "table", name])
+        result = self.runner.invoke(cli, ["db", "migrate", "DATABASE", "--to", "1"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(self.database_manager.current_database_migration_version(), 1)
+
+        self.runner.invoke(cli, ["db", "migrate", "DATABASE"])
+        result = self.runner.invoke(cli, ["db", "downgrade", "DATABASE", "--steps", "2"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(self.database_manager.current_database_migration_version(), 0)
+
     def test_cli_migrate(self):
         result = self.runner.invoke(cli, ["db", "provision", "DATABASE"])
         self.assertEqual(result.exit_code, 0)
@@ -195,3 +219,80 @@ class CLIDatabaseTests(unittest.TestCase):
         result = self.runner.invoke(cli, ["db", "reset", "DATABASE"])
         self.assertEqual(result.exit_code, 0)
         self.assertEqual(self.database_manager.current_database_migration_version(), None)
+
+    def test_cli_migrate_environment_group(self):
+        result = self.runner.invoke(cli, ["db", "provision", "DATABASE"])
+        self.assertEqual(result.exit_code, 0)
+        with open(self.migration_repository.repository_database_config_path(), 'a') as config_file:
+            config_file.write("\n[SHARDS]\nmembers: DATABASE\n")
+
+        self.runner.invoke(cli, ["new", "table", "test"])
+        result = self.runner.invoke(cli, ["db", "migrate", "SHARDS"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("DATABASE: migrated (1 migrations", result.output)
+        self.assertEqual(self.database_manager.current_database_migration_version(), 0)
+
+    def test_cli_migrate_environment_group_fail_fast_after_canary(self):
+        result = self.runner.invoke(cli, ["db", "provision", "DATABASE"])
+        self.assertEqual(result.exit_code, 0)
+        with open(self.migration_repository.repository_database_config_path(), 'a') as config_file:
+            config_file.write("\n[SHARDS]\nmembers: MISSING, DATABASE\ncanary: MISSING\n")
+
+        self.runner.invoke(cli, ["new", "table", "test"])
+        result = self.runner.invoke(cli, ["db", "migrate", "SHARDS", "--continue-on-error"])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("MISSING: failed", result.output)
+        self.assertIn("DATABASE: skipped", result.output)
+        self.assertIsNone(self.database_manager.current_database_migration_version())
+
+    def test_cli_verify(self):
+        result = self.runner.invoke(cli, ["db", "provision", "DATABASE"])
+        self.assertEqual(result.exit_code, 0)
+
+        self.runner.invoke(cli, ["new", "table", "test"])
+        self.runner.invoke(cli, ["db", "migrate", "DATABASE"])
+
+        result = self.runner.invoke(cli, ["db", "verify", "DATABASE"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(result.output.rstrip(), "{0}: {1}".format(CLIStrings.DB_DATABASE_VERIFIED, 1))
+
+    def test_cli_fingerprint_and_status(self):
+        self.runner.invoke(cli, ["db", "provision", "DATABASE"])
+        self.runner.invoke(cli, ["new", "table", "test"])
+
+        result = self.runner.invoke(cli, ["fingerprint", "--check"])
+        self.assertEqual(result.exit_code, 1)
+        result = self.runner.invoke(cli, ["fingerprint"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertTrue(result.output.startswith("Saved fingerprint:"))
+        result = self.runner.invoke(cli, ["fingerprint", "--check"])
+        self.assertEqual(result.exit_code, 0)
+
+        result = self.runner.invoke(cli, ["db", "status", "DATABASE", "--no-daemon"])
+        self.assertEqual(result.exit_code, 1)
+        self.assertEqual(result.output.rstrip(), "{0}: behind".format(CLIStrings.DB_SCHEMA_STATUS))
+        self.runner.invoke(cli, ["db", "migrate", "DATABASE"])
+        result = self.runner.invoke(cli, ["db", "status", "DATABASE", "--no-daemon"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(result.output.rstrip(), "{0}: up-to-date".format(CLIStrings.DB_SCHEMA_STATUS))
+
+    def test_cli_schema_snapshot_and_diff(self):
+        result = self.runner.invoke(cli, ["db", "provision", "DATABASE"])
+        self.assertEqual(result.exit_code, 0)
+
+        result = self.runner.invoke(cli, ["schema", "snapshot", "DATABASE"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertTrue(result.output.startswith("Saved schema snapshot:db/snapshots/DATABASE.json (1 tables"))
+
+        result = self.runner.invoke(cli, ["schema", "diff", "DATABASE", "db/snapshots/DATABASE.json"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(result.output.rstrip(), CLIStrings.DB_SCHEMAS_MATCH)
+
+        self.runner.invoke(cli, ["new", "table", "test"])
+        self.runner.invoke(cli, ["db", "migrate", "DATABASE"])
+        result = self.runner.invoke(cli, ["schema", "diff", "db/snapshots/DATABASE.json", "DATABASE"])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("+ table test", result.output)
+
+        result = self.runner.invoke(cli, ["schema", "diff", "DATABASE", "DATABASE", "--cached"])
+        self.assertEqual(result.exit_code, 0)
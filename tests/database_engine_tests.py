@@ -0,0 +1,189 @@
+import shutil
+import tempfile
+import unittest
+
+from stickshift.migration_repository import MigrationRepository
+from stickshift.database_manager import DatabaseManager, InvalidMigrationRangeError, ChangedMigrationError
+from stickshift.migration_planner import OutOfOrderMigrationError, DuplicateMigrationVersionError
+from stickshift.database_engine import SQLiteConnection, UnsupportedEngineFeatureError, InvalidEngineError, \
+    engine_for
+
+SQLITE_CONFIG_FILE_CONTENTS = "[LOCAL]\nengine: sqlite\ndatabase:\n\n[UNKNOWN]\nengine: oracle\ndatabase: stickshift\n"
+
+
+class SQLiteEngineTests(unittest.TestCase):
+    """Runs the migration logic against an in-memory SQLite database, so no server is needed."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.migration_repository = MigrationRepository(directory=self.directory)
+        self.migration_repository.create_repository()
+        with open(self.migration_repository.repository_database_config_path(), "w") as config_file:
+            config_file.write(SQLITE_CONFIG_FILE_CONTENTS)
+        self.output = []
+        self.database_manager = DatabaseManager(migration_repository=self.migration_repository,
+                                                environment="LOCAL",
+                                                output=self.output.append)
+        self.database_manager.provision_database()
+
+    def tearDown(self):
+        self.database_manager.close()
+        shutil.rmtree(self.directory)
+
+    def create_migration(self, name, upgrade, downgrade="SELECT 1;", migration_index=None):
+        if migration_index is None:
+            migration_index = self.migration_repository.current_migration_count()
+        self.migration_repository.create_migration(name=name,
+                                                   directory=self.migration_repository.repository_upgrade_path(),
+                                                   contents=upgrade,
+                                                   migration_index=migration_index)
+        self.migration_repository.create_migration(name=name,
+                                                   directory=self.migration_repository.repository_downgrade_path(),
+                                                   contents=downgrade,
+                                                   migration_index=migration_index)
+
+    def create_table_migration(self, table):
+        self.create_migration("create_table_{0}".format(table),
+                              "CREATE TABLE {0} (id INTEGER);\nINSERT INTO {0} VALUES (1);".format(table),
+                              "DROP TABLE {0};".format(table))
+
+    def test_database_config_reads_engine_fields(self):
+        self.assertEqual(self.migration_repository.database_config("LOCAL"), {"engine": "sqlite", "database": ""})
+        self.assertRaises(InvalidEngineError, self.migration_repository.database_config, "UNKNOWN")
+
+    def test_provision_database(self):
+        self.assertTrue(self.database_manager.is_database_provisioned())
+        self.assertFalse(self.database_manager.provision_database())
+        self.assertEqual(self.database_manager.list_tables(), ["version_migration"])
+        self.assertEqual(self.database_manager.list_procedures(), [])
+        self.database_manager.deprovision_database()
+        self.assertFalse(self.database_manager.is_database_provisioned())
+
+    def test_migrate_in_every_transaction_mode(self):
+        for transaction_mode in ["none", "batch", "savepoint"]:
+            self.create_table_migration("test_{0}".format(transaction_mode))
+            self.database_manager.migrate(transaction_mode=transaction_mode)
+        self.assertEqual(sorted(self.database_manager.list_tables()),
+                         ["test_batch", "test_none", "test_savepoint", "version_migration"])
+        self.assertEqual(self.database_manager.current_database_migration_version(), 2)
+        self.assertEqual([status for version, file_name, status in self.database_manager.verify_migrations()],
+                         ["ok", "ok", "ok"])
+
+    def test_failed_migration_is_rolled_back(self):
+        self.create_table_migration("test_1")
+        self.create_migration("insert_missing", "INSERT INTO test_1 VALUES (2);\nINSERT INTO missing VALUES (1);")
+        self.assertRaises(Exception, self.database_manager.migrate)
+        self.assertEqual(self.database_manager.current_database_migration_version(), 0)
+        self.assertRaises(Exception, self.database_manager.migrate, transaction_mode="batch")
+        with self.database_manager.connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM test_1;")
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_migrate_batch_rolls_back_on_failure(self):
+        self.create_table_migration("test_1")
+        self.create_migration("insert_missing", "INSERT INTO missing VALUES (1);")
+        self.assertRaises(Exception, self.database_manager.migrate, transaction_mode="batch")
+        self.assertEqual(self.database_manager.list_tables(), ["version_migration"])
+        self.assertRaises(Exception, self.database_manager.migrate, transaction_mode="savepoint")
+        self.assertEqual(self.database_manager.current_database_migration_version(), 0)
+
+    def test_reset_and_history(self):
+        self.create_table_migration("test_1")
+        self.create_table_migration("test_2")
+        self.database_manager.migrate(transaction_mode="batch")
+        history = self.database_manager.migration_history()
+        self.assertEqual([entry.version for entry in history], [0, 1])
+        self.assertIsNotNone(history[0].duration)
+        self.assertIsNone(history[0].server_duration)
+        self.database_manager.reset()
+        self.assertIsNone(self.database_manager.current_database_migration_version())
+        self.assertEqual(self.database_manager.list_tables(), ["version_migration"])
+
+    def test_postgres_only_features_are_refused(self):
+        self.assertRaises(UnsupportedEngineFeatureError, self.database_manager.dump_baseline, 0)
+        self.assertRaises(UnsupportedEngineFeatureError, self.database_manager.migrate, workers=2)
+        self.assertRaises(UnsupportedEngineFeatureError, self.database_manager.schema_snapshot)
+        self.assertEqual(engine_for(None).name, "postgres")
+
+    def test_schema_status(self):
+        self.assertEqual(self.database_manager.schema_status(), "behind")
+        self.create_table_migration("test_1")
+        self.database_manager.migrate()
+        self.assertEqual(self.database_manager.schema_status(), "up-to-date")
+        self.assertEqual(sorted(self.database_manager.list_tables()), ["test_1", "version_migration"])
+        self.database_manager.reset()
+        self.assertEqual(self.database_manager.schema_status(), "behind")
+
+    def test_connection_begins_transactions_like_psycopg2(self):
+        connection = SQLiteConnection(":memory:")
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE TABLE test_1 (id INTEGER);")
+            connection.autocommit = False
+            cursor.execute("INSERT INTO test_1 VALUES (%s);", (1,))
+            connection.rollback()
+            connection.autocommit = True
+            cursor.execute("SELECT COUNT(*) FROM test_1;")
+            self.assertEqual(cursor.fetchone()[0], 0)
+        connection.close()
+        self.assertTrue(connection.closed)
+
+    def test_out_of_order_migrations(self):
+        self.create_table_migration("test_0")
+        self.create_migration("create_table_test_2", "CREATE TABLE test_2 (id INTEGER);", migration_index=2)
+        self.database_manager.migrate()
+        self.create_migration("create_table_test_1", "CREATE TABLE test_1 (id INTEGER);", "DROP TABLE test_1;",
+                              migration_index=1)
+        self.assertEqual(self.database_manager.migrate(), [])
+        self.assertIn("Migration is older than the applied version 2: V01__create_table_test_1.sql, skipped",
+                      self.output)
+        self.assertRaises(OutOfOrderMigrationError, self.database_manager.migrate, out_of_order="error")
+        self.assertEqual(self.database_manager.migrate(out_of_order="apply"), ["V01__create_table_test_1.sql"])
+        self.assertEqual(self.database_manager.applied_versions(), [0, 1, 2])
+        self.assertEqual(self.database_manager.applied_downgrades(),
+                         ["V02__create_table_test_2.sql", "V01__create_table_test_1.sql",
+                          "V00__create_table_test_0.sql"])
+
+    def test_migrations_sharing_a_version_are_refused(self):
+        self.create_table_migration("test_0")
+        self.create_migration("create_table_test_a", "CREATE TABLE test_a (id INTEGER);", migration_index=1)
+        self.database_manager.migrate()
+        self.create_migration("create_table_test_b", "CREATE TABLE test_b (id INTEGER);", migration_index=1)
+        self.assertRaises(DuplicateMigrationVersionError, self.database_manager.migrate, transaction_mode="none")
+        self.assertEqual(sorted(self.database_manager.list_tables()), ["test_0", "test_a", "version_migration"])
+        self.assertEqual(self.database_manager.applied_versions(), [0, 1])
+
+    def test_downgrade_steps_and_to(self):
+        for table in ["test_0", "test_1", "test_2", "test_3"]:
+            self.create_table_migration(table)
+        self.database_manager.migrate(to=2)
+        self.assertEqual(self.database_manager.current_database_migration_version(), 2)
+        self.database_manager.migrate()
+        self.assertTrue(self.database_manager.downgrade(steps=2))
+        self.assertEqual(self.database_manager.applied_versions(), [0, 1])
+        self.assertTrue(self.database_manager.downgrade(to=0))
+        self.assertFalse(self.database_manager.downgrade(to=0))
+        self.assertEqual(sorted(self.database_manager.list_tables()), ["test_0", "version_migration"])
+        self.assertRaises(InvalidMigrationRangeError, self.database_manager.downgrade, steps=1, to=0)
+        self.assertRaises(InvalidMigrationRangeError, self.database_manager.downgrade, steps=0)
+
+    def test_downgrade_steps_are_atomic(self):
+        self.create_table_migration("test_0")
+        self.create_migration("create_table_test_1", "CREATE TABLE test_1 (id INTEGER);", "DROP TABLE missing;")
+        self.create_table_migration("test_2")
+        self.database_manager.migrate()
+        self.assertRaises(Exception, self.database_manager.downgrade, steps=3)
+        self.assertEqual(self.database_manager.applied_versions(), [0, 1, 2])
+        self.assertEqual(len(self.database_manager.list_tables()), 4)
+
+    def test_resume_refuses_changed_migration(self):
+        self.create_migration("create_table_test_1", "-- stickshift: no-transaction\n"
+                                                     "CREATE TABLE IF NOT EXISTS test_1 (id INTEGER);\n"
+                                                     "INSERT INTO missing VALUES (1);")
+        self.assertRaises(Exception, self.database_manager.migrate)
+        with open(self.database_manager.upgrade_script_path("V00__create_table_test_1.sql"), "a") as script:
+            script.write("\nINSERT INTO test_1 VALUES (1);")
+        self.assertRaises(ChangedMigrationError, self.database_manager.migrate, resume=True)
+        self.database_manager.execute_create("CREATE TABLE missing (id INTEGER);")
+        self.database_manager.migrate()
+        self.assertEqual(self.database_manager.applied_versions(), [0])
+        self.assertFalse(self.database_manager.resume)
@@ -1,7 +1,13 @@
+import gzip
+import shutil
 import unittest
+import threading
 
 from stickshift.migration_repository import MigrationRepository
-from stickshift.database_manager import DatabaseManager
+from stickshift.database_manager import DatabaseManager, MigrateLockTimeoutError, connect_database, \
+    QUERY_MIGRATE_LOCK
+from stickshift.schema_catalog import diff_snapshots
+from stickshift.schema_gate import SCHEMA_UP_TO_DATE, SCHEMA_BEHIND, SCHEMA_AHEAD, LOCAL_FINGERPRINTS, schema_status
 
 
 class DatabaseManagerTests(unittest.TestCase):
@@ -18,6 +24,7 @@ class DatabaseManagerTests(unittest.TestCase):
             self.database_manager.reset()
             self.database_manager.deprovision_database()
         self.migration_repository.clear()
+        LOCAL_FINGERPRINTS.clear()
 
     # Database Provisioning Tests
 
@@ -40,6 +47,12 @@ class DatabaseManagerTests(unittest.TestCase):
         self.database_manager.deprovision_database()
         self.assertFalse(self.database_manager.is_database_provisioned())
 
+    def test_provision_database_adds_primary_key_to_version_table(self):
+        self.database_manager.execute_create("CREATE TABLE version_migration (version INTEGER, migrated_at INTEGER);")
+        self.assertFalse(self.database_manager.provision_database())
+        self.assertEqual(self.database_manager.execute_fetch(
+            "SELECT contype FROM pg_constraint WHERE conrelid = 'version_migration'::regclass;"), ["p"])
+
     # Database Versioning Tests
 
     def test_current_database_migration_version(self):
@@ -114,8 +127,524 @@ class DatabaseManagerTests(unittest.TestCase):
         self.database_manager.upgrade()
         self.assertEqual(len(self.database_manager.list_tables()), 3)
 
+    def test_migrate_batch_records_all_versions(self):
+        self.database_manager.provision_database()
+        self.migration_repository.create_new_table_migration("test_1")
+        self.migration_repository.create_new_table_migration("test_2")
+        self.database_manager.migrate(transaction_mode="batch")
+        self.assertEqual(len(self.database_manager.list_tables()), 3)
+        self.assertEqual(self.database_manager.current_database_migration_version(), 1)
+
+    def test_migrate_batch_rolls_back_on_failure(self):
+        self.database_manager.provision_database()
+        self.migration_repository.create_new_table_migration("test_1")
+        self.migration_repository.create_new_table_alteration_migration("test_1_invalid")
+        with open(self.migration_repository.repository_upgrade_path() + "/V01__alter_table_test_1_invalid.sql", "w") as script:
+            script.write("ALTER TABLE missing ADD COLUMN id INTEGER;")
+        self.assertRaises(Exception, self.database_manager.migrate, transaction_mode="batch")
+        self.assertEqual(len(self.database_manager.list_tables()), 1)
+        self.assertIsNone(self.database_manager.current_database_migration_version())
+
+    def test_migrate_savepoint_commits_migrations_before_failure(self):
+        self.database_manager.provision_database()
+        self.migration_repository.create_new_table_migration("test_1")
+        self.migration_repository.create_new_table_alteration_migration("test_1_invalid")
+        with open(self.migration_repository.repository_upgrade_path() + "/V01__alter_table_test_1_invalid.sql", "w") as script:
+            script.write("ALTER TABLE missing ADD COLUMN id INTEGER;")
+        self.assertRaises(Exception, self.database_manager.migrate, transaction_mode="savepoint")
+        self.assertEqual(len(self.database_manager.list_tables()), 2)
+        self.assertEqual(self.database_manager.current_database_migration_version(), 0)
+
+    def test_migrate_streams_large_scripts(self):
+        self.database_manager.provision_database()
+        self.database_manager.streaming_threshold = 0
+        self.migration_repository.create_new_procedure_migration("test")
+        with open(self.migration_repository.repository_upgrade_path() + "/V00__create_sp_test.sql", "w") as script:
+            script.write("CREATE TABLE test_1 (name TEXT);\n"
+                         "INSERT INTO test_1 VALUES ('a;b');\n"
+                         "CREATE FUNCTION sp_test() RETURNS INTEGER AS $$ BEGIN RETURN 1; END; $$ LANGUAGE plpgsql;\n")
+        with open(self.migration_repository.repository_downgrade_path() + "/V00__drop_sp_test.sql", "w") as script:
+            script.write("DROP TABLE test_1; DROP FUNCTION sp_test();")
+        self.database_manager.migrate()
+        self.assertEqual(self.database_manager.list_procedures(), ["sp_test"])
+        self.assertEqual(self.database_manager.current_database_migration_version(), 0)
+        self.assertEqual([status for version, file_name, status in self.database_manager.verify_migrations()], ["ok"])
+
+    def test_migrate_streamed_script_is_atomic(self):
+        self.database_manager.provision_database()
+        self.database_manager.streaming_threshold = 0
+        self.migration_repository.create_new_table_migration("test_1")
+        with open(self.migration_repository.repository_upgrade_path() + "/V00__create_table_test_1.sql", "a") as script:
+            script.write(";\nALTER TABLE missing ADD COLUMN id INTEGER;")
+        self.assertRaises(Exception, self.database_manager.migrate)
+        self.assertEqual(len(self.database_manager.list_tables()), 1)
+        self.assertIsNone(self.database_manager.current_database_migration_version())
+
+    def test_migrate_copy_migration(self):
+        self.database_manager.provision_database()
+        self.migration_repository.create_new_table_migration("test_1")
+        with open(self.migration_repository.repository_upgrade_path() + "/V00__create_table_test_1.sql", "w") as script:
+            script.write("CREATE TABLE test_1 (id INTEGER, name TEXT); CREATE TABLE test_2 (id INTEGER);")
+        with open(self.migration_repository.repository_downgrade_path() + "/V00__drop_table_test_1.sql", "w") as script:
+            script.write("DROP TABLE test_1; DROP TABLE test_2;")
+        self.migration_repository.create_new_data_migration("test_1")
+        with open(self.migration_repository.repository_upgrade_path() + "/V01__load_test_1.copy", "a") as script:
+            script.write("\n[test_2]\nfile: test_2.tsv.gz\nformat: text\n")
+        with open(self.migration_repository.repository_data_path() + "/test_1.csv", "w") as data_file:
+            data_file.write("id,name\n1,\"a,b\"\n2,c\n")
+        with gzip.open(self.migration_repository.repository_data_path() + "/test_2.tsv.gz", "wb") as data_file:
+            data_file.write(b"1\n2\n3\n")
+
+        self.database_manager.migrate()
+        self.assertEqual(self.database_manager.current_database_migration_version(), 1)
+        self.assertEqual(self.database_manager.execute_fetch("SELECT name FROM test_1 ORDER BY id;"), ["a,b", "c"])
+        self.assertEqual(self.database_manager.execute_fetch("SELECT COUNT(*) FROM test_2;"), [3])
+
+        self.database_manager.downgrade()
+        self.assertEqual(self.database_manager.execute_fetch("SELECT COUNT(*) FROM test_1;"), [0])
+
+    def test_migrate_backfill_migration_resumes_after_failure(self):
+        self.database_manager.provision_database()
+        self.migration_repository.create_new_table_migration("test_1")
+        with open(self.migration_repository.repository_upgrade_path() + "/V00__create_table_test_1.sql", "w") as script:
+            script.write("CREATE TABLE test_1 AS SELECT id, NULL::TEXT AS name FROM generate_series(1, 25) id;")
+        self.migration_repository.create_new_backfill_migration("test_1")
+        backfill_path = self.migration_repository.repository_upgrade_path() + "/V01__backfill_test_1.backfill"
+        with open(backfill_path, "w") as script:
+            script.write("[test_1]\nkey: id\nbatch_size: 10\nmax_batch_size: 10\n"
+                         "sql: UPDATE test_1 SET name = (10 / (20 - id))::TEXT WHERE id BETWEEN %(start)s AND %(end)s\n")
+        output = []
+        self.database_manager.output = output.append
+        self.assertRaises(Exception, self.database_manager.migrate)
+        self.assertEqual(self.database_manager.current_database_migration_version(), 0)
+        self.assertEqual(self.database_manager.execute_fetch("SELECT COUNT(name) FROM test_1;"), [10])
+
+        with open(backfill_path, "w") as script:
+            script.write("[test_1]\nkey: id\nbatch_size: 10\nmax_batch_size: 10\n"
+                         "sql: UPDATE test_1 SET name = id::TEXT WHERE id BETWEEN %(start)s AND %(end)s\n")
+        self.database_manager.migrate()
+        self.assertEqual(output[-3:], ["Migration:V01__backfill_test_1.backfill resuming test_1 after id 10",
+                                       "Migration:V01__backfill_test_1.backfill backfilled 25 rows of test_1 in 2 "
+                                       "batches",
+                                       "Migration:V01__backfill_test_1.backfill completed"])
+        self.assertEqual(self.database_manager.execute_fetch("SELECT COUNT(name) FROM test_1;"), [25])
+        self.assertEqual(self.database_manager.current_database_migration_version(), 1)
+        self.assertEqual(self.database_manager.execute_fetch("SELECT COUNT(*) FROM version_migration_backfill;"), [0])
+
+    def test_schema_snapshot(self):
+        self.database_manager.provision_database()
+        self.migration_repository.create_new_table_migration("test_1")
+        with open(self.migration_repository.repository_upgrade_path() + "/V00__create_table_test_1.sql", "w") as script:
+            script.write("CREATE TABLE test_1 (id INTEGER NOT NULL, name TEXT DEFAULT 'a');\n"
+                         "CREATE INDEX test_1_name_idx ON test_1 (name);\n"
+                         "CREATE FUNCTION test_1_count() RETURNS BIGINT AS 'SELECT COUNT(*) FROM test_1' LANGUAGE SQL;")
+        with open(self.migration_repository.repository_downgrade_path() + "/V00__drop_table_test_1.sql", "w") as script:
+            script.write("DROP FUNCTION test_1_count(); DROP TABLE test_1;")
+        self.database_manager.migrate()
+        snapshot = self.database_manager.schema_snapshot()
+        self.assertEqual(snapshot.version, 0)
+        self.assertEqual(sorted(snapshot.tables), ["test_1", "version_migration"])
+        self.assertEqual(snapshot.tables["test_1"]["columns"], {"id": "integer NOT NULL",
+                                                                "name": "text DEFAULT 'a'::text"})
+        self.assertEqual(snapshot.indexes["test_1_name_idx"]["table"], "test_1")
+        self.assertEqual(list(snapshot.functions), ["test_1_count()"])
+        self.assertEqual(self.database_manager.list_procedures(), ["test_1_count"])
+        self.assertTrue(self.database_manager.connection.autocommit)
+
+        self.database_manager.execute_create("ALTER TABLE test_1 ALTER COLUMN id TYPE BIGINT;")
+        self.assertEqual(diff_snapshots(snapshot, self.database_manager.schema_snapshot()),
+                         ["~ column test_1.id: integer NOT NULL -> bigint NOT NULL"])
+
+    def test_schema_status(self):
+        self.database_manager.provision_database()
+        self.assertEqual(self.database_manager.schema_status(), SCHEMA_BEHIND)
+        self.migration_repository.create_new_table_migration("test_1")
+        self.migration_repository.create_new_table_migration("test_2")
+        self.database_manager.migrate()
+        self.assertEqual(self.database_manager.schema_status(), SCHEMA_UP_TO_DATE)
+        self.assertEqual(self.database_manager.execute_fetch("SELECT version FROM version_migration_fingerprint;"),
+                         [1])
+        self.assertEqual(schema_status(environment="DATABASE"), SCHEMA_UP_TO_DATE)
+
+        self.migration_repository.create_new_table_migration("test_3")
+        self.assertEqual(self.database_manager.schema_status(), SCHEMA_BEHIND)
+        self.database_manager.upgrade()
+        self.assertEqual(self.database_manager.schema_status(), SCHEMA_UP_TO_DATE)
+        # An operation under the migrate lock that applies nothing leaves the recorded fingerprint alone.
+        self.database_manager.execute_create("UPDATE version_migration_fingerprint SET fingerprint = 'other';")
+        self.database_manager.with_migrate_lock(lambda: None)
+        self.assertEqual(self.database_manager.schema_status(), SCHEMA_BEHIND)
+        self.database_manager.migrate()
+        self.assertEqual(self.database_manager.schema_status(), SCHEMA_UP_TO_DATE)
+
+        # An older release whose saved fingerprint lacks the newest migration.
+        saved = self.migration_repository.save_fingerprint()
+        self.database_manager.downgrade(steps=1)
+        self.assertEqual(self.database_manager.schema_status(), SCHEMA_BEHIND)
+        self.database_manager.migrate()
+        with open(self.migration_repository.repository_fingerprint_path(), "w") as fingerprint_file:
+            fingerprint_file.write('{"fingerprint": "older", "version": 1}')
+        self.assertEqual(self.database_manager.schema_status(), SCHEMA_AHEAD)
+        self.assertEqual(saved[1], 2)
+
+        # A version table dropped or changed behind its back leaves the recorded fingerprint unused.
+        self.database_manager.execute_create("DELETE FROM version_migration WHERE version = 2;")
+        self.assertEqual(self.database_manager.schema_status(), SCHEMA_BEHIND)
+        self.database_manager.execute_create("DROP TABLE version_migration;")
+        self.assertEqual(self.database_manager.schema_status(), SCHEMA_BEHIND)
+        self.database_manager.execute_create("DROP TABLE test_1; DROP TABLE test_2; DROP TABLE test_3; "
+                                             "DROP TABLE version_migration_fingerprint;")
+
+    def lock_table_test_1(self):
+        self.database_manager.provision_database()
+        self.migration_repository.create_new_table_migration("test_1")
+        self.database_manager.upgrade()
+        self.migration_repository.create_new_table_alteration_migration("test_1_name")
+        with open(self.migration_repository.repository_upgrade_path() + "/V01__alter_table_test_1_name.sql", "w") as script:
+            script.write("-- stickshift: lock_timeout=50ms\nALTER TABLE test_1 ADD COLUMN name TEXT;")
+        with open(self.migration_repository.repository_downgrade_path() + "/V01__undo_alter_table_test_1_name.sql", "w") as script:
+            script.write("ALTER TABLE test_1 DROP COLUMN name;")
+        locker = connect_database(self.database_manager.database_config)
+        with locker.cursor() as cursor:
+            cursor.execute("LOCK TABLE test_1 IN ACCESS SHARE MODE;")
+        return locker
+
+    def test_migrate_gives_up_when_lock_is_not_available(self):
+        locker = self.lock_table_test_1()
+        output = []
+        self.database_manager.output = output.append
+        self.database_manager.lock_retry_budget = 0.3
+        try:
+            self.assertRaises(Exception, self.database_manager.migrate)
+        finally:
+            locker.close()
+        self.assertTrue(any("lock not available" in line for line in output))
+        self.assertEqual(self.database_manager.current_database_migration_version(), 0)
+        self.assertEqual(self.database_manager.execute_fetch("SHOW lock_timeout;"), ["0"])
+
+    def test_migrate_retries_until_lock_is_available(self):
+        locker = self.lock_table_test_1()
+        self.database_manager.output = lambda message: None
+        release = threading.Timer(0.3, locker.close)
+        release.start()
+        self.database_manager.migrate(transaction_mode="batch")
+        release.join()
+        self.assertEqual(self.database_manager.current_database_migration_version(), 1)
+
+    def test_migrate_non_transactional_migration(self):
+        self.database_manager.provision_database()
+        self.migration_repository.create_new_table_migration("test_1")
+        with open(self.migration_repository.repository_upgrade_path() + "/V00__create_table_test_1.sql", "w") as script:
+            script.write("CREATE TABLE test_1 (name TEXT);")
+        self.migration_repository.create_new_index_migration("test_1", ["name"])
+        self.migration_repository.create_new_table_migration("test_2")
+        self.database_manager.migrate(transaction_mode="batch")
+        self.assertEqual(self.database_manager.current_database_migration_version(), 2)
+        self.assertEqual(self.database_manager.execute_fetch(
+            "SELECT indexrelid::regclass::text FROM pg_index WHERE indrelid = 'test_1'::regclass AND indisvalid;"),
+            ["test_1_name_idx"])
+
+        self.database_manager.reset()
+        self.assertEqual(len(self.database_manager.list_tables()), 1)
+
+    def test_migrate_non_transactional_migration_drops_invalid_index(self):
+        self.database_manager.provision_database()
+        self.migration_repository.create_new_table_migration("test_1")
+        with open(self.migration_repository.repository_upgrade_path() + "/V00__create_table_test_1.sql", "w") as script:
+            script.write("CREATE TABLE test_1 (name TEXT); INSERT INTO test_1 VALUES ('a'), ('a');")
+        self.migration_repository.create_new_index_migration("test_1", ["name"])
+        with open(self.migration_repository.repository_upgrade_path() + "/V01__create_index_test_1_name_idx.sql", "w") as script:
+            script.write("-- stickshift: no-transaction\nCREATE UNIQUE INDEX CONCURRENTLY test_1_name_idx ON test_1 (name);")
+        output = []
+        self.database_manager.output = output.append
+        self.assertRaises(Exception, self.database_manager.migrate)
+        self.assertIn("Migration:V01__create_index_test_1_name_idx.sql dropped invalid index public.test_1_name_idx",
+                      output)
+        self.assertEqual(self.database_manager.execute_fetch(
+            "SELECT COUNT(*) FROM pg_index WHERE indrelid = 'test_1'::regclass;"), [0])
+        self.assertEqual(self.database_manager.current_database_migration_version(), 0)
+
+    def test_migrate_resumes_non_transactional_migration_after_failure(self):
+        self.database_manager.provision_database()
+        self.migration_repository.create_new_table_migration("test_1")
+        with open(self.migration_repository.repository_upgrade_path() + "/V00__create_table_test_1.sql", "w") as script:
+            script.write("-- stickshift: no-transaction\nCREATE TABLE test_1 (id INTEGER);\n"
+                         "INSERT INTO test_1 VALUES (1);\nINSERT INTO test_2 SELECT * FROM test_1;\n"
+                         "INSERT INTO test_1 VALUES (2);")
+        output = []
+        self.database_manager.output = output.append
+        self.assertRaises(Exception, self.database_manager.migrate)
+        self.assertIn("Migration:V00__create_table_test_1.sql continues from statement 3 with migrate --resume",
+                      output)
+        self.assertEqual(self.database_manager.current_database_migration_version(), None)
+
+        self.database_manager.execute_create("CREATE TABLE test_2 (id INTEGER);")
+        self.database_manager.migrate(resume=True)
+        self.assertIn("Migration:V00__create_table_test_1.sql resuming after statement 2", output)
+        self.assertEqual(self.database_manager.execute_fetch("SELECT COUNT(*) FROM test_1;"), [2])
+        self.assertEqual(self.database_manager.execute_fetch("SELECT COUNT(*) FROM test_2;"), [1])
+        self.assertEqual(self.database_manager.current_database_migration_version(), 0)
+        self.assertEqual(self.database_manager.execute_fetch(
+            "SELECT COUNT(*) FROM version_migration_checkpoint;"), [0])
+        self.database_manager.execute_create("DROP TABLE test_2;")
+
+    def test_migrate_waits_for_the_migrate_lock(self):
+        self.database_manager.provision_database()
+        self.migration_repository.create_new_table_migration("test_1")
+        output = []
+        self.database_manager.output = output.append
+        self.database_manager.migrate_lock_wait = 0.2
+        locker = connect_database(self.database_manager.database_config)
+        locker.autocommit = True
+        with locker.cursor() as cursor:
+            cursor.execute(QUERY_MIGRATE_LOCK)
+        try:
+            self.assertRaises(MigrateLockTimeoutError, self.database_manager.migrate)
+            self.assertEqual(output, ["Database:DATABASE is being migrated by another process, "
+                                      "waiting for it to finish"])
+            self.assertEqual(self.database_manager.execute_fetch("SHOW lock_timeout;"), ["0"])
+
+            self.database_manager.migrate_lock_wait = 5
+            release = threading.Timer(0.3, locker.close)
+            release.start()
+            self.assertEqual(self.database_manager.migrate(), ["V00__create_table_test_1.sql"])
+            release.join()
+        finally:
+            locker.close()
+        self.assertEqual(self.database_manager.execute_fetch(
+            "SELECT COUNT(*) FROM pg_locks WHERE locktype = 'advisory';"), [0])
+
+    def test_concurrent_migrates_apply_once(self):
+        self.database_manager.provision_database()
+        self.migration_repository.create_new_table_migration("test_0")
+        self.database_manager.migrate()
+        self.migration_repository.create_new_table_migration("test_1")
+        with open(self.migration_repository.repository_upgrade_path() + "/V01__create_table_test_1.sql", "w") as script:
+            script.write("CREATE TABLE test_1 AS SELECT pg_sleep(0.3)::TEXT AS name;")
+        managers = [DatabaseManager(migration_repository=self.migration_repository, environment="DATABASE",
+                                    output=lambda message: None) for idx in range(4)]
+        results = []
+
+        def migrate(database_manager):
+            results.append(database_manager.migrate())
+
+        threads = [threading.Thread(target=migrate, args=(database_manager,)) for database_manager in managers]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            for database_manager in managers:
+                database_manager.close()
+        self.assertEqual(sorted(results), [[], [], [], ["V01__create_table_test_1.sql"]])
+        self.assertEqual(self.database_manager.applied_versions(), [0, 1])
+
+        # Once up to date, a migrate returns without waiting for the lock.
+        locker = connect_database(self.database_manager.database_config)
+        locker.autocommit = True
+        try:
+            with locker.cursor() as cursor:
+                cursor.execute(QUERY_MIGRATE_LOCK)
+            self.database_manager.migrate_lock_wait = 0.1
+            self.assertEqual(self.database_manager.migrate(), [])
+        finally:
+            locker.close()
+
+    def test_migrate_with_workers_overlaps_independent_migrations(self):
+        self.database_manager.provision_database()
+        self.migration_repository.create_new_table_migration("test_1")
+        with open(self.migration_repository.repository_upgrade_path() + "/V00__create_table_test_1.sql", "w") as script:
+            script.write("CREATE TABLE test_1 AS SELECT pg_sleep(0.3)::TEXT AS name;")
+        self.migration_repository.create_new_table_migration("test_2")
+        self.migration_repository.create_new_index_migration("test_1", ["name"])
+        self.migration_repository.create_new_table_migration("test_3")
+        events = []
+        self.database_manager.add_listener(events.append)
+        self.database_manager.output = lambda message: None
+        self.assertEqual(self.database_manager.migrate(workers=3), self.migration_repository.current_migrations_list())
+        # The index waits for its table, while the other tables are created as it is being filled.
+        events = [(event.event, event.version) for event in events]
+        self.assertEqual(sorted(events[:3]), [("begin", 0), ("begin", 1), ("begin", 3)])
+        self.assertGreater(events.index(("begin", 2)), events.index(("end", 0)))
+        self.assertLess(events.index(("end", 1)), events.index(("end", 0)))
+        self.assertEqual(self.database_manager.applied_versions(), [0, 1, 2, 3])
+        self.assertEqual([status for version, file_name, status in self.database_manager.verify_migrations()],
+                         ["ok", "ok", "ok", "ok"])
+
+    def test_migrate_with_workers_commits_migrations_as_they_finish(self):
+        self.database_manager.provision_database()
+        self.database_manager.execute_create("CREATE TABLE hot_b (id INTEGER);")
+        self.migration_repository.create_new_table_migration("test_1")
+        with open(self.migration_repository.repository_upgrade_path() + "/V00__create_table_test_1.sql", "w") as script:
+            script.write("-- stickshift: no-transaction\nCREATE TABLE test_1 AS SELECT pg_sleep(0.5)::TEXT AS name;")
+        self.migration_repository.create_new_table_alteration_migration("hot_b")
+        with open(self.migration_repository.repository_upgrade_path() + "/V01__alter_table_hot_b.sql", "w") as script:
+            script.write("ALTER TABLE hot_b ADD COLUMN name TEXT;")
+        reader = connect_database(self.database_manager.database_config)
+        reader.autocommit = True
+        seen = []
+
+        def listener(event):
+            if event.event == "end" and event.direction == "upgrade" and event.version == 1:
+                # The older migration is still running, yet the table is free and the version recorded.
+                with reader.cursor() as cursor:
+                    cursor.execute("SET lock_timeout = '100ms'; SELECT COUNT(*) FROM hot_b;")
+                    seen.append(cursor.fetchone()[0])
+                    cursor.execute("SELECT version FROM version_migration;")
+                    seen.append(cursor.fetchall())
+
+        self.database_manager.add_listener(listener)
+        self.database_manager.output = lambda message: None
+        try:
+            self.database_manager.migrate(workers=2)
+        finally:
+            reader.close()
+        self.assertEqual(seen, [0, [(1,)]])
+        self.assertEqual(self.database_manager.applied_versions(), [0, 1])
+        self.assertEqual(self.database_manager.interrupted_versions(), [])
+        self.database_manager.execute_create("DROP TABLE hot_b;")
+
+    def test_migrate_with_workers_keeps_interrupted_migrations_pending(self):
+        self.database_manager.provision_database()
+        self.migration_repository.create_new_table_migration("test_1")
+        with open(self.migration_repository.repository_upgrade_path() + "/V00__create_table_test_1.sql", "w") as script:
+            script.write("CREATE TABLE test_1 AS SELECT pg_sleep(0.3)::TEXT AS name; INSERT INTO missing VALUES (1);")
+        self.migration_repository.create_new_table_migration("test_2")
+        self.database_manager.output = lambda message: None
+        self.assertRaises(Exception, self.database_manager.migrate, workers=2)
+        self.assertEqual(self.database_manager.applied_versions(), [1])
+        self.assertEqual(self.database_manager.interrupted_versions(), [0])
+        self.assertEqual(sorted(self.database_manager.list_tables()), ["test_2", "version_migration"])
+        self.assertRaises(Exception, self.database_manager.migrate, transaction_mode="batch", workers=2)
+
+        with open(self.migration_repository.repository_upgrade_path() + "/V00__create_table_test_1.sql", "w") as script:
+            script.write("CREATE TABLE test_1 (name TEXT);")
+        self.assertEqual(self.database_manager.migrate(out_of_order="error"), ["V00__create_table_test_1.sql"])
+        self.assertEqual(self.database_manager.applied_versions(), [0, 1])
+
+    @unittest.skipUnless(shutil.which("pg_dump"), "pg_dump is not installed")
+    def test_migrate_applies_baseline_to_new_database(self):
+        self.database_manager.provision_database()
+        self.migration_repository.create_new_table_migration("test_1")
+        with open(self.migration_repository.repository_upgrade_path() + "/V00__create_table_test_1.sql", "w") as script:
+            script.write("CREATE TABLE test_1 (name TEXT); INSERT INTO test_1 VALUES ('a');")
+        self.migration_repository.create_new_table_migration("test_2")
+        self.database_manager.migrate()
+        self.migration_repository.create_baseline(version=1, contents=self.database_manager.dump_baseline(
+            version=1, data_tables=["test_1"]))
+
+        self.database_manager.reset()
+        self.migration_repository.create_new_table_migration("test_3")
+        output = []
+        self.database_manager.output = output.append
+        self.database_manager.migrate()
+        self.assertEqual(output, ["Baseline:V01__baseline.sql completed, 2 migrations recorded",
+                                  "Migration:V02__create_table_test_3.sql completed"])
+        self.assertEqual(self.database_manager.execute_fetch("SELECT name FROM test_1;"), ["a"])
+        self.assertEqual([status for version, file_name, status in self.database_manager.verify_migrations()],
+                         ["ok", "ok", "ok"])
+
+    @unittest.skipUnless(shutil.which("pg_dump"), "pg_dump is not installed")
+    def test_migrate_to_version_before_baseline_applies_migrations(self):
+        self.database_manager.provision_database()
+        self.migration_repository.create_new_table_migration("test_1")
+        self.migration_repository.create_new_table_migration("test_2")
+        self.database_manager.migrate()
+        self.migration_repository.create_baseline(version=1, contents=self.database_manager.dump_baseline(version=1))
+
+        self.database_manager.reset()
+        output = []
+        self.database_manager.output = output.append
+        self.database_manager.migrate(to=0)
+        self.assertEqual(output, ["Migration:V00__create_table_test_1.sql completed"])
+        self.assertEqual(self.database_manager.applied_versions(), [0])
+        self.assertEqual(sorted(self.database_manager.list_tables()), ["test_1", "version_migration"])
+
+    # Database History Tests
+
+    def test_migrate_records_timings(self):
+        self.database_manager.provision_database()
+        self.migration_repository.create_new_table_migration("test_1")
+        self.migration_repository.create_new_table_migration("test_2")
+        self.database_manager.upgrade()
+        self.database_manager.migrate(transaction_mode="batch")
+        history = self.database_manager.migration_history()
+        self.assertEqual([(entry.version, entry.migration_file_name) for entry in history],
+                         [(0, "V00__create_table_test_1.sql"), (1, "V01__create_table_test_2.sql")])
+        for entry in history:
+            self.assertGreaterEqual(entry.duration, entry.server_duration)
+            self.assertGreater(entry.server_duration, 0)
+            self.assertEqual(entry.script_bytes, len("CREATE TABLE IF NOT EXISTS test_1 ()"))
+
+    def test_listeners_receive_migration_events(self):
+        self.database_manager.provision_database()
+        self.migration_repository.create_new_table_migration("test_1")
+        self.migration_repository.create_new_table_alteration_migration("test_1_invalid")
+        with open(self.migration_repository.repository_upgrade_path() + "/V01__alter_table_test_1_invalid.sql", "w") as script:
+            script.write("ALTER TABLE missing ADD COLUMN id INTEGER;")
+        events = []
+        self.database_manager.add_listener(events.append)
+        self.assertRaises(Exception, self.database_manager.migrate)
+        self.database_manager.downgrade()
+        self.assertEqual([(event.event, event.direction, event.version) for event in events],
+                         [("begin", "upgrade", 0), ("end", "upgrade", 0),
+                          ("begin", "upgrade", 1), ("failed", "upgrade", 1),
+                          ("begin", "downgrade", 0), ("end", "downgrade", 0)])
+        self.assertIsNotNone(events[3].error)
+        self.assertIsNotNone(events[1].duration)
+
+    # Database Verification Tests
+
+    def test_verify_migrations(self):
+        self.database_manager.provision_database()
+        self.migration_repository.create_new_table_migration("test_1")
+        self.migration_repository.create_new_table_migration("test_2")
+        self.database_manager.migrate()
+        self.assertEqual([status for version, file_name, status in self.database_manager.verify_migrations()],
+                         ["ok", "ok"])
+
+    def test_verify_migrations_detects_modified_scripts(self):
+        self.database_manager.provision_database()
+        self.migration_repository.create_new_table_migration("test_1")
+        self.database_manager.migrate(transaction_mode="batch")
+        self.migration_repository.upgrade_index(checksums=True)
+        with open(self.migration_repository.repository_upgrade_path() + "/V00__create_table_test_1.sql", "a") as script:
+            script.write("\nCREATE TABLE IF NOT EXISTS test_extra ();")
+        self.assertEqual(self.database_manager.verify_migrations(),
+                         [(0, "V00__create_table_test_1.sql", "modified")])
+
+    def test_verify_migrations_detects_modified_data_files(self):
+        self.database_manager.provision_database()
+        self.migration_repository.create_new_table_migration("test_1")
+        with open(self.migration_repository.repository_upgrade_path() + "/V00__create_table_test_1.sql", "w") as script:
+            script.write("CREATE TABLE test_1 (id INTEGER, name TEXT);")
+        self.migration_repository.create_new_data_migration("test_1")
+        with open(self.migration_repository.repository_data_path() + "/test_1.csv", "w") as data_file:
+            data_file.write("id,name\n1,a\n")
+        self.database_manager.migrate()
+        self.assertEqual([status for version, file_name, status in self.database_manager.verify_migrations()],
+                         ["ok", "ok"])
+
+        with open(self.migration_repository.repository_data_path() + "/test_1.csv", "a") as data_file:
+            data_file.write("2,b\n")
+        self.assertEqual(self.database_manager.verify_migrations()[1], (1, "V01__load_test_1.copy", "modified"))
+
     # Database Reset Tests
 
+    def test_plan_migrations(self):
+        self.database_manager.provision_database()
+        self.migration_repository.create_new_table_migration("test_1")
+        self.migration_repository.create_new_table_alteration_migration("version_migration")
+        with open(self.migration_repository.repository_upgrade_path() + "/V01__alter_table_version_migration.sql", "w") as script:
+            script.write("ALTER TABLE version_migration ALTER COLUMN version TYPE BIGINT;")
+        plans = self.database_manager.plan_migrations()
+        self.assertEqual([plan.migration_file_name for plan in plans],
+                         ["V00__create_table_test_1.sql", "V01__alter_table_version_migration.sql"])
+        self.assertEqual(plans[0].risk(), "none")
+        self.assertEqual(plans[1].statements[0].lock, "ACCESS EXCLUSIVE")
+        self.assertIsNotNone(plans[1].statements[0].statistics)
+
     def test_reset_runs_multiple_migrations(self):
         self.database_manager.provision_database()
         self.migration_repository.create_new_table_migration("test_1")
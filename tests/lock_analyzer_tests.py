@@ -0,0 +1,66 @@
+import unittest
+
+from stickshift.lock_analyzer import classify_statement, classify_migration, plan_migrations, TableStatistics, \
+    script_tables, \
+    LOCK_ACCESS_EXCLUSIVE, LOCK_SHARE, LOCK_SHARE_UPDATE_EXCLUSIVE, LOCK_SHARE_ROW_EXCLUSIVE, LOCK_ROW_EXCLUSIVE, \
+    COST_CATALOG, COST_SCAN, COST_REWRITE, RISK_NONE, RISK_LOW, RISK_HIGH
+
+LARGE_TABLE = TableStatistics(rows=10000000, heap_bytes=2 * 1024 * 1024 * 1024, total_bytes=3 * 1024 * 1024 * 1024)
+
+
+class LockAnalyzerTests(unittest.TestCase):
+
+    def assertClassified(self, statement, table, lock, cost):
+        targets = classify_statement(statement)
+        self.assertEqual(len(targets), 1)
+        self.assertEqual((targets[0].table, targets[0].lock, targets[0].cost), (table, lock, cost))
+
+    def test_classify_alter_table(self):
+        self.assertClassified("ALTER TABLE users ADD COLUMN name TEXT;", "users", LOCK_ACCESS_EXCLUSIVE, COST_CATALOG)
+        self.assertClassified("ALTER TABLE users ADD COLUMN token UUID DEFAULT gen_random_uuid();",
+                              "users", LOCK_ACCESS_EXCLUSIVE, COST_REWRITE)
+        self.assertClassified("ALTER TABLE users ALTER COLUMN id TYPE BIGINT;", "users", LOCK_ACCESS_EXCLUSIVE,
+                              COST_REWRITE)
+        self.assertClassified("ALTER TABLE users ALTER COLUMN name SET NOT NULL;", "users", LOCK_ACCESS_EXCLUSIVE,
+                              COST_SCAN)
+        self.assertClassified("ALTER TABLE ONLY users ADD CONSTRAINT fk FOREIGN KEY (team_id) REFERENCES teams(id) "
+                              "NOT VALID;", "users", LOCK_SHARE_ROW_EXCLUSIVE, COST_CATALOG)
+
+    def test_classify_alter_table_takes_strongest_action(self):
+        self.assertClassified("ALTER TABLE users ADD COLUMN name TEXT, ALTER COLUMN id TYPE BIGINT;",
+                              "users", LOCK_ACCESS_EXCLUSIVE, COST_REWRITE)
+
+    def test_classify_indexes(self):
+        self.assertClassified("CREATE INDEX users_name ON users (name);", "users", LOCK_SHARE, COST_SCAN)
+        self.assertClassified("CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS users_name ON users (name);",
+                              "users", LOCK_SHARE_UPDATE_EXCLUSIVE, COST_SCAN)
+
+    def test_classify_ignores_comments_and_literals(self):
+        self.assertClassified("-- ALTER TABLE teams ADD COLUMN a TEXT;\nINSERT INTO users VALUES ('ALTER TABLE x');",
+                              "users", LOCK_ROW_EXCLUSIVE, COST_CATALOG)
+        self.assertEqual(classify_statement("CREATE FUNCTION f() RETURNS VOID AS $$ TRUNCATE users; $$ LANGUAGE sql;"),
+                         [])
+
+    def test_plan_risk(self):
+        classified = [("V00__alter_table_users.sql", classify_migration(["ALTER TABLE users ADD COLUMN a TEXT;"])),
+                      ("V01__alter_table_users.sql", classify_migration(["ALTER TABLE users ALTER COLUMN id TYPE BIGINT;"]))]
+        plans = plan_migrations(classified, {"users": LARGE_TABLE})
+        self.assertEqual([plan.risk() for plan in plans], [RISK_LOW, RISK_HIGH])
+        self.assertGreater(plans[1].seconds(), 1.0)
+
+    def test_plan_treats_tables_created_in_plan_as_new(self):
+        classified = [("V00__create_table_users.sql", classify_migration(["CREATE TABLE users (id INTEGER);",
+                                                                          "INSERT INTO users VALUES (1);",
+                                                                          "INSERT INTO users VALUES (2);",
+                                                                          "ALTER TABLE users ALTER COLUMN id TYPE BIGINT;"]))]
+        plans = plan_migrations(classified, {})
+        self.assertEqual(plans[0].risk(), RISK_NONE)
+        self.assertEqual([statement.count for statement in plans[0].statements], [1, 2, 1])
+
+    def test_script_tables(self):
+        self.assertEqual(script_tables(["CREATE TABLE Orders (id INTEGER REFERENCES public.users);",
+                                        'INSERT INTO "Audit" SELECT * FROM orders JOIN items ON true;',
+                                        "ALTER TABLE orders RENAME TO purchases;"]),
+                         {"orders", "users", "Audit", "items", "purchases"})
+        self.assertEqual(script_tables(["-- Nothing but a comment"]), set())
+        self.assertIsNone(script_tables(["CREATE INDEX ON users (id);", "CREATE VIEW active AS SELECT 1;"]))
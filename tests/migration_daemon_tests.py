@@ -0,0 +1,83 @@
+import threading
+import unittest
+
+from click.testing import CliRunner
+
+from stickshift import daemon_client
+from stickshift.cli import cli
+from stickshift.cli_strings import CLIStrings
+from stickshift.database_manager import DatabaseManager
+from stickshift.migration_daemon import MigrationDaemon
+from stickshift.migration_repository import MigrationRepository
+
+
+class MigrationDaemonTests(unittest.TestCase):
+
+    def setUp(self):
+        self.migration_repository = MigrationRepository()
+        self.migration_repository.clear()
+        self.migration_repository.create_repository()
+        self.database_manager = DatabaseManager(migration_repository=self.migration_repository,
+                                                environment="DATABASE")
+        self.daemon = MigrationDaemon(migration_repository=MigrationRepository())
+        self.daemon_thread = threading.Thread(target=self.daemon.serve_forever)
+        self.daemon_thread.start()
+        self.daemon.serving.wait()
+        self.runner = CliRunner()
+
+    def tearDown(self):
+        self.daemon.shutdown()
+        self.daemon_thread.join()
+        if self.database_manager.is_database_provisioned():
+            self.database_manager.reset()
+            self.database_manager.deprovision_database()
+        self.migration_repository.clear()
+
+    def test_request(self):
+        response = daemon_client.request(operation="provision", environment="DATABASE")
+        self.assertEqual(response["exit_code"], 0)
+        self.assertEqual(response["stderr"].rstrip(), CLIStrings.DB_DATABASE_PROVISIONED_SUCCESSFULLY)
+        self.assertTrue(self.database_manager.is_database_provisioned())
+
+    def test_request_with_invalid_environment(self):
+        response = daemon_client.request(operation="version", environment="INVALID")
+        self.assertEqual(response["exit_code"], 1)
+        self.assertIn("InvalidEnvironmentError", response["stderr"])
+
+    def test_cli_uses_daemon(self):
+        self.runner.invoke(cli, ["db", "provision", "DATABASE"])
+        self.runner.invoke(cli, ["new", "table", "test"])
+        result = self.runner.invoke(cli, ["db", "migrate", "DATABASE"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(result.output.rstrip(), "Migration:V00__create_table_test.sql completed")
+
+        result = self.runner.invoke(cli, ["db", "version", "DATABASE"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(result.output.rstrip(), "{0}: {1}".format(CLIStrings.DB_DATABASE_VERSION, 0))
+        self.assertEqual(len(self.daemon.pools), 1)
+
+    def test_request_with_other_database_config(self):
+        database_config = dict(self.migration_repository.database_config("DATABASE"), database="elsewhere")
+        response = daemon_client.request(operation="provision", environment="DATABASE",
+                                         database_config=database_config)
+        self.assertIsNone(response)
+        self.assertFalse(self.database_manager.is_database_provisioned())
+
+        response = daemon_client.request(operation="provision", environment="DATABASE",
+                                         database_config=self.migration_repository.database_config("DATABASE"))
+        self.assertEqual(response["exit_code"], 0)
+
+    def test_request_with_engine_without_pools(self):
+        with open(self.migration_repository.repository_database_config_path(), "a") as config_file:
+            config_file.write("\n[LOCAL]\nengine: sqlite\ndatabase:\n")
+        self.assertIsNone(daemon_client.request(operation="version", environment="LOCAL"))
+
+    def test_pool_rebuilt_when_database_config_changes(self):
+        database_config = self.migration_repository.database_config("DATABASE")
+        pool = self.daemon.environment_pool("DATABASE", database_config)
+        self.assertIs(self.daemon.environment_pool("DATABASE", dict(database_config)), pool)
+
+        changed_pool = self.daemon.environment_pool("DATABASE", dict(database_config, database="elsewhere"))
+        self.assertIsNot(changed_pool, pool)
+        self.assertTrue(pool.retired)
+        self.assertIs(self.daemon.pools["DATABASE"], changed_pool)
@@ -0,0 +1,69 @@
+import time
+import threading
+import unittest
+
+from stickshift.migration_graph import InvalidDependencyError, MigrationScheduler, build_migration_graph
+
+
+def migration_list(count, start=0):
+    return ["V{0:02d}__step.sql".format(version) for version in range(start, start + count)]
+
+
+class MigrationGraphTests(unittest.TestCase):
+
+    def test_infer_dependencies_from_tables(self):
+        migrations = migration_list(5)
+        tables = dict(zip(migrations, [{"users"}, {"orders"}, {"users", "orders"}, None, {"items"}]))
+        graph = build_migration_graph(migrations, {}, tables)
+        self.assertEqual(graph.dependencies, {"V00__step.sql": set(),
+                                              "V01__step.sql": set(),
+                                              "V02__step.sql": {"V00__step.sql", "V01__step.sql"},
+                                              "V03__step.sql": {"V02__step.sql"},
+                                              "V04__step.sql": {"V03__step.sql"}})
+
+    def test_declared_dependencies(self):
+        migrations = migration_list(4, start=10)
+        tables = dict(zip(migrations, [{"users"}, None, {"users"}, {"users"}]))
+        graph = build_migration_graph(migrations, {"V11__step.sql": [], "V12__step.sql": [10, 7]}, tables,
+                                      applied_versions=[7])
+        self.assertEqual(graph.dependencies["V11__step.sql"], set())
+        self.assertEqual(graph.dependencies["V12__step.sql"], {"V10__step.sql"})
+        self.assertEqual(graph.dependencies["V13__step.sql"], {"V11__step.sql", "V12__step.sql"})
+        self.assertRaises(InvalidDependencyError, build_migration_graph, migrations, {"V11__step.sql": [12]}, tables)
+        self.assertRaises(InvalidDependencyError, build_migration_graph, migrations, {"V13__step.sql": [8]}, tables)
+
+    def test_scheduler_records_as_migrations_finish(self):
+        migrations = migration_list(4)
+        graph = build_migration_graph(migrations, {}, dict((name, {name}) for name in migrations))
+        running = []
+        overlapped = []
+
+        def apply(worker, migration_file_name):
+            running.append(migration_file_name)
+            # Newer migrations finish first, and are recorded without waiting for the older ones.
+            time.sleep(0.02 * (len(migrations) - len(running)))
+            overlapped.append(len(running))
+
+        scheduler = MigrationScheduler(graph, workers=4)
+        self.assertEqual(scheduler.run(apply), migrations)
+        self.assertEqual(scheduler.recorded, list(reversed(migrations)))
+        self.assertEqual(max(overlapped), 4)
+
+    def test_scheduler_stops_at_failure(self):
+        migrations = migration_list(4)
+        graph = build_migration_graph(migrations, {}, dict(zip(migrations, [{"a"}, {"b"}, {"a"}, {"c"}])))
+        started = []
+        lock = threading.Lock()
+
+        def apply(worker, migration_file_name):
+            with lock:
+                started.append(migration_file_name)
+            if migration_file_name == "V00__step.sql":
+                time.sleep(0.05)
+                raise ValueError(migration_file_name)
+
+        scheduler = MigrationScheduler(graph, workers=2)
+        self.assertRaises(ValueError, scheduler.run, apply)
+        # V02 waits for V00, which failed, and nothing else is started once it failed.
+        self.assertEqual(scheduler.recorded, ["V01__step.sql", "V03__step.sql"])
+        self.assertNotIn("V02__step.sql", started)
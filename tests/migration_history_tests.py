@@ -0,0 +1,35 @@
+import unittest
+
+from stickshift.migration_history import HistoryEntry, can_time_query, describe_bytes, slowest_migrations, \
+    compare_histories, describe_history_totals
+
+
+class MigrationHistoryTests(unittest.TestCase):
+
+    def test_can_time_query(self):
+        self.assertTrue(can_time_query("ALTER TABLE users ADD COLUMN name TEXT;"))
+        self.assertTrue(can_time_query("CREATE TABLE concurrently_loaded ();"))
+        self.assertFalse(can_time_query("-- cleanup\nVACUUM users;"))
+        self.assertFalse(can_time_query("CREATE UNIQUE INDEX CONCURRENTLY users_name_idx ON users (name);"))
+        self.assertFalse(can_time_query("DROP DATABASE scratch;"))
+
+    def test_describe_bytes(self):
+        self.assertEqual(describe_bytes(None), "-")
+        self.assertEqual(describe_bytes(512), "512 B")
+        self.assertEqual(describe_bytes(3 * 1024 * 1024), "3.0 MB")
+
+    def test_slowest_migrations(self):
+        history = [HistoryEntry(0, "V00__a.sql", 1.5, 1.2, 10, 0),
+                   HistoryEntry(1, "V01__b.sql", None, None, None, 0),
+                   HistoryEntry(2, "V02__c.sql", 4.0, None, 20, 0)]
+        self.assertEqual([entry.version for entry in slowest_migrations(history, limit=5)], [2, 0])
+        self.assertEqual(slowest_migrations(history)[0].describe(), "V2 V02__c.sql: 4.000s (server -, 20 B)")
+        self.assertEqual(describe_history_totals(history), "3 migrations, 2 timed, 5.500s (server 1.200s)")
+
+    def test_compare_histories(self):
+        histories = [("SHARD_1", [HistoryEntry(0, "V00__a.sql", 1.0, 1.0, 10, 0),
+                                  HistoryEntry(1, "V01__b.sql", 2.0, 2.0, 10, 0)]),
+                     ("SHARD_2", [HistoryEntry(0, "V00__a.sql", 3.0, 3.0, 10, 0)])]
+        self.assertEqual(compare_histories(histories),
+                         ["V0 V00__a.sql: SHARD_1 1.000s, SHARD_2 3.000s",
+                          "V1 V01__b.sql: SHARD_1 2.000s, SHARD_2 -"])
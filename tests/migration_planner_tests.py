@@ -0,0 +1,52 @@
+import unittest
+
+from stickshift.migration_manifest import MigrationIndex
+from stickshift.migration_planner import InvalidOutOfOrderPolicyError, DuplicateMigrationVersionError, plan_upgrade, \
+    plan_downgrade
+
+
+def migration_index(versions):
+    return MigrationIndex([[version, "step", "V{0:02d}__step.sql".format(version), 0, 0.0, None]
+                           for version in versions])
+
+
+class MigrationPlannerTests(unittest.TestCase):
+
+    def test_plan_upgrade_of_new_database(self):
+        plan = plan_upgrade(migration_index([0, 1, 2]), [])
+        self.assertEqual(plan.pending, ["V00__step.sql", "V01__step.sql", "V02__step.sql"])
+        self.assertEqual(plan.out_of_order, [])
+        self.assertIsNone(plan.newest_version)
+
+    def test_plan_upgrade_with_gaps(self):
+        plan = plan_upgrade(migration_index([0, 3, 7, 9]), [0, 3, 5])
+        self.assertEqual(plan.pending, ["V07__step.sql", "V09__step.sql"])
+        self.assertEqual(plan.unknown, [5])
+
+    def test_plan_upgrade_out_of_order_policies(self):
+        index = migration_index([0, 1, 2, 3])
+        plan = plan_upgrade(index, [0, 2], policy="warn")
+        self.assertEqual(plan.pending, ["V03__step.sql"])
+        self.assertEqual(plan.skipped(), ["V01__step.sql"])
+        plan = plan_upgrade(index, [0, 2], policy="apply")
+        self.assertEqual(plan.pending, ["V01__step.sql", "V03__step.sql"])
+        self.assertEqual(plan.out_of_order, ["V01__step.sql"])
+        self.assertEqual(plan.skipped(), [])
+        self.assertRaises(InvalidOutOfOrderPolicyError, plan_upgrade, index, [0], policy="sometimes")
+
+    def test_plan_upgrade_keeps_interrupted_versions_pending(self):
+        plan = plan_upgrade(migration_index([0, 1, 2, 3]), [0, 2], policy="error", interrupted_versions=[1, 2])
+        self.assertEqual(plan.pending, ["V01__step.sql", "V03__step.sql"])
+        self.assertEqual(plan.out_of_order, [])
+
+    def test_plan_upgrade_refuses_duplicate_versions(self):
+        index = MigrationIndex([[version, name, "V{0:02d}__{1}.sql".format(version, name), 0, 0.0, None]
+                                for version, name in [(4, "c"), (5, "a"), (5, "b")]])
+        for applied_versions in [[4], [4, 5]]:
+            with self.assertRaises(DuplicateMigrationVersionError) as context:
+                plan_upgrade(index, applied_versions)
+            self.assertEqual(str(context.exception), "V05__a.sql and V05__b.sql share version 5, renumber one of them")
+
+    def test_plan_downgrade_only_applied_versions(self):
+        self.assertEqual(plan_downgrade(migration_index([0, 1, 2, 3]), [0, 2, 3]),
+                         ["V03__step.sql", "V02__step.sql", "V00__step.sql"])
@@ -1,6 +1,9 @@
+import os
+import hashlib
 import unittest
 
-from stickshift.migration_repository import MigrationRepository, InvalidEnvironmentError, InvalidDatabaseFieldError, find_migration_index
+from stickshift.migration_repository import MigrationRepository, InvalidEnvironmentError, InvalidDatabaseFieldError, find_migration_index, \
+    InvalidEnvironmentGroupError, parse_migration_version
 
 
 class MigrationRepositoryTests(unittest.TestCase):
@@ -45,6 +48,45 @@ class MigrationRepositoryTests(unittest.TestCase):
         assert(self.migration_repository.current_migration_count() == 1)
         assert(self.migration_repository.current_migrations_list() == ["V00__create_sp_test.sql"])
 
+    def test_index_creation_migration(self):
+        self.migration_repository.create_repository()
+        self.migration_repository.create_new_index_migration("test", ["name", "email"])
+        assert(self.migration_repository.current_migrations_list() == ["V00__create_index_test_name_email_idx.sql"])
+        assert(self.migration_repository.current_downgrade_list() == ["V00__drop_index_test_name_email_idx.sql"])
+        with open(self.migration_repository.repository_upgrade_path() + "/V00__create_index_test_name_email_idx.sql") as script:
+            self.assertEqual(script.read(), "-- stickshift: no-transaction\n"
+                                            "CREATE INDEX CONCURRENTLY IF NOT EXISTS test_name_email_idx ON test (name, email);\n")
+
+    def test_latest_baseline(self):
+        self.migration_repository.create_repository()
+        self.assertIsNone(self.migration_repository.latest_baseline())
+        self.migration_repository.create_baseline(version=3, contents="CREATE TABLE test ();")
+        self.migration_repository.create_baseline(version=12, contents="CREATE TABLE test ();")
+        self.assertEqual(self.migration_repository.latest_baseline(), (12, "V12__baseline.sql"))
+
+    def test_fingerprint_changes_with_migrations(self):
+        self.migration_repository.create_repository()
+        self.migration_repository.create_new_table_migration("test")
+        fingerprint = self.migration_repository.fingerprint()
+        self.assertEqual(self.migration_repository.fingerprint(), fingerprint)
+        with open(self.migration_repository.repository_upgrade_path() + "/V00__create_table_test.sql", "a") as script:
+            script.write("\nCREATE TABLE IF NOT EXISTS test_extra ();")
+        self.assertNotEqual(self.migration_repository.fingerprint(), fingerprint)
+
+    def test_fingerprint_keeps_data_file_checksums(self):
+        self.migration_repository.create_repository()
+        self.migration_repository.create_new_data_migration("test")
+        path = self.migration_repository.repository_data_path() + "/test.csv"
+        with open(path, "w") as data_file:
+            data_file.write("1,a\n")
+        fingerprint = self.migration_repository.fingerprint()
+        # An unchanged file is not hashed again, so a checksum changed in the manifest is used as it is.
+        self.migration_repository.manifest.data["files"][path][2] = "cached"
+        self.assertNotEqual(self.migration_repository.fingerprint(), fingerprint)
+        with open(path, "w") as data_file:
+            data_file.write("1,ab\n")
+        self.assertNotIn("cached", self.migration_repository.manifest.file_checksums([path]))
+
     def test_migration_count(self):
         self.migration_repository.create_repository()
         self.migration_repository.create_new_table_migration("test")
@@ -76,3 +118,64 @@ class MigrationRepositoryTests(unittest.TestCase):
     def test_database_config_with_invalid_database_fields(self):
         self.migration_repository.create_repository()
         self.failUnlessRaises(InvalidDatabaseFieldError, self.migration_repository.database_config, environment="DATABASE", database_fields=["invalid"])
+
+    def test_environment_group(self):
+        self.migration_repository.create_repository()
+        with open(self.migration_repository.repository_database_config_path(), 'a') as config_file:
+            config_file.write("\n[SHARDS]\nmembers: DATABASE,\n    host=localhost dbname=shard\ncanary: DATABASE\nconcurrency: 2\n")
+        assert(self.migration_repository.is_environment_group("SHARDS"))
+        assert(not self.migration_repository.is_environment_group("DATABASE"))
+        group = self.migration_repository.environment_group("SHARDS")
+        assert(group["members"] == ["DATABASE", "host=localhost dbname=shard"])
+        assert(group["canary"] == ["DATABASE"])
+        assert(group["concurrency"] == 2)
+        assert(group["on_error"] == "fail-fast")
+        assert(self.migration_repository.target_database_config("host=localhost dbname=shard") == {"dsn": "host=localhost dbname=shard"})
+
+    def test_environment_group_with_invalid_canary(self):
+        self.migration_repository.create_repository()
+        with open(self.migration_repository.repository_database_config_path(), 'a') as config_file:
+            config_file.write("\n[SHARDS]\nmembers: DATABASE\ncanary: MISSING\n")
+        self.assertRaises(InvalidEnvironmentGroupError, self.migration_repository.environment_group, "SHARDS")
+
+    def test_database_config_is_parsed_once_until_changed(self):
+        self.migration_repository.create_repository()
+        path = self.migration_repository.repository_database_config_path()
+        os.utime(path, (os.stat(path).st_mtime - 10, os.stat(path).st_mtime - 10))
+        config = self.migration_repository.read_database_config()
+        assert(self.migration_repository.read_database_config() is config)
+        with open(path, 'a') as config_file:
+            config_file.write("workers: 4\n")
+        assert(self.migration_repository.read_database_config() is not config)
+        assert(self.migration_repository.environment_setting("DATABASE", "workers") == "4")
+
+    def test_migration_manifest_is_written(self):
+        self.migration_repository.create_repository()
+        self.migration_repository.create_new_table_migration("test")
+        self.migration_repository.current_migrations_list()
+        assert(os.path.exists(self.migration_repository.repository_manifest_path()))
+        cached_repository = MigrationRepository()
+        assert(cached_repository.current_migrations_list() == ["V00__create_table_test.sql"])
+
+    def test_migration_manifest_ignores_unversioned_files(self):
+        self.migration_repository.create_repository()
+        self.migration_repository.create_new_table_migration("test")
+        open(self.migration_repository.repository_upgrade_path() + "/.DS_Store", "a").close()
+        assert(self.migration_repository.current_migrations_list() == ["V00__create_table_test.sql"])
+
+    def test_migration_index_orders_by_version(self):
+        self.migration_repository.create_repository()
+        for i in range(0, 11):
+            self.migration_repository.create_new_table_migration("test_{0}".format(i))
+        index = self.migration_repository.upgrade_index()
+        assert(list(index.versions) == list(range(0, 11)))
+        assert(index.file_name_for_version(10) == "V10__create_table_test_10.sql")
+        assert(index.file_name_for_version(11) is None)
+        assert(index.file_names_after(8) == ["V09__create_table_test_9.sql", "V10__create_table_test_10.sql"])
+        assert(parse_migration_version("V10__create_table_test_10.sql") == 10)
+
+    def test_migration_index_checksums(self):
+        self.migration_repository.create_repository()
+        self.migration_repository.create_new_table_migration("test")
+        index = self.migration_repository.upgrade_index(checksums=True)
+        assert(index.entries[0][5] == hashlib.sha256(b"CREATE TABLE IF NOT EXISTS test ()").hexdigest())
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from stickshift.schema_catalog import SchemaSnapshot, InvalidSnapshotError, diff_snapshots, save_snapshot, \
+    load_snapshot, read_schema_snapshot, QUERY_CATALOG_TABLES, QUERY_CATALOG_COLUMNS, QUERY_CATALOG_INDEXES
+
+
+def snapshot(columns, indexes=None, functions=None, kind="r"):
+    return SchemaSnapshot(tables={"orders": {"kind": kind, "rows": 10, "bytes": 8192, "columns": columns}},
+                          indexes=indexes, functions=functions)
+
+
+class SchemaCatalogTests(unittest.TestCase):
+
+    def test_diff_snapshots(self):
+        old = snapshot({"id": "integer NOT NULL", "total": "integer"},
+                       indexes={"orders_total_idx": {"table": "orders", "valid": True, "bytes": 0,
+                                                     "definition": "CREATE INDEX orders_total_idx ON orders (total)"}},
+                       functions={"total(integer)": "a"})
+        new = snapshot({"id": "integer NOT NULL", "total": "bigint", "note": "text DEFAULT ''::text"},
+                       indexes={"orders_total_idx": {"table": "orders", "valid": False, "bytes": 0,
+                                                     "definition": "CREATE INDEX orders_total_idx ON orders (total)"}},
+                       functions={"total(integer)": "b", "note()": "c"})
+        self.assertEqual(diff_snapshots(old, new),
+                         ["+ column orders.note",
+                          "~ column orders.total: integer -> bigint",
+                          "~ index orders_total_idx: CREATE INDEX orders_total_idx ON orders (total) -> "
+                          "CREATE INDEX orders_total_idx ON orders (total) INVALID",
+                          "+ function note()",
+                          "~ function total(integer)"])
+        self.assertEqual(diff_snapshots(old, snapshot({}, kind="v")), ["~ table orders: table -> view",
+                                                                      "- column orders.id",
+                                                                      "- column orders.total",
+                                                                      "- index orders_total_idx",
+                                                                      "- function total(integer)"])
+
+    def test_sizes_are_not_compared(self):
+        old = snapshot({"id": "integer"})
+        new = snapshot({"id": "integer"})
+        new.tables["orders"]["rows"] = 1000
+        self.assertEqual(diff_snapshots(old, new), [])
+        self.assertEqual(new.describe_tables(), ["orders: 1000 rows, 8.0 KB"])
+
+    def test_read_schema_snapshot(self):
+        rows = {QUERY_CATALOG_TABLES: [("orders", "r", None, 16384)],
+                QUERY_CATALOG_COLUMNS: [("orders", "id", "integer", True, None),
+                                        ("orders", "note", "text", False, "''::text")],
+                QUERY_CATALOG_INDEXES: []}
+        read = read_schema_snapshot(lambda query: iter(rows.get(query, [])), environment="LOCAL", version=3)
+        self.assertEqual(read.tables["orders"]["columns"], {"id": "integer NOT NULL", "note": "text DEFAULT ''::text"})
+        self.assertEqual(read.describe(), "1 tables, 0 indexes, 0 functions, 16.0 KB")
+        self.assertEqual(read.describe_tables(), ["orders: - rows, 16.0 KB"])
+
+    def test_save_and_load_snapshot(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "LOCAL.json")
+            saved = snapshot({"id": "integer"}, functions={"total(integer)": "a"})
+            saved.version = 4
+            save_snapshot(saved, path)
+            loaded = load_snapshot(path)
+            self.assertEqual(loaded.version, 4)
+            self.assertEqual(diff_snapshots(saved, loaded), [])
+            with open(path, "w") as snapshot_file:
+                snapshot_file.write("{}")
+            self.assertRaises(InvalidSnapshotError, load_snapshot, path)
+            self.assertRaises(InvalidSnapshotError, load_snapshot, os.path.join(directory, "missing.json"))
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,43 @@
+import shutil
+import tempfile
+import unittest
+
+from stickshift.migration_repository import MigrationRepository
+from stickshift.schema_gate import SCHEMA_UP_TO_DATE, SCHEMA_BEHIND, SCHEMA_AHEAD, LOCAL_FINGERPRINTS, \
+    compare_fingerprints, local_fingerprint
+
+
+class SchemaGateTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.migration_repository = MigrationRepository(directory=self.directory)
+        self.migration_repository.create_repository()
+        self.migration_repository.create_new_table_migration("test_1")
+
+    def tearDown(self):
+        LOCAL_FINGERPRINTS.pop(self.directory, None)
+        shutil.rmtree(self.directory)
+
+    def test_compare_fingerprints(self):
+        self.assertEqual(compare_fingerprints(("a", 2), ("a", 2)), SCHEMA_UP_TO_DATE)
+        self.assertEqual(compare_fingerprints(("a", 2), None), SCHEMA_BEHIND)
+        self.assertEqual(compare_fingerprints(("a", 2), (None, 1)), SCHEMA_BEHIND)
+        self.assertEqual(compare_fingerprints(("a", 2), ("b", 2)), SCHEMA_BEHIND)
+        self.assertEqual(compare_fingerprints(("a", 2), ("b", 3)), SCHEMA_AHEAD)
+        self.assertEqual(compare_fingerprints(("a", None), (None, 0)), SCHEMA_AHEAD)
+
+    def test_local_fingerprint_is_computed_once(self):
+        fingerprint = local_fingerprint(self.directory)
+        self.assertEqual(fingerprint, self.migration_repository.current_fingerprint())
+        self.assertEqual(fingerprint[1], 0)
+        self.migration_repository.create_new_table_migration("test_2")
+        self.assertEqual(local_fingerprint(self.directory), fingerprint)
+
+    def test_local_fingerprint_reads_saved_fingerprint(self):
+        self.assertIsNone(self.migration_repository.saved_fingerprint())
+        saved = self.migration_repository.save_fingerprint()
+        self.migration_repository.create_new_table_migration("test_2")
+        self.assertNotEqual(self.migration_repository.current_fingerprint(), saved)
+        self.assertEqual(self.migration_repository.saved_fingerprint(), saved)
+        self.assertEqual(local_fingerprint(self.directory), saved)
@@ -0,0 +1,28 @@
+import unittest
+
+from stickshift.script_directives import parse_script_directives, InvalidDirectiveError
+
+
+class ScriptDirectivesTests(unittest.TestCase):
+
+    def test_parse_directives(self):
+        directives = parse_script_directives("-- Adds a column\n"
+                                             "-- stickshift: lock_timeout=200ms, statement_timeout = 5min\n"
+                                             "\n"
+                                             "-- stickshift: no-transaction\n"
+                                             "ALTER TABLE users ADD COLUMN name TEXT;\n"
+                                             "-- stickshift: lock_timeout=1s\n")
+        self.assertEqual(directives, {"lock_timeout": "200ms", "statement_timeout": "5min", "no-transaction": True})
+
+    def test_parse_directives_without_header(self):
+        self.assertEqual(parse_script_directives("CREATE TABLE users ();"), {})
+
+    def test_parse_invalid_timeout(self):
+        self.assertRaises(InvalidDirectiveError, parse_script_directives, "-- stickshift: lock_timeout='1s'; DROP")
+
+    def test_parse_dependencies(self):
+        directives = parse_script_directives("-- stickshift: depends=V03, depends=7\n"
+                                             "-- stickshift: depends=v12\n")
+        self.assertEqual(directives, {"depends": [3, 7, 12]})
+        self.assertRaises(InvalidDirectiveError, parse_script_directives, "-- stickshift: depends")
+        self.assertRaises(InvalidDirectiveError, parse_script_directives, "-- stickshift: depends=users")
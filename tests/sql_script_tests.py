@@ -0,0 +1,41 @@
+import io
+import hashlib
+import unittest
+
+from stickshift.sql_script import ScriptReader, StatementLexer, split_statements
+
+SCRIPT = "-- header; comment\n" \
+         "CREATE TABLE a (x text DEFAULT 'a;b''c');\n" \
+         "/* block ; /* nested ; */ still */ INSERT INTO a VALUES (E'it\\'s;');\n" \
+         "CREATE OR REPLACE FUNCTION sp_x() RETURNS void AS $$\nBEGIN PERFORM 1; END; $$ LANGUAGE plpgsql;\n" \
+         "CREATE FUNCTION f() RETURNS text AS $body$ select 'x;$$;' $body$ LANGUAGE sql;\n" \
+         "SELECT \"we;ird\" FROM a$b$c;\n" \
+         ";;\n" \
+         "SELECT 1 - 2 / 3\n" \
+         "-- trailing\n"
+
+
+class SQLScriptTests(unittest.TestCase):
+
+    def test_split_statements(self):
+        statements = split_statements(SCRIPT)
+        self.assertEqual(len(statements), 6)
+        self.assertEqual("".join(statements), SCRIPT)
+        self.assertTrue(statements[2].endswith("END; $$ LANGUAGE plpgsql;"))
+        self.assertTrue(statements[3].endswith("$body$ LANGUAGE sql;"))
+
+    def test_split_statements_without_code(self):
+        self.assertEqual(split_statements("-- nothing here;\n/* or here; */"), [])
+
+    def test_split_statements_is_independent_of_chunk_size(self):
+        statements = split_statements(SCRIPT)
+        for chunk_size in range(1, 32):
+            reader = ScriptReader(io.BytesIO(SCRIPT.encode("utf-8")), chunk_size=chunk_size)
+            self.assertEqual(list(StatementLexer(reader.read)), statements)
+
+    def test_script_reader_checksum(self):
+        contents = u"SELECT 'é';".encode("utf-8")
+        reader = ScriptReader(io.BytesIO(contents), chunk_size=1)
+        self.assertEqual(list(StatementLexer(reader.read)), [u"SELECT 'é';"])
+        self.assertEqual(reader.checksum(), hashlib.sha256(contents).hexdigest())
+        self.assertEqual(reader.bytes_read, len(contents))
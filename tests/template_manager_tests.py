@@ -0,0 +1,80 @@
+import unittest
+
+from stickshift.migration_repository import MigrationRepository
+from stickshift.database_manager import DatabaseManager, quote_identifier
+from stickshift.template_manager import TemplateManager, DatabaseAlreadyExistsError, database_config_for, \
+    QUERY_DROP_DATABASE
+
+
+class TemplateManagerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.migration_repository = MigrationRepository()
+        self.migration_repository.clear()
+        self.migration_repository.create_repository()
+        self.output = []
+        self.template_manager = TemplateManager(migration_repository=self.migration_repository,
+                                                environment="DATABASE",
+                                                output=self.output.append)
+        self.clones = []
+
+    def tearDown(self):
+        with self.template_manager.connection.cursor() as cursor:
+            for name in self.clones:
+                cursor.execute(QUERY_DROP_DATABASE.format(quote_identifier(name)))
+        for template in self.template_manager.list_templates():
+            self.template_manager.drop_template(template)
+        self.template_manager.close()
+        self.migration_repository.clear()
+
+    def clone(self, name):
+        self.clones.append(name)
+        return self.template_manager.clone(name)
+
+    def clone_database_manager(self, name):
+        return DatabaseManager(migration_repository=self.migration_repository,
+                               environment="DATABASE",
+                               database_config=database_config_for(self.template_manager.database_config, name),
+                               output=self.output.append)
+
+    def test_clone_creates_migrated_database(self):
+        self.migration_repository.create_new_table_migration("test_1")
+        self.migration_repository.create_new_table_migration("test_2")
+        template = self.clone("stickshift_clone_1")
+        database_manager = self.clone_database_manager("stickshift_clone_1")
+        try:
+            self.assertEqual(database_manager.current_database_migration_version(), 1)
+            self.assertEqual(len(database_manager.list_tables()), 3)
+        finally:
+            database_manager.close()
+        self.assertEqual(self.template_manager.list_templates(), [template])
+        self.assertIn("Template:{0} built".format(template), self.output)
+
+    def test_clone_reuses_template(self):
+        self.migration_repository.create_new_table_migration("test_1")
+        template = self.clone("stickshift_clone_1")
+        del self.output[:]
+        self.assertEqual(self.clone("stickshift_clone_2"), template)
+        self.assertEqual(self.output, ["Database:stickshift_clone_2 created from {0}".format(template)])
+
+    def test_clone_rebuilds_and_prunes_template_when_migrations_change(self):
+        self.migration_repository.create_new_table_migration("test_1")
+        stale_template = self.clone("stickshift_clone_1")
+        self.migration_repository.create_new_table_migration("test_2")
+        template = self.clone("stickshift_clone_2")
+        self.assertNotEqual(template, stale_template)
+        self.assertIn("Template:{0} dropped".format(stale_template), self.output)
+        self.assertEqual(self.template_manager.list_templates(), [template])
+
+    def test_clone_existing_database(self):
+        self.assertRaises(DatabaseAlreadyExistsError, self.template_manager.clone,
+                          self.template_manager.database_name())
+
+    def test_failed_template_build_is_dropped(self):
+        self.migration_repository.create_new_table_alteration_migration("missing")
+        with open(self.migration_repository.repository_upgrade_path() + "/V00__alter_table_missing.sql", "w") as script:
+            script.write("ALTER TABLE missing ADD COLUMN id INTEGER;")
+        template = self.template_manager.template_name()
+        self.assertRaises(Exception, self.clone, "stickshift_clone_1")
+        self.assertIsNone(self.template_manager.database_is_template(template))
+        self.assertIsNone(self.template_manager.database_is_template("stickshift_clone_1"))